@@ -209,10 +209,12 @@ class AbsoluteTimeTrack():
         """
         Asssumes that the given track is the return value of getNoteMessagesAbsTrack.
         Randomly offset the velocities of the note messages in the track.
-        TODO: test me
+        Velocities are clamped to the midi range, and note_ons are kept above 0 so that they do not turn into note_offs.
         """
         newTrack = copy.deepcopy(noteTrack)
         for am in newTrack:
             if isinstance(am.msg, mido.Message):
-                am.msg.velocity += random.randrange(-maxOffset, maxOffset+1)
+                velocity = am.msg.velocity + random.randrange(-maxOffset, maxOffset+1)
+                lowest = 1 if am.msg.type == 'note_on' and am.msg.velocity > 0 else 0
+                am.msg.velocity = min(127, max(lowest, velocity))
         return newTrack
\ No newline at end of file
@@ -1,16 +1,47 @@
+import copy
 import os
+import threading
 import mido
 
 from midiUtils.constants import *
-from midiUtils import tools
+from midiUtils.cache import hashKey, hashBytes
+from midiUtils.eventTrack import EventTrack, readSmfBytes
+from midiUtils.seedIndex import SeedIndex, VoiceFeatureIndex
+from midiUtils.sampling import AliasTable
 
-from typing import List
+import numpy as np
+
+from typing import Dict, List, Tuple
 from collections import Counter
 
 class AugSeedExample:
-    def __init__(self, midi_path, style):
+    def __init__(self, midi_path, style, voiceEvents: Dict[str, EventTrack]=None, ticksPerBeat: int=None, contentHash: str=None):
+        """
+        If voiceEvents (voice to EventTrack), ticksPerBeat and contentHash are given, the midi file is not read,
+        and these tracks are returned as they are by getVoiceEvents (see sharedPool.py).
+        contentHash is the hash of the bytes the tracks were parsed from (see cache.hashBytes).
+        """
         self.midi_path = midi_path
         self.style = style
+        if voiceEvents is not None:
+            self._events = None
+            self._voiceEvents = voiceEvents
+            self.ticksPerBeat = ticksPerBeat
+            self.contentHash = contentHash
+        else:
+            # parsed once; voice tracks are extracted from these arrays on demand.
+            # Not memory-mapped, so that a pool does not hold a file open per seed (and seeds can be replaced)
+            with open(midi_path, "rb") as f:
+                data = f.read()
+            try:
+                eventMid = readSmfBytes(data)
+            except EOFError as e:
+                raise EOFError(f"{midi_path}: {e}") from e
+            # hashed from the parsed bytes, so that the pool version matches the tracks even if the file changes later
+            self.contentHash = hashBytes(data)
+            self._events = eventMid.tracks[0]
+            self._voiceEvents = None
+            self.ticksPerBeat = eventMid.ticksPerBeat
         self.voices = self.__getVoices()
         self.filename = self.__getFilename(midi_path)
 
@@ -29,11 +60,15 @@ class AugSeedExample:
         """
         Returns a midi track that contains only the specified voice
         """
-        pitches = PERC_VOICES_MAPPING[voice]
-        mid = mido.MidiFile(self.midi_path)
-        track = mid.tracks[0]
-    
-        return tools.getTrackWithSelectPitches(track, pitches, notesOnly=True)
+        return self.getVoiceEvents(voice).toMidiTrack()
+
+    def getVoiceEvents(self, voice) -> EventTrack:
+        """
+        Returns an EventTrack that contains only the note messages of the specified voice, and the end of track
+        """
+        if self._voiceEvents is not None:
+            return self._voiceEvents.get(voice, EventTrack())
+        return self._events.selectPitches(PERC_VOICES_MAPPING[voice], notesOnly=True)
 
     def getVoice(self, voice) -> mido.MidiTrack:
         """
@@ -47,50 +82,222 @@ class AugSeedExample:
         """
         Returns true if the example has the specified voice
         """
-        track = self.__getVoiceTrack(voice)
-        return not tools.isTrackEmpty(track)
+        if self._voiceEvents is not None:
+            return voice in self._voiceEvents
+        return self._events.hasNoteOn(PERC_VOICES_MAPPING[voice])
 
     def __str__(self) -> str:
         return f'AugExample of style "{self.style}" at midi_path: "{self.midi_path}"'
 
-class SeedExamplesRetriever:
-    def __init__(self, dir):
-        # dir
+def getSeedFileStats(dir) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the (mtime in ns, size) of every midi file in dir, by filename, in directory listing order.
+    """
+    stats = {}
+    for f in os.listdir(dir):
+        if f.endswith(".mid"):
+            try:
+                st = os.stat(f"{dir}/{f}")
+            except FileNotFoundError:
+                # removed since the listing
+                continue
+            stats[f] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+class SeedPool:
+    """
+    The examples and indexes of a SeedExamplesRetriever at one point in time.
+    A pool is never modified once built (except for its lazily built indexes), so that a retriever can swap
+    its whole pool in one assignment when its directory changes.
+    """
+    # the most alias tables a pool caches
+    MAX_SAMPLERS = 4096
+
+    def __init__(self, dir, examples: List[AugSeedExample], fileStats: Dict[str, Tuple[int, int]], dedupe=False, maxDuplicateDistance=0, previous: "SeedPool" = None):
+        """
+        The fingerprints and rhythm features of files whose stats are unchanged since the previous pool are reused,
+        so that a reload only computes them for added and modified files.
+        """
         self.dir = dir
+        self.fileStats = dict(fileStats)
+
+        # per file data, by filename (content hash) or (filename, voice) (fingerprints and features)
+        self.fileHashes = {ae.filename: ae.contentHash for ae in examples}
+        self.fingerprints = {}
+        self.features = {}
+        if previous is not None:
+            unchanged = set(f for f, stat in self.fileStats.items() if previous.fileStats.get(f) == stat)
+            self.fingerprints = {k: v for k, v in previous.fingerprints.items() if k[0] in unchanged}
+            self.features = {k: v for k, v in previous.features.items() if k[0] in unchanged}
+
         # styles
-        styleSet = set()
-        for f in os.listdir(dir):
-            if f.endswith(".mid"):
-                style = f.split("_")[0]
-                styleSet.add(style)
-        self.styles = list(styleSet)
-        if len(self.styles) < 2:
-            raise Exception(f"Must have at least 2 styles in {dir} to construct SeedExamplesRetriever.")
-        
+        self.styles = list(set(ae.style for ae in examples))
         # examples by style dict
-        self._examplesByStyle = {style: [] for style in self.styles}
-        for f in os.listdir(dir):
-            if f.endswith(".mid"):
-                style = f.split("_")[0]
-                augExample = AugSeedExample(midi_path=f"{dir}/{f}", style=style)
-                self._examplesByStyle[style].append(augExample)     
+        self.examplesByStyle = {style: [] for style in self.styles}
+        for ae in examples:
+            self.examplesByStyle[ae.style].append(ae)
+        self.examplesByFilename = {ae.filename: ae for ae in examples}
+
+        # tracks to skip when listing candidates
+        self.seedIndex = None
+        self.redundantTracks = set()
+        if dedupe:
+            self.seedIndex = SeedIndex(examples, maxDistance=maxDuplicateDistance, fingerprintCache=self.fingerprints)
+            self.redundantTracks = self.seedIndex.getRedundantTracks()
+
+        # built on first use
+        self.poolVersion = None
+        self.redundantTracksHash = None
+        self.featureIndex = None
+        # (candidates, alias table) by (preferredStyle, outOfStyle, voicesToExclude), or by candidate set
+        self.samplers = {}
+
+    @staticmethod
+    def load(dir, fileStats: Dict[str, Tuple[int, int]], previous: "SeedPool" = None, dedupe=False, maxDuplicateDistance=0) -> "SeedPool":
+        """
+        Builds the pool of the given files of dir (see getSeedFileStats).
+        Examples whose file stats are unchanged since the previous pool are reused instead of parsed again.
+        """
+        examples = []
+        loadedStats = {}
+        for f, stat in fileStats.items():
+            if previous is not None and previous.fileStats.get(f) == stat:
+                ae = previous.getExample(f)
+            else:
+                try:
+                    ae = AugSeedExample(midi_path=f"{dir}/{f}", style=f.split("_")[0])
+                except (OSError, EOFError, ValueError):
+                    # removed or still being written; left out, so that the next reload retries it
+                    continue
+            examples.append(ae)
+            loadedStats[f] = stat
+        return SeedPool(dir, examples, loadedStats, dedupe, maxDuplicateDistance, previous)
+
+    def getExample(self, filename) -> AugSeedExample:
+        return self.examplesByFilename.get(filename)
+
+    def getAllExamples(self) -> List[AugSeedExample]:
+        return [ae for style in self.styles for ae in self.examplesByStyle[style]]
+
+class SeedExamplesRetriever:
+    STRATA = ("style", "voice", "styleVoice")
+
+    def __init__(self, dir, dedupe=False, maxDuplicateDistance=0, styleWeights: Dict[str, float]=None, voiceWeights: Dict[str, float]=None, stratify: str=None, pool: SeedPool=None):
+        """
+        If pool is given, it is used as is instead of parsing the files of dir (see sharedPool.py).
+
+        If dedupe is True, voice tracks that duplicate another example's track (their onset grids differ in at most
+        maxDuplicateDistance 16th note steps, see SeedIndex) are never returned as candidates.
+
+        By default, candidate tracks are sampled uniformly. styleWeights and voiceWeights (missing keys weigh 1) scale the
+        probability of every track of a style or voice. With stratify ("style", "voice" or "styleVoice"), every stratum
+        is first given the same total probability (times its weights), however many tracks it has.
+        """
+        if stratify is not None and stratify not in self.STRATA:
+            raise ValueError(f"stratify must be one of {self.STRATA} or None, got {stratify}")
+        self.styleWeights = dict(styleWeights) if styleWeights else {}
+        self.voiceWeights = dict(voiceWeights) if voiceWeights else {}
+        self.stratify = stratify
+        self.styleUsage = Counter()
+        self.voiceUsage = Counter()
+
+        # dir
+        self.dir = dir
+        self.dedupe = dedupe
+        self.maxDuplicateDistance = maxDuplicateDistance
+
+        self._reloadLock = threading.Lock()
+        self._stopWatching = None
+        self._watcher = None
+        self.lastReloadError = None
+
+        self._pool = self.__checkPool(pool if pool is not None else SeedPool.load(dir, getSeedFileStats(dir), None, dedupe, maxDuplicateDistance))
+
+    def __checkPool(self, pool: SeedPool) -> SeedPool:
+        if len(pool.styles) < 2:
+            raise Exception(f"Must have at least 2 styles in {self.dir} to construct SeedExamplesRetriever.")
+        return pool
+
+    @property
+    def styles(self) -> List[str]:
+        return self._pool.styles
+
+    @property
+    def seedIndex(self) -> SeedIndex:
+        return self._pool.seedIndex
+
+    def reload(self) -> bool:
+        """
+        Brings the pool up to date with the directory: new and modified files are parsed, removed files are dropped,
+        and unchanged examples are reused, along with their content hashes, fingerprints and rhythm features (keyed by
+        filename, mtime and size), so that only added and modified files are read, hashed and indexed. The new pool
+        replaces the old one in a single assignment, so callers see either the old or the new pool, never a partially
+        built one.
+        Returns True if the pool changed. If the directory would be left with fewer than 2 styles, raises and keeps the old pool.
+        """
+        with self._reloadLock:
+            fileStats = getSeedFileStats(self.dir)
+            if fileStats == self._pool.fileStats:
+                return False
+            newPool = self.__checkPool(SeedPool.load(self.dir, fileStats, self._pool, self.dedupe, self.maxDuplicateDistance))
+            changed = newPool.fileStats != self._pool.fileStats
+            self._pool = newPool
+            return changed
+
+    def startWatching(self, interval: float = 1.0):
+        """
+        Reloads the pool (see reload) every interval seconds, in a daemon thread, until stopWatching is called.
+        A failed reload is stored in lastReloadError, and the previous pool keeps being used.
+        """
+        if self._watcher is not None:
+            return
+        self._stopWatching = threading.Event()
+        def watch(stop):
+            while not stop.wait(interval):
+                try:
+                    self.reload()
+                    self.lastReloadError = None
+                except Exception as e:
+                    self.lastReloadError = e
+        self._watcher = threading.Thread(target=watch, args=(self._stopWatching,), daemon=True)
+        self._watcher.start()
+
+    def stopWatching(self):
+        if self._watcher is None:
+            return
+        self._stopWatching.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def snapshot(self) -> "SeedExamplesRetriever":
+        """
+        Returns a retriever frozen on the current pool, which later reloads do not affect.
+        Sampling weights and usage counters are shared with this retriever.
+        """
+        frozen = copy.copy(self)
+        frozen._reloadLock = threading.Lock()
+        frozen._stopWatching = None
+        frozen._watcher = None
+        return frozen
 
     def getExamplesByStyle(self, style) -> List[AugSeedExample]:
         """
         Returns a list of AugSeedExamples given a style
         """
-        if style not in self.styles:
+        pool = self._pool
+        if style not in pool.styles:
             return []
-        return self._examplesByStyle[style]
+        return pool.examplesByStyle[style]
     
     def getExamplesOutOfStyle(self, style) -> List[AugSeedExample]:
         """
         Returns a list of AugSeedExamples that are not of the specified style
         """
+        pool = self._pool
         outOfStyleExamples = []
-        for s in self.styles:
+        for s in pool.styles:
             if s != style:
-                outOfStyleExamples.extend(self._examplesByStyle[s])
+                outOfStyleExamples.extend(pool.examplesByStyle[s])
         return outOfStyleExamples
     
     def getCandidateTracksInfo(self, preferredStyle: str, outOfStyle: bool, voicesToExclude):
@@ -99,12 +306,18 @@ class SeedExamplesRetriever:
         If outOfStyle is True, the returned tracks will NOT be of the preferred style.
         Any tracks whose voice is in voicesToExclude will be removed from the list.
         """
+        return self.__getCandidateTracksInfo(self._pool, preferredStyle, outOfStyle, voicesToExclude)
 
-        examples = self.getExamplesOutOfStyle(preferredStyle) if outOfStyle else self.getExamplesByStyle(preferredStyle)
+    def __getCandidateTracksInfo(self, pool: SeedPool, preferredStyle: str, outOfStyle: bool, voicesToExclude):
+        if outOfStyle:
+            examples = [ae for s in pool.styles if s != preferredStyle for ae in pool.examplesByStyle[s]]
+        else:
+            examples = pool.examplesByStyle.get(preferredStyle, [])
         trackInfo = []
         for ae in examples:
             for v in ae.voices:
-                trackInfo.append((ae.filename, v))
+                if (ae.filename, v) not in pool.redundantTracks:
+                    trackInfo.append((ae.filename, v))
         
         # remove tracks from voices to exclude
         trimmedTrackInfo = []
@@ -113,17 +326,159 @@ class SeedExamplesRetriever:
                 trimmedTrackInfo.append(ti)
         return trimmedTrackInfo
     
+    def isWeighted(self) -> bool:
+        return bool(self.styleWeights or self.voiceWeights or self.stratify)
+
+    def getSamplingParams(self) -> dict:
+        """
+        Returns the sampling params of the constructor (styleWeights, voiceWeights and stratify).
+        """
+        return {"styleWeights": self.styleWeights, "voiceWeights": self.voiceWeights, "stratify": self.stratify}
+
+    def getSamplingConfig(self) -> dict:
+        """
+        Returns what, besides the seed pool, decides which tracks are drawn: the sampling weights, the dedupe settings,
+        and a hash of the tracks that dedupe skips.
+        """
+        pool = self._pool
+        if pool.redundantTracksHash is None:
+            pool.redundantTracksHash = hashKey(sorted(pool.redundantTracks))
+        return {
+            **self.getSamplingParams(),
+            "dedupe": self.dedupe,
+            "maxDuplicateDistance": self.maxDuplicateDistance,
+            "redundantTracks": pool.redundantTracksHash,
+        }
+
+    def getCandidateWeights(self, candidatesInfo) -> np.ndarray:
+        """
+        Returns the sampling weight of every (filename, voice) candidate (see the constructor).
+        """
+        examples = self._pool.examplesByFilename
+        styles = [examples[f].style for f, _ in candidatesInfo]
+        weights = np.array([self.styleWeights.get(s, 1.0) * self.voiceWeights.get(v, 1.0) for s, (_, v) in zip(styles, candidatesInfo)], dtype=np.float64)
+        if self.stratify is not None:
+            if self.stratify == "style":
+                strata = styles
+            elif self.stratify == "voice":
+                strata = [v for _, v in candidatesInfo]
+            else:
+                strata = [(s, v) for s, (_, v) in zip(styles, candidatesInfo)]
+            counts = Counter(strata)
+            weights /= np.array([counts[s] for s in strata], dtype=np.float64)
+        return weights
+
+    def __getSampler(self, pool: SeedPool, key, candidatesInfo) -> tuple:
+        """
+        Returns the (candidatesInfo, alias table) of a candidate set, built once and cached in the pool under key.
+        The table is None if no candidate has a positive weight.
+        """
+        sampler = pool.samplers.get(key)
+        if sampler is None:
+            weights = self.getCandidateWeights(candidatesInfo) if candidatesInfo else np.zeros(0)
+            table = AliasTable(weights) if weights.sum() > 0 else None
+            sampler = (candidatesInfo, table)
+            if len(pool.samplers) >= SeedPool.MAX_SAMPLERS:
+                # candidate sets of similarity-aware retrieval vary with every target; drop the oldest
+                del pool.samplers[next(iter(pool.samplers))]
+            pool.samplers[key] = sampler
+        return sampler
+
+    def sampleFromCandidates(self, candidatesInfo, rng: np.random.Generator):
+        """
+        Draws one (filename, voice) from a list of candidates, with the configured weights, or returns None if there are
+        no candidates (or none with a positive weight). The alias table of a weighted draw is built once per candidate set.
+        """
+        if not candidatesInfo:
+            return None
+        if not self.isWeighted():
+            filename, voice = rng.choice(candidatesInfo)
+        else:
+            candidatesInfo = [tuple(c) for c in candidatesInfo]
+            _, table = self.__getSampler(self._pool, ("candidates", tuple(candidatesInfo)), candidatesInfo)
+            if table is None:
+                return None
+            filename, voice = candidatesInfo[table.sample(rng)]
+        self.recordUsage(filename, voice)
+        return filename, voice
+
+    def sampleCandidateTrack(self, preferredStyle: str, outOfStyle: bool, voicesToExclude, rng: np.random.Generator):
+        """
+        Draws one (filename, voice) among getCandidateTracksInfo(preferredStyle, outOfStyle, voicesToExclude), or returns None
+        if there are no candidates (or none with a positive weight). Weighted draws use an alias table that is cached per
+        set of arguments, so they take O(1).
+        """
+        if not self.isWeighted():
+            candidatesInfo = self.getCandidateTracksInfo(preferredStyle, outOfStyle, voicesToExclude)
+            return self.sampleFromCandidates(candidatesInfo, rng)
+
+        pool = self._pool
+        key = (preferredStyle, outOfStyle, frozenset(voicesToExclude))
+        sampler = pool.samplers.get(key)
+        if sampler is None:
+            sampler = self.__getSampler(pool, key, self.__getCandidateTracksInfo(pool, preferredStyle, outOfStyle, voicesToExclude))
+        candidatesInfo, table = sampler
+        if table is None:
+            return None
+        filename, voice = candidatesInfo[table.sample(rng)]
+        self.recordUsage(filename, voice)
+        return filename, voice
+
+    def recordUsage(self, filename, voice):
+        self.styleUsage[self.getExampleStyle(filename)] += 1
+        self.voiceUsage[voice] += 1
+
+    def getUsage(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the number and the fraction of sampled tracks per style, e.g. {"songo": {"count": 10, "fraction": 0.5}, ...}.
+        """
+        total = sum(self.styleUsage.values())
+        return {style: {"count": count, "fraction": count / total} for style, count in self.styleUsage.items()}
+
+    def resetUsage(self):
+        self.styleUsage.clear()
+        self.voiceUsage.clear()
+
+    def getPoolVersion(self) -> str:
+        """
+        Returns a hash of the seed pool: the style, filename and contents of every example, as they were parsed.
+        Two retrievers with the same pool version produce the same candidates and tracks.
+        """
+        pool = self._pool
+        if pool.poolVersion is None:
+            contents = []
+            for style in sorted(pool.styles):
+                for ae in sorted(pool.examplesByStyle[style], key=lambda ae: ae.filename):
+                    contents.append((style, ae.filename, pool.fileHashes[ae.filename]))
+            pool.poolVersion = hashKey(contents)
+        return pool.poolVersion
+
+    def getFeatureIndex(self) -> VoiceFeatureIndex:
+        """
+        Returns the rhythm feature index of every voice track in the pool, used for similarity-aware retrieval.
+        """
+        pool = self._pool
+        if pool.featureIndex is None:
+            pool.featureIndex = VoiceFeatureIndex(pool.getAllExamples(), featureCache=pool.features)
+        return pool.featureIndex
+
+    def getExampleStyle(self, filename):
+        """
+        Returns the style of the example with the given filename, or None if there is no such example.
+        """
+        ae = self._pool.getExample(filename)
+        return None if ae is None else ae.style
+
     def getTrack(self, filename, voice):
         """
         Assumes that the filename in the examplesByStyle dict is unique,
         which it should be since every example is a different file in the same directory.
         Returns a midi track containing only the specified voice.
         """
-        for style in self.styles:
-            for ae in self.getExamplesByStyle(style):
-                if ae.filename == filename:
-                    return ae.getVoice(voice)
-        return mido.MidiTrack()
+        ae = self._pool.getExample(filename)
+        if ae is None:
+            return mido.MidiTrack()
+        return ae.getVoice(voice)
 
     def __str__(self) -> str:
         return f'SeedExamplesRetriever with styles {self.styles}, at dir "{self.dir}"'
\ No newline at end of file
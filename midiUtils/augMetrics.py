@@ -0,0 +1,155 @@
+from midiUtils.corpusStats import VOICES, VOICE_OF_PITCH
+from midiUtils.eventTrack import EventMidiFile, readSmfFile
+from midiUtils.manifest import readManifest
+from midiUtils.timing import roundTicks
+
+import mido
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+"""
+How much augmented files differ from their sources, per PERC_VOICES_MAPPING voice:
+- onsetOverlap: the Jaccard index of the source and output onset hit maps (1 when the voice is silent in both)
+- hammingDistance: the number of grid steps whose hit differs between the two hit maps
+- velocityDivergence: the Jensen-Shannon divergence (in bits, from 0 to 1) of the velocity histograms
+Hit maps span every step up to the last onset of the batch's files by default; with a numSteps, they wrap around every
+numSteps steps (as in timing.getOnsetGrid), so that e.g. bars 1 and 3 of a 4-bar file land on the same 2-bar grid and
+hits moved between them go unnoticed.
+Hit maps and velocity histograms are dense (files, voices, steps or bins) arrays, built for many files at once with a
+bincount, so the metrics of thousands of pairs are a few array operations. Every file is read once, however many
+augmentations of it are compared.
+"""
+
+PAIR_METRICS = ["onsetOverlap", "hammingDistance", "velocityDivergence"]
+
+def getFileFeatures(mids: List[Union[mido.MidiFile, EventMidiFile]], stepsPerBeat: int = 4, numSteps: int = None, numVelocityBins: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (files, voices, steps) boolean onset hit maps of all tracks of every file, and their
+    (files, voices, numVelocityBins) velocity histograms. The hit maps are as long as the latest onset of all files
+    (padded with no hits), or numSteps long with onsets wrapped around every numSteps steps.
+    """
+    mids = [m if isinstance(m, EventMidiFile) else EventMidiFile.fromMidiFile(m) for m in mids]
+    tracks = [(i, m.ticksPerBeat, t) for i, m in enumerate(mids) for t in m.tracks if len(t) > 0]
+    numFiles, numVoices = len(mids), len(VOICES)
+    if tracks:
+        files = np.concatenate([np.full(len(t), i) for i, _, t in tracks])
+        ticksPerBeat = np.concatenate([np.full(len(t), tpb, dtype=np.float64) for _, tpb, t in tracks])
+        times = np.concatenate([t.times for _, _, t in tracks])
+        isHit = np.concatenate([t.noteOnMask() & (t.velocities > 0) for _, _, t in tracks])
+        notes = np.concatenate([t.notes for _, _, t in tracks]).astype(np.int64)
+        velocities = np.concatenate([t.velocities for _, _, t in tracks]).astype(np.int64)
+        isHit &= VOICE_OF_PITCH[notes] >= 0
+    else:
+        files = times = notes = velocities = np.zeros(0, dtype=np.int64)
+        ticksPerBeat = np.ones(0)
+        isHit = np.zeros(0, dtype=bool)
+
+    files, voices = files[isHit], VOICE_OF_PITCH[notes[isHit]]
+    steps = roundTicks(times[isHit] * (stepsPerBeat / ticksPerBeat[isHit]))
+    if numSteps is None:
+        numSteps = int(steps.max()) + 1 if len(steps) > 0 else 1
+    else:
+        steps = np.mod(steps, numSteps)
+    bins = (np.clip(velocities[isHit], 1, 127) - 1) * numVelocityBins // 127
+    rows = files * numVoices + voices
+    hitMaps = np.bincount(rows * numSteps + steps, minlength=numFiles * numVoices * numSteps) > 0
+    velocityCounts = np.bincount(rows * numVelocityBins + bins, minlength=numFiles * numVoices * numVelocityBins)
+    return hitMaps.reshape(numFiles, numVoices, numSteps), velocityCounts.reshape(numFiles, numVoices, numVelocityBins)
+
+def padSteps(hitMaps: np.ndarray, numSteps: int) -> np.ndarray:
+    """
+    Pads hit maps with steps without hits, up to numSteps steps.
+    """
+    return np.pad(hitMaps, [(0, 0)] * (hitMaps.ndim - 1) + [(0, numSteps - hitMaps.shape[-1])])
+
+def getOnsetOverlap(hitMaps1: np.ndarray, hitMaps2: np.ndarray) -> np.ndarray:
+    intersection = (hitMaps1 & hitMaps2).sum(axis=-1)
+    union = (hitMaps1 | hitMaps2).sum(axis=-1)
+    return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
+def getHammingDistance(hitMaps1: np.ndarray, hitMaps2: np.ndarray) -> np.ndarray:
+    return (hitMaps1 ^ hitMaps2).sum(axis=-1)
+
+def getVelocityDivergence(velocityCounts1: np.ndarray, velocityCounts2: np.ndarray) -> np.ndarray:
+    """
+    Jensen-Shannon divergence in bits over the last axis: 0 when both histograms are empty, 1 when only one is.
+    """
+    totals1 = velocityCounts1.sum(axis=-1, keepdims=True)
+    totals2 = velocityCounts2.sum(axis=-1, keepdims=True)
+    p = velocityCounts1 / np.maximum(totals1, 1)
+    q = velocityCounts2 / np.maximum(totals2, 1)
+    m = (p + q) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        divergence = (np.where(p > 0, p * np.log2(p / m), 0) + np.where(q > 0, q * np.log2(q / m), 0)).sum(axis=-1) / 2
+    divergence = np.where((totals1[..., 0] == 0) & (totals2[..., 0] == 0), 0.0, divergence)
+    return np.where((totals1[..., 0] == 0) != (totals2[..., 0] == 0), 1.0, divergence)
+
+def comparePairs(sourceFeatures: Tuple[np.ndarray, np.ndarray], outputFeatures: Tuple[np.ndarray, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Returns every metric of PAIR_METRICS as a (pairs, voices) array, from the features (see getFileFeatures) of the
+    sources and outputs of every pair. The shorter hit maps are padded to the length of the longer ones.
+    """
+    sourceHitMaps, sourceVelocities = sourceFeatures
+    outputHitMaps, outputVelocities = outputFeatures
+    numSteps = max(sourceHitMaps.shape[-1], outputHitMaps.shape[-1])
+    sourceHitMaps, outputHitMaps = padSteps(sourceHitMaps, numSteps), padSteps(outputHitMaps, numSteps)
+    return {
+        "onsetOverlap": getOnsetOverlap(sourceHitMaps, outputHitMaps),
+        "hammingDistance": getHammingDistance(sourceHitMaps, outputHitMaps),
+        "velocityDivergence": getVelocityDivergence(sourceVelocities, outputVelocities),
+    }
+
+def compareMidiFiles(source: Union[mido.MidiFile, EventMidiFile], output: Union[mido.MidiFile, EventMidiFile], stepsPerBeat: int = 4, numSteps: int = None, numVelocityBins: int = 8) -> Dict[str, np.ndarray]:
+    """
+    Returns the metrics of a single pair of files in memory, as (voices,) arrays.
+    """
+    hitMaps, velocityCounts = getFileFeatures([source, output], stepsPerBeat, numSteps, numVelocityBins)
+    metrics = comparePairs((hitMaps[:1], velocityCounts[:1]), (hitMaps[1:], velocityCounts[1:]))
+    return {name: values[0] for name, values in metrics.items()}
+
+def _readFileFeatures(paths: List[str], stepsPerBeat: int, numSteps: int, numVelocityBins: int) -> Tuple[np.ndarray, np.ndarray]:
+    return getFileFeatures([readSmfFile(p) for p in paths], stepsPerBeat, numSteps, numVelocityBins)
+
+def computePairMetrics(sourcePaths: List[str], outputPaths: List[str], stepsPerBeat: int = 4, numSteps: int = None, numVelocityBins: int = 8, maxWorkers: int = None, chunkSize: int = 256) -> Dict[str, np.ndarray]:
+    """
+    Returns every metric of PAIR_METRICS as a (pairs, voices) array, for the pairs of sourcePaths[i] and outputPaths[i].
+    Every distinct file is read once, over a process pool (by default, one process per cpu; in this process with
+    maxWorkers=1), in chunks of chunkSize files.
+    """
+    if len(sourcePaths) != len(outputPaths):
+        raise ValueError("Expected as many source paths as output paths")
+    paths, indices = np.unique(np.array([str(p) for p in list(sourcePaths) + list(outputPaths)], dtype=str), return_inverse=True)
+    chunks = [paths[i:i + chunkSize].tolist() for i in range(0, len(paths), chunkSize)]
+    args = [(c, stepsPerBeat, numSteps, numVelocityBins) for c in chunks]
+    if maxWorkers == 1:
+        parts = [_readFileFeatures(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            parts = list(executor.map(_readFileFeatures, *zip(*args))) if args else []
+    numVoices = len(VOICES)
+    # chunks without numSteps are as long as their own latest onset
+    length = max([p[0].shape[-1] for p in parts] + [numSteps or 1])
+    hitMaps = np.concatenate([padSteps(p[0], length) for p in parts]) if parts else np.zeros((0, numVoices, length), dtype=bool)
+    velocityCounts = np.concatenate([p[1] for p in parts]) if parts else np.zeros((0, numVoices, numVelocityBins), dtype=np.int64)
+
+    sources, outputs = indices[:len(sourcePaths)], indices[len(sourcePaths):]
+    return comparePairs((hitMaps[sources], velocityCounts[sources]), (hitMaps[outputs], velocityCounts[outputs]))
+
+def computeManifestMetrics(manifestPath: str, **kwargs) -> Dict[str, np.ndarray]:
+    """
+    computePairMetrics on the source and output files of a manifest (see manifest.py), in row order.
+    The remaining params are passed on to computePairMetrics.
+    """
+    manifest = readManifest(manifestPath, ["sourceFile", "outputFile"])
+    return computePairMetrics(manifest["sourceFile"], manifest["outputFile"], **kwargs)
+
+def getLowDiversityMask(metrics: Dict[str, np.ndarray], minHammingDistance: int = 1, maxOnsetOverlap: float = 1.0) -> np.ndarray:
+    """
+    Returns True for every pair whose output differs from its source (summed over voices) by fewer than
+    minHammingDistance grid steps, or whose mean onset overlap over voices is above maxOnsetOverlap.
+    """
+    hammingDistance = np.asarray(metrics["hammingDistance"])
+    onsetOverlap = np.asarray(metrics["onsetOverlap"])
+    return (hammingDistance.sum(axis=-1) < minHammingDistance) | (onsetOverlap.mean(axis=-1) > maxOnsetOverlap)
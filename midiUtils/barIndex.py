@@ -0,0 +1,253 @@
+from midiUtils.editPipeline import trimEventTrack
+from midiUtils.eventTrack import EventTrack, META_STATUS, SYSEX_STATUS, decodeTrackEvents, iterTrackChunks, readSmfHeader
+
+import mmap
+import os
+import mido
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+"""
+A corpus index for random access to bar windows of midi files.
+For every track of every file, the index stores where each bar starts: the byte offset of the first event at or after
+the bar line, the absolute time and running status in effect there, and which notes are sounding.
+A window of bars is then read by decoding only its own events (plus the track's leading metadata), straight from
+a memory map of the file, instead of parsing the whole file and scanning it from the start.
+Windows are the same as those of tools.trimMidiTrack (see editPipeline.trimEventTrack), hanging notes included.
+Like trimMidiTrack, bars have a fixed length of beatsPerBar beats.
+"""
+
+NO_RUNNING_STATUS = -1
+
+def getRunningStatus(events: np.ndarray) -> np.ndarray:
+    """
+    Returns the running status in effect before each event, and after the last one (NO_RUNNING_STATUS if there is none),
+    as decodeTrackEvents tracks it: channel messages set it, sysex messages clear it, meta messages leave it unchanged.
+    """
+    status = events["status"].astype(np.int64)
+    isChannel = status < 0xF0
+    setsStatus = isChannel | (status == SYSEX_STATUS)
+    lastSetter = np.maximum.accumulate(np.where(setsStatus, np.arange(len(events)), -1))
+    after = np.where((lastSetter >= 0) & isChannel[np.maximum(lastSetter, 0)], status[np.maximum(lastSetter, 0)], NO_RUNNING_STATUS)
+    return np.concatenate([[NO_RUNNING_STATUS], after]).astype(np.int64)
+
+def getActiveNotes(events: np.ndarray, eventIndices: np.ndarray) -> np.ndarray:
+    """
+    Returns, for each index of eventIndices, the notes sounding before that event: an array of 128 channels,
+    -1 for notes that are off. A note_on of velocity 0 turns its note off.
+    """
+    track = EventTrack(events)
+    noteOn, noteOff = track.noteOnMask(), track.noteOffMask()
+    noteIndices = np.flatnonzero(noteOn | noteOff).tolist()
+    noteOn = (noteOn & (track.velocities > 0)).tolist()
+    notes = events["data1"].tolist()
+    channels = (events["status"] & 0x0F).tolist()
+    active = np.full((len(eventIndices), 128), -1, dtype=np.int8)
+    state = [-1] * 128
+    n = 0
+    for row, eventIndex in enumerate(eventIndices.tolist()):
+        while n < len(noteIndices) and noteIndices[n] < eventIndex:
+            i = noteIndices[n]
+            state[notes[i]] = channels[i] if noteOn[i] else -1
+            n += 1
+        active[row] = state
+    return active
+
+def indexTrack(data, start: int, end: int, barTicks: int) -> dict:
+    """
+    Decodes a track chunk at data[start:end] once and returns its bar boundaries. Boundary k is the first event at or
+    after tick k * barTicks; the last boundary closes the bar the last event falls in (a track that ends on a bar line,
+    like a 2-bar clip whose end of track is at tick 2 * barTicks, has no bar after it).
+    """
+    eventOffsets = []
+    events = decodeTrackEvents(data, start, end, eventOffsets=eventOffsets)
+    n = len(events)
+    times = events["time"]
+    offsets = np.array(eventOffsets + [end], dtype=np.int64)
+
+    lastTime = int(times[-1]) if n > 0 else 0
+    numBars = -(-lastTime // barTicks)
+    boundaryTimes = np.arange(numBars + 1, dtype=np.int64) * barTicks
+    first = np.searchsorted(times, boundaryTimes, side="left")
+    runningStatus = getRunningStatus(events)
+
+    # the leading metadata kept by trimMidiTrack (see helpers.getMetaDataAndIndex)
+    isMetaData = (events["status"] == META_STATUS) & (times == 0) & ~EventTrack(events).endOfTrackMask()
+    notMetaData = np.flatnonzero(~isMetaData)
+    metaCount = int(notMetaData[0]) if len(notMetaData) > 0 else n
+
+    # windows that end at (or past) the last boundary take every event up to the end of the track
+    nextOffset = offsets[np.minimum(first + 1, n)]
+    nextOffset[-1] = end
+    return {
+        "chunkStart": start,
+        "chunkEnd": end,
+        "metaEnd": int(offsets[metaCount]),
+        "offset": offsets[first],
+        "nextOffset": nextOffset,
+        "previousTime": np.concatenate([[0], times])[first],
+        "runningStatus": runningStatus[first],
+        "activeNotes": getActiveNotes(events, first),
+    }
+
+class BarIndex:
+    FILE_COLUMNS = ["paths", "sizes", "mtimes", "ticksPerBeat", "firstTrack", "numTracks"]
+    TRACK_COLUMNS = ["chunkStart", "chunkEnd", "metaEnd", "firstBoundary", "numBoundaries"]
+    BOUNDARY_COLUMNS = ["offset", "nextOffset", "previousTime", "runningStatus", "activeNotes"]
+
+    def __init__(self, beatsPerBar: int, arrays: Dict[str, np.ndarray]):
+        """
+        Use build or load. arrays holds the FILE_COLUMNS, TRACK_COLUMNS and BOUNDARY_COLUMNS of the whole corpus:
+        a file's tracks are the rows firstTrack to firstTrack + numTracks of the track columns,
+        and a track's boundaries are the rows firstBoundary to firstBoundary + numBoundaries of the boundary columns.
+        """
+        self.beatsPerBar = beatsPerBar
+        self.arrays = arrays
+        self.fileIndices = {str(p): i for i, p in enumerate(arrays["paths"])}
+
+    @staticmethod
+    def build(midiPaths: List[str], beatsPerBar: int = 4) -> "BarIndex":
+        """
+        Indexes every track of the given files. Files that cannot be decoded are skipped.
+        """
+        files = {column: [] for column in BarIndex.FILE_COLUMNS}
+        tracks = []
+        numTracks = 0
+        for path in midiPaths:
+            path = str(path)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                    stat = os.fstat(f.fileno())
+                _, declaredTracks, ticksPerBeat = readSmfHeader(data)
+                fileTracks = []
+                for start, end in iterTrackChunks(data):
+                    if len(fileTracks) == declaredTracks:
+                        break
+                    fileTracks.append(indexTrack(data, start, end, beatsPerBar * ticksPerBeat))
+            except (OSError, EOFError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+                continue
+
+            files["paths"].append(path)
+            files["sizes"].append(stat.st_size)
+            files["mtimes"].append(stat.st_mtime_ns)
+            files["ticksPerBeat"].append(ticksPerBeat)
+            files["firstTrack"].append(numTracks)
+            files["numTracks"].append(len(fileTracks))
+            tracks.extend(fileTracks)
+            numTracks += len(fileTracks)
+
+        arrays = {column: np.array(values, dtype=np.int64) for column, values in files.items() if column != "paths"}
+        arrays["paths"] = np.array(files["paths"], dtype=np.str_)
+        for column in ["chunkStart", "chunkEnd", "metaEnd"]:
+            arrays[column] = np.array([t[column] for t in tracks], dtype=np.int64)
+        numBoundaries = np.array([len(t["offset"]) for t in tracks], dtype=np.int64)
+        arrays["numBoundaries"] = numBoundaries
+        arrays["firstBoundary"] = np.cumsum(numBoundaries) - numBoundaries
+        for column in BarIndex.BOUNDARY_COLUMNS:
+            parts = [t[column] for t in tracks]
+            if column == "activeNotes":
+                arrays[column] = np.concatenate(parts) if parts else np.zeros((0, 128), dtype=np.int8)
+            else:
+                arrays[column] = np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+        return BarIndex(beatsPerBar, arrays)
+
+    def save(self, path):
+        np.savez(path, beatsPerBar=self.beatsPerBar, **self.arrays)
+
+    @staticmethod
+    def load(path) -> "BarIndex":
+        with np.load(path, allow_pickle=False) as npz:
+            columns = BarIndex.FILE_COLUMNS + BarIndex.TRACK_COLUMNS + BarIndex.BOUNDARY_COLUMNS
+            return BarIndex(int(npz["beatsPerBar"]), {column: npz[column] for column in columns})
+
+    def getPaths(self) -> List[str]:
+        return self.arrays["paths"].tolist()
+
+    def __fileIndex(self, file) -> int:
+        return file if isinstance(file, (int, np.integer)) else self.fileIndices[str(file)]
+
+    def __trackRow(self, file, trackIndex: int) -> int:
+        fileIndex = self.__fileIndex(file)
+        if not 0 <= trackIndex < self.arrays["numTracks"][fileIndex]:
+            raise ValueError(f"{self.arrays['paths'][fileIndex]} has no track {trackIndex}")
+        return int(self.arrays["firstTrack"][fileIndex]) + trackIndex
+
+    def __boundaryRow(self, trackRow: int, bar: int) -> int:
+        if bar < 0:
+            raise ValueError("bars must be non-negative")
+        # bars past the end of the track all start at its end
+        return int(self.arrays["firstBoundary"][trackRow]) + min(bar, int(self.arrays["numBoundaries"][trackRow]) - 1)
+
+    def getNumBars(self, file, trackIndex: int = 0) -> int:
+        """
+        Returns the number of bars of a track, up to its last event.
+        """
+        return int(self.arrays["numBoundaries"][self.__trackRow(file, trackIndex)]) - 1
+
+    def getActiveNotes(self, file, bar: int, trackIndex: int = 0) -> np.ndarray:
+        """
+        Returns the notes sounding at the start of a bar: the channel of every note that is on, -1 for notes that are off.
+        """
+        return self.arrays["activeNotes"][self.__boundaryRow(self.__trackRow(file, trackIndex), bar)]
+
+    def getWindow(self, file, startBar: int, endBar: int, trackIndex: int = 0) -> EventTrack:
+        """
+        Returns bars startBar to endBar (excluded) of a track, the same as tools.trimMidiTrack would.
+        file is a path or the index of a file in getPaths. The file must not have changed since it was indexed.
+        The returned track's payload references a memory map of the file.
+        """
+        fileIndex = self.__fileIndex(file)
+        trackRow = self.__trackRow(fileIndex, trackIndex)
+        path = str(self.arrays["paths"][fileIndex])
+        stat = os.stat(path)
+        if stat.st_size != self.arrays["sizes"][fileIndex] or stat.st_mtime_ns != self.arrays["mtimes"][fileIndex]:
+            raise ValueError(f"{path} has changed since it was indexed")
+
+        a = self.arrays
+        barTicks = self.beatsPerBar * int(a["ticksPerBeat"][fileIndex])
+        start = self.__boundaryRow(trackRow, startBar)
+        end = self.__boundaryRow(trackRow, max(startBar, endBar))
+        with open(path, "rb") as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                data = f.read()
+
+        parts = []
+        if startBar > 0:
+            # the leading metadata, which trimMidiTrack keeps in every window but the first
+            parts.append(decodeTrackEvents(data, int(a["chunkStart"][trackRow]), int(a["metaEnd"][trackRow])))
+        runningStatus = int(a["runningStatus"][start])
+        # the window's events, and the first event after it, which decides how hanging notes are timed
+        parts.append(decodeTrackEvents(data, int(a["offset"][start]), int(a["nextOffset"][end]), int(a["previousTime"][start]), None if runningStatus == NO_RUNNING_STATUS else runningStatus))
+        window = EventTrack(np.concatenate(parts), data)
+        return trimEventTrack(window, startBar * barTicks, endBar * barTicks, keepMetaData=startBar != 0)
+
+    def getWindowMidiTrack(self, file, startBar: int, endBar: int, trackIndex: int = 0) -> mido.MidiTrack:
+        return self.getWindow(file, startBar, endBar, trackIndex).toMidiTrack()
+
+    def sampleWindow(self, rng: np.random.Generator, numBars: int = 2, trackIndex: int = 0) -> Tuple[str, int, EventTrack]:
+        """
+        Returns a random window of numBars bars: the path of its file, its first bar and its events.
+        Windows are drawn uniformly among all windows (starting at a bar line, within a track) of all files
+        that have the track.
+        """
+        a = self.arrays
+        fileIndices = np.flatnonzero(a["numTracks"] > trackIndex)
+        if len(fileIndices) == 0:
+            raise ValueError(f"No file has a track {trackIndex}")
+        numWindows = np.maximum(a["numBoundaries"][a["firstTrack"][fileIndices] + trackIndex] - numBars, 1)
+        k = int(rng.integers(numWindows.sum()))
+        position = int(np.searchsorted(np.cumsum(numWindows), k, side="right"))
+        startBar = k - int(numWindows[:position].sum())
+        fileIndex = int(fileIndices[position])
+        return str(a["paths"][fileIndex]), startBar, self.getWindow(fileIndex, startBar, startBar + numBars, trackIndex)
+
+    def __len__(self):
+        return len(self.arrays["paths"])
+
+    def __str__(self) -> str:
+        return f"BarIndex of {len(self)} files, {len(self.arrays['chunkStart'])} tracks and {len(self.arrays['offset'])} bar boundaries"
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from typing import Dict, Optional
+
+"""
+A small content-addressed disk cache.
+Each entry is a directory named after its key, holding one or more files.
+Entries are written to a temporary directory and renamed into place, so readers never see partial entries.
+When maxBytes is set, the least recently used entries (by directory mtime, refreshed on every hit) are evicted.
+The cache's size is scanned once, then kept up to date with the entries this instance stores; the directory is only
+scanned again when that total goes over maxBytes, and eviction then goes down to EVICT_FRACTION of maxBytes, so that
+a sweep of puts does not list the whole cache on every put. Entries stored by other processes count from the next scan.
+"""
+
+# the fraction of maxBytes a cache over budget is evicted down to
+EVICT_FRACTION = 0.9
+
+def hashKey(*parts) -> str:
+    """
+    Returns a sha256 hex digest of the given parts.
+    bytes are hashed as they are; anything else is hashed through its (sorted) JSON representation.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            data = bytes(part)
+        else:
+            data = json.dumps(part, sort_keys=True, default=str).encode()
+        # length prefix so that ("ab", "c") and ("a", "bc") hash differently
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+def hashBytes(data) -> str:
+    """
+    Returns the sha256 hex digest of bytes, the same as hashFile of a file with these contents.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def hashFile(path) -> str:
+    """
+    Returns the sha256 hex digest of a file's contents.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class DiskCache:
+    def __init__(self, dir, maxBytes: Optional[int] = None):
+        self.dir = str(dir)
+        self.maxBytes = maxBytes
+        os.makedirs(self.dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        # the total size as of the last scan, plus the entries stored since (None until the first scan)
+        self._totalBytes = None
+
+    def _entryDir(self, key: str) -> str:
+        return f"{self.dir}/{key}"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the directory of the entry with the given key, or None on a miss.
+        A hit marks the entry as recently used.
+        """
+        entryDir = self._entryDir(key)
+        if not os.path.isdir(entryDir):
+            self.misses += 1
+            return None
+        try:
+            os.utime(entryDir)
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entryDir
+
+    def put(self, key: str, files: Dict[str, bytes]) -> str:
+        """
+        Stores the given files (filename to contents) under key, and returns the entry's directory.
+        If the entry already exists, it is left as is. Eviction never removes the entry just stored, even if it is
+        larger than maxBytes on its own.
+        """
+        entryDir = self._entryDir(key)
+        if os.path.isdir(entryDir):
+            return entryDir
+
+        tmpDir = f"{self.dir}/.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmpDir)
+        for filename, data in files.items():
+            with open(f"{tmpDir}/{filename}", "wb") as f:
+                f.write(data)
+        try:
+            os.rename(tmpDir, entryDir)
+        except OSError:
+            # another writer stored the same entry first
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            return entryDir
+
+        if self.maxBytes is not None:
+            if self._totalBytes is None:
+                self._totalBytes = self.size()
+            else:
+                self._totalBytes += sum(len(data) for data in files.values())
+            if self._totalBytes > self.maxBytes:
+                self._totalBytes = self.evict(int(self.maxBytes * EVICT_FRACTION), keep=key)
+        return entryDir
+
+    def putFile(self, key: str, filename: str, sourcePath) -> str:
+        """
+        Like put, for a single file that already exists on disk.
+        """
+        with open(sourcePath, "rb") as f:
+            return self.put(key, {filename: f.read()})
+
+    def _entries(self):
+        """
+        Returns a list of (mtime, size, entryDir) for every entry in the cache.
+        """
+        entries = []
+        for key in os.listdir(self.dir):
+            if key.startswith("."):
+                continue
+            entryDir = self._entryDir(key)
+            try:
+                size = sum(os.path.getsize(f"{entryDir}/{f}") for f in os.listdir(entryDir))
+                entries.append((os.path.getmtime(entryDir), size, entryDir))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def size(self) -> int:
+        """
+        Returns the total size of all entries in bytes.
+        """
+        return sum(e[1] for e in self._entries())
+
+    def evict(self, maxBytes: int, keep: str = None) -> int:
+        """
+        Removes least recently used entries (except the entry of key keep) until the cache holds at most maxBytes.
+        Returns the size of the remaining entries.
+        """
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        keepDir = self._entryDir(keep) if keep is not None else None
+        for _, size, entryDir in entries:
+            if total <= maxBytes:
+                break
+            if entryDir == keepDir:
+                continue
+            shutil.rmtree(entryDir, ignore_errors=True)
+            total -= size
+        return total
+
+    def clear(self):
+        for key in os.listdir(self.dir):
+            shutil.rmtree(self._entryDir(key), ignore_errors=True)
+        self._totalBytes = None
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __str__(self) -> str:
+        return f'DiskCache at "{self.dir}" with {len(self)} entries'
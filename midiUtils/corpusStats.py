@@ -0,0 +1,231 @@
+from midiUtils.constants import *
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.eventTrack import EventTrack, readSmfFile
+from midiUtils.manifest import iterManifestChunks
+from midiUtils.timing import roundTicks
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List
+
+"""
+Per-style, per-voice statistics of a drum corpus (the seed pool, or augmented outputs): hit counts, hit densities,
+velocity histograms and onset grid distributions.
+Voices are those of PERC_VOICES_MAPPING. Every statistic is a count, kept in arrays indexed by style and voice,
+so stats are updated by adding files (each file's hits are counted with a few bincounts) and merged by adding arrays.
+Files are identified by a key (their path or seed filename); a file that was already counted is skipped, so a corpus
+can be updated with only its new files, and the partial stats of parallel workers can be merged.
+"""
+
+VOICES = list(PERC_VOICES_MAPPING)
+# the voice index of every pitch, -1 for pitches of no voice
+VOICE_OF_PITCH = np.full(128, -1, dtype=np.int64)
+for _i, _voice in enumerate(VOICES):
+    VOICE_OF_PITCH[PERC_VOICES_MAPPING[_voice]] = _i
+
+class CorpusStats:
+    ARRAYS = ["files", "beats", "voiceFiles", "hits", "velocities", "onsets"]
+
+    def __init__(self, stepsPerBeat: int = 4, numSteps: int = 32):
+        """
+        Onsets are counted on a grid of stepsPerBeat steps per beat, wrapped around every numSteps steps
+        (2 bars of 16th notes in 4/4 by default, like seedIndex's fingerprints).
+        """
+        self.stepsPerBeat = stepsPerBeat
+        self.numSteps = numSteps
+        self.styles = []
+        self.keys = set()
+        numVoices = len(VOICES)
+        # one row per style
+        self.files = np.zeros(0, dtype=np.int64)
+        self.beats = np.zeros(0, dtype=np.float64)
+        self.voiceFiles = np.zeros((0, numVoices), dtype=np.int64)
+        self.hits = np.zeros((0, numVoices), dtype=np.int64)
+        self.velocities = np.zeros((0, numVoices, 128), dtype=np.int64)
+        self.onsets = np.zeros((0, numVoices, numSteps), dtype=np.int64)
+
+    def __styleRow(self, style: str) -> int:
+        style = str(style)
+        if style not in self.styles:
+            self.styles.append(style)
+            for name in CorpusStats.ARRAYS:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros((1,) + array.shape[1:], dtype=array.dtype)]))
+        return self.styles.index(style)
+
+    def addTracks(self, key: str, style: str, tracks: List[EventTrack], ticksPerBeat: int) -> bool:
+        """
+        Counts the hits of the tracks of one file. Returns False (and counts nothing) if key was already counted.
+        """
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        row = self.__styleRow(style)
+        numVoices = len(VOICES)
+
+        tracks = [t for t in tracks if len(t) > 0]
+        times = np.concatenate([t.times for t in tracks]) if tracks else np.zeros(0, dtype=np.int64)
+        isHit = np.concatenate([t.noteOnMask() & (t.velocities > 0) for t in tracks]) if tracks else np.zeros(0, dtype=bool)
+        notes = np.concatenate([t.notes for t in tracks])[isHit] if tracks else np.zeros(0, dtype=np.int64)
+        velocities = np.concatenate([t.velocities for t in tracks])[isHit] if tracks else np.zeros(0, dtype=np.int64)
+        voices = VOICE_OF_PITCH[notes.astype(np.int64)]
+        inVoice = voices >= 0
+        voices = voices[inVoice]
+        velocities = velocities[inVoice].astype(np.int64)
+        steps = np.mod(roundTicks(times[isHit][inVoice] * (self.stepsPerBeat / ticksPerBeat)), self.numSteps)
+
+        hits = np.bincount(voices, minlength=numVoices)
+        self.files[row] += 1
+        self.beats[row] += (times.max() if len(times) > 0 else 0) / ticksPerBeat
+        self.voiceFiles[row] += hits > 0
+        self.hits[row] += hits
+        self.velocities[row] += np.bincount(voices * 128 + velocities, minlength=numVoices * 128).reshape(numVoices, 128)
+        self.onsets[row] += np.bincount(voices * self.numSteps + steps, minlength=numVoices * self.numSteps).reshape(numVoices, self.numSteps)
+        return True
+
+    def addFile(self, path: str, style: str, key: str = None) -> bool:
+        """
+        Counts the hits of every track of a midi file. key defaults to the path.
+        """
+        eventMid = readSmfFile(path)
+        return self.addTracks(str(path) if key is None else key, style, eventMid.tracks, eventMid.ticksPerBeat)
+
+    def addFiles(self, paths: Iterable[str], styles: Iterable[str]) -> int:
+        """
+        Counts the files that were not counted yet. Returns how many were added.
+        """
+        return sum(self.addFile(path, style) for path, style in zip(paths, styles) if str(path) not in self.keys)
+
+    def addRetriever(self, ser: SeedExamplesRetriever) -> int:
+        """
+        Counts the seed examples of a retriever (keyed by filename) that were not counted yet. Returns how many were added.
+        """
+        added = 0
+        for style in ser.styles:
+            for ae in ser.getExamplesByStyle(style):
+                if ae.filename not in self.keys:
+                    added += self.addTracks(ae.filename, ae.style, [ae.getVoiceEvents(v) for v in ae.voices], ae.ticksPerBeat)
+        return added
+
+    def addManifest(self, manifestPath: str) -> int:
+        """
+        Counts the augmented outputs of a manifest (see manifest.py) that were not counted yet, under their preferred style.
+        """
+        added = 0
+        for chunk in iterManifestChunks(manifestPath, ["outputFile", "preferredStyle"]):
+            added += self.addFiles(chunk["outputFile"], chunk["preferredStyle"])
+        return added
+
+    def merge(self, *others: "CorpusStats") -> "CorpusStats":
+        """
+        Returns the stats of this corpus and the others. Raises a ValueError if they use other grids or share files.
+        """
+        merged = CorpusStats(self.stepsPerBeat, self.numSteps)
+        for stats in (self,) + others:
+            if (stats.stepsPerBeat, stats.numSteps) != (self.stepsPerBeat, self.numSteps):
+                raise ValueError("Cannot merge stats of different onset grids")
+            shared = merged.keys & stats.keys
+            if shared:
+                raise ValueError(f"Cannot merge stats that share {len(shared)} files, e.g. {sorted(shared)[0]}")
+            for i, style in enumerate(stats.styles):
+                row = merged.__styleRow(style)
+                for name in CorpusStats.ARRAYS:
+                    getattr(merged, name)[row] += getattr(stats, name)[i]
+            merged.keys |= stats.keys
+        return merged
+
+    def getDensities(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the hits per beat of every voice of every style.
+        """
+        densities = self.hits / np.maximum(self.beats, 1e-9)[:, None]
+        return {style: dict(zip(VOICES, densities[i].tolist())) for i, style in enumerate(self.styles)}
+
+    def getVelocityHistogram(self, style: str = None, voice: str = None, numBins: int = 8) -> np.ndarray:
+        """
+        Returns the velocity counts in numBins bins of equal width over 0 to 127, for a style and voice
+        (or summed over all styles or voices when None).
+        """
+        if 128 % numBins != 0:
+            raise ValueError("numBins must divide 128")
+        counts = self.__select(self.velocities, style, voice)
+        return counts.reshape(numBins, 128 // numBins).sum(axis=1)
+
+    def getOnsetDistribution(self, style: str = None, voice: str = None) -> np.ndarray:
+        """
+        Returns the fraction of hits on every step of the onset grid, for a style and voice (or all styles or voices when None).
+        """
+        counts = self.__select(self.onsets, style, voice)
+        total = counts.sum()
+        return counts / total if total > 0 else counts.astype(np.float64)
+
+    def __select(self, array: np.ndarray, style: str, voice: str) -> np.ndarray:
+        if style is not None:
+            if style not in self.styles:
+                raise ValueError(f"Unknown style {style}")
+            array = array[self.styles.index(style)][None]
+        array = array.sum(axis=0)
+        return array[VOICES.index(voice)] if voice is not None else array.sum(axis=0)
+
+    def getSummary(self) -> Dict[str, dict]:
+        """
+        Returns the number of files and beats of every style, and the hits and share of files of each of its voices.
+        """
+        summary = {}
+        for i, style in enumerate(self.styles):
+            files = int(self.files[i])
+            summary[style] = {
+                "files": files,
+                "beats": float(self.beats[i]),
+                "hits": dict(zip(VOICES, self.hits[i].tolist())),
+                "voiceFileShare": dict(zip(VOICES, (self.voiceFiles[i] / max(files, 1)).tolist())),
+            }
+        return summary
+
+    def save(self, path):
+        np.savez(
+            path,
+            stepsPerBeat=self.stepsPerBeat,
+            numSteps=self.numSteps,
+            styles=np.array(self.styles, dtype=np.str_),
+            keys=np.array(sorted(self.keys), dtype=np.str_),
+            **{name: getattr(self, name) for name in CorpusStats.ARRAYS},
+        )
+
+    @staticmethod
+    def load(path) -> "CorpusStats":
+        with np.load(path, allow_pickle=False) as npz:
+            stats = CorpusStats(int(npz["stepsPerBeat"]), int(npz["numSteps"]))
+            stats.styles = npz["styles"].tolist()
+            stats.keys = set(npz["keys"].tolist())
+            for name in CorpusStats.ARRAYS:
+                setattr(stats, name, npz[name])
+        return stats
+
+    def __str__(self) -> str:
+        return f"CorpusStats of {len(self.keys)} files in {len(self.styles)} styles"
+
+def _computeStats(paths: List[str], styles: List[str], stepsPerBeat: int, numSteps: int) -> CorpusStats:
+    stats = CorpusStats(stepsPerBeat, numSteps)
+    stats.addFiles(paths, styles)
+    return stats
+
+def computeStats(paths: List[str], styles: List[str], stats: CorpusStats = None, maxWorkers: int = None, chunkSize: int = 256) -> CorpusStats:
+    """
+    Counts files over a process pool (by default, one process per cpu; in this process with maxWorkers=1),
+    in chunks of chunkSize files, and merges the partial stats. If stats are given, only the files they do not count
+    yet are read, and the result includes them.
+    """
+    stats = stats if stats is not None else CorpusStats()
+    pending = [(str(p), str(s)) for p, s in zip(paths, styles) if str(p) not in stats.keys]
+    # a file listed twice is counted once
+    pending = list(dict(pending).items())
+    chunks = [pending[i:i + chunkSize] for i in range(0, len(pending), chunkSize)]
+    args = [([p for p, _ in c], [s for _, s in c], stats.stepsPerBeat, stats.numSteps) for c in chunks]
+    if maxWorkers == 1:
+        partials = [_computeStats(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            partials = list(executor.map(_computeStats, *zip(*args))) if args else []
+    return stats.merge(*partials)
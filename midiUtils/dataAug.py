@@ -1,14 +1,23 @@
 from midiUtils.constants import *
-from midiUtils import tools
+from midiUtils.editPipeline import EditPipeline
 from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.manifest import ManifestWriter
+from midiUtils.cache import DiskCache, hashKey
+from midiUtils.eventTrack import BatchMidiWriter, EventTrack
+from midiUtils.seedIndex import getRhythmFeatures
+from midiUtils.augMetrics import compareMidiFiles
 from typing import List, Tuple
 
 import mido
 import copy
+import io
+import json
+import os
+import zlib
 import numpy as np
 
             
-def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int, ser: SeedExamplesRetriever, rng: np.random.Generator, preferredStyle=None, outOfStyleProb=0.0, channel=9, debug=False) -> Tuple[mido.MidiFile, List[Tuple[str, str]]]:
+def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int, ser: SeedExamplesRetriever, rng: np.random.Generator, preferredStyle=None, outOfStyleProb=0.0, channel=9, debug=False, cache: DiskCache=None, similarityTopK=None) -> Tuple[mido.MidiFile, List[Tuple[str, str]]]:
     """
     Transforms a midi file by probably replacing the specified voices with voices from the given style;
     otherwise replaces with voices from a different style.
@@ -23,6 +32,10 @@ def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int,
     - outOfStyleProb: the probability of choosing a voice from a different style than the preferred style
     - channel: the channel to which the transformed track will be collapsed
     - debug: if True, prints debug information
+    - cache: if specified, results are looked up in and stored to this cache (see getTransformCacheKey).
+      On a hit, rng is advanced to the state it would have after computing the transformation.
+    - similarityTopK: if specified, each replacement is chosen among the similarityTopK candidates whose rhythm is closest
+      to the voice it replaces in the original track (see getTargetFeatures), instead of among all candidates
     return: the transformed midi file and the replacement info (for each replacement track, the filename and the voice that was replaced)
     """
     if numReplacements > len(PERC_VOICES_MAPPING):
@@ -30,11 +43,37 @@ def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int,
     if numReplacements < 1:
         raise ValueError("numReplacements must be at least 1")
 
+    # the whole transformation sees the same seed pool, even if ser is reloaded in the meantime
+    ser = ser.snapshot()
+
+    if cache is not None:
+        cacheKey = getTransformCacheKey(mid, trackIndex, numReplacements, ser, rng, preferredStyle, outOfStyleProb, channel, similarityTopK)
+        entryDir = cache.get(cacheKey)
+        cachedMid = None
+        if entryDir is not None:
+            try:
+                with open(f"{entryDir}/info.json") as f:
+                    info = json.load(f)
+                cachedMid = mido.MidiFile(f"{entryDir}/output.mid")
+            except FileNotFoundError:
+                # evicted by another process in the meantime
+                pass
+        if cachedMid is not None:
+            if debug:
+                print(f"Cache hit for key {cacheKey}")
+            rng.bit_generator.state = info["rngState"]
+            replacementInfo = [tuple(x) for x in info["replacementInfo"]]
+            for filename, voice in replacementInfo:
+                ser.recordUsage(filename, voice)
+            return cachedMid, replacementInfo
+
     originalTrack = mid.tracks[trackIndex]
 
     if preferredStyle == None:
         preferredStyle = rng.choice(ser.styles)
-        
+
+    targetFeatures = getTargetFeatures(originalTrack, mid.ticks_per_beat) if similarityTopK is not None else None
+
     # a list of tuples, where each tuples is structured as (noteTrack, filename, voice)
     noteTracksAndInfo = [] 
     ranOutOfCandidates = False
@@ -44,7 +83,7 @@ def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int,
         outOfStyle = rng.random() < outOfStyleProb
 
         voicesReplaced = [x[2] for x in noteTracksAndInfo]
-        replacementTrack, filename, voice = getReplacementTrack(preferredStyle, outOfStyle, voicesReplaced, ser, rng, debug)
+        replacementTrack, filename, voice = getReplacementTrack(preferredStyle, outOfStyle, voicesReplaced, ser, rng, debug, targetFeatures, similarityTopK)
         if replacementTrack == None:
             if debug:
                 print(f"Ran out of candidate tracks without repeating voices for out-of-style choice '{outOfStyle}'. Iteration: {i}; voices replaced: {voicesReplaced}.")
@@ -57,7 +96,7 @@ def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int,
         outOfStyle = not outOfStyle
         for j in range(i, numReplacements):
             voicesReplaced = [x[2] for x in noteTracksAndInfo]
-            replacementTrack, filename, voice = getReplacementTrack(preferredStyle, outOfStyle, voicesReplaced, ser, rng, debug)
+            replacementTrack, filename, voice = getReplacementTrack(preferredStyle, outOfStyle, voicesReplaced, ser, rng, debug, targetFeatures, similarityTopK)
             if replacementTrack == None:
                 if debug:
                     print(f"Completely ran out of candidate tracks. Iteration: {j}; Voices replaced: {voicesReplaced}.")
@@ -72,13 +111,13 @@ def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int,
     pitchesToDelete = []
     for voice in voicesReplaced:
         pitchesToDelete.extend(PERC_VOICES_MAPPING[voice])
-    originalTrack = tools.deletePitches(originalTrack, pitchesToDelete)
+    edit = EditPipeline(originalTrack).deletePitches(pitchesToDelete)
 
     # merge the replacements into the original track
     noteTracks = [x[0] for x in noteTracksAndInfo]
-    newTrack = tools.mergeMultipleTracks(trackWithMetaData=originalTrack, noteTracks=noteTracks)
+    edit = edit.merge(noteTracks)
     # collapse the track to a single channel
-    newTrack = tools.allMessagesToChannel(newTrack, channel)
+    newTrack = edit.toChannel(channel).toMidiTrack()
 
     # Construct transformed midi file
     transformedMid = copy.deepcopy(mid)
@@ -86,20 +125,155 @@ def transformMidiFile(mid: mido.MidiFile, trackIndex: int, numReplacements: int,
 
     replacementInfo = [(x[1], x[2]) for x in noteTracksAndInfo]
 
+    if cache is not None:
+        info = {"replacementInfo": replacementInfo, "rngState": rng.bit_generator.state}
+        cache.put(cacheKey, {"output.mid": midiFileToBytes(transformedMid), "info.json": json.dumps(info).encode()})
+
     return transformedMid, replacementInfo
 
-def getReplacementTrack(preferredStyle: str, outOfStyle: bool, voicesReplaced: List[str], ser: SeedExamplesRetriever, rng: np.random.Generator, debug=False) -> Tuple[mido.MidiTrack, str, str]:
+def midiFileToBytes(mid: mido.MidiFile) -> bytes:
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+def getTransformCacheKey(mid: mido.MidiFile, trackIndex: int, numReplacements: int, ser: SeedExamplesRetriever, rng: np.random.Generator, preferredStyle=None, outOfStyleProb=0.0, channel=9, similarityTopK=None) -> str:
+    """
+    Returns the cache key of a transformMidiFile call: a hash of the source midi's contents, the seed pool version,
+    the retriever's sampling weights, the transformation parameters and the current state of the random number generator.
+    """
+    params = {
+        "trackIndex": trackIndex,
+        "numReplacements": numReplacements,
+        "preferredStyle": None if preferredStyle is None else str(preferredStyle),
+        "outOfStyleProb": float(outOfStyleProb),
+        "channel": channel,
+        "similarityTopK": similarityTopK,
+    }
+    return hashKey(midiFileToBytes(mid), ser.getPoolVersion(), ser.getSamplingConfig(), params, rng.bit_generator.state)
+
+def getTargetFeatures(track: mido.MidiTrack, ticksPerBeat: int) -> dict:
+    """
+    Returns the rhythm features (see seedIndex.getRhythmFeatures) to match for each voice of the track:
+    the features of the voice itself if the track has it, otherwise those of the whole track.
+    """
+    eventTrack = EventTrack.fromMidiTrack(track)
+    wholeTrackFeatures = getRhythmFeatures(eventTrack, ticksPerBeat)
+    targetFeatures = {}
+    for voice, pitches in PERC_VOICES_MAPPING.items():
+        if eventTrack.hasNoteOn(pitches):
+            targetFeatures[voice] = getRhythmFeatures(eventTrack, ticksPerBeat, pitches)
+        else:
+            targetFeatures[voice] = wholeTrackFeatures
+    return targetFeatures
+
+def getReplacementTrack(preferredStyle: str, outOfStyle: bool, voicesReplaced: List[str], ser: SeedExamplesRetriever, rng: np.random.Generator, debug=False, targetFeatures: dict=None, similarityTopK=None) -> Tuple[mido.MidiTrack, str, str]:
     """
     Gets a replacement voice (midi track) using the seedExamplesRetriever.
     With a probability of (1-outOfStyleProb), the replacement voice will be from the given style.
-    Given the preferredStyle and whether not we're replacing with an out of style voice, we get a list of candidate tracks, from which randomly choose one.
+    Given the preferredStyle and whether not we're replacing with an out of style voice, we get a list of candidate tracks, from which randomly choose one (uniformly, or with the retriever's sampling weights).
+    If similarityTopK and targetFeatures (see getTargetFeatures) are given, we randomly choose among the similarityTopK candidates closest to the target instead.
     We mainly return the midi track, but we also return the filename and the voice of the chosen track so that we can keep track of which voices have been replaced by what track.
     """
 
-    candidatesInfo = ser.getCandidateTracksInfo(preferredStyle, outOfStyle, voicesToExclude=voicesReplaced)
-    if not candidatesInfo:
+    if similarityTopK is not None and targetFeatures is not None:
+        candidatesInfo = ser.getCandidateTracksInfo(preferredStyle, outOfStyle, voicesToExclude=voicesReplaced)
+        if ser.isWeighted():
+            # candidates that can never be drawn must not take the place of others among the closest
+            candidatesInfo = [c for c, w in zip(candidatesInfo, ser.getCandidateWeights(candidatesInfo)) if w > 0]
+        if not candidatesInfo:
+            return None, None, None
+        candidatesInfo = ser.getFeatureIndex().topKByVoice(targetFeatures, similarityTopK, candidatesInfo)
+        choice = ser.sampleFromCandidates(candidatesInfo, rng)
+    else:
+        choice = ser.sampleCandidateTrack(preferredStyle, outOfStyle, voicesReplaced, rng)
+    if choice is None:
         return None, None, None
-    filename, voice = rng.choice(candidatesInfo)
+    filename, voice = choice
     if debug:
         print(f"Chose track from {filename} with voice {voice} to replace. Out of style? {outOfStyle}")
-    return ser.getTrack(filename, voice), filename, voice
\ No newline at end of file
+    return ser.getTrack(filename, voice), filename, voice
+
+def getFileKey(filename: str, rootDir: str = None) -> str:
+    """
+    Returns the path of the file relative to rootDir, with / separators (the file's basename if rootDir is None).
+    """
+    if rootDir is None:
+        return os.path.basename(str(filename))
+    return os.path.relpath(os.path.abspath(str(filename)), os.path.abspath(str(rootDir))).replace(os.sep, "/")
+
+def getFileRng(seed: int, filename: str, rootDir: str = None) -> np.random.Generator:
+    """
+    Returns a random number generator that depends only on the seed and the file's path relative to rootDir
+    (see getFileKey), so that a file gets the same random stream regardless of the order in which a batch is processed,
+    and files of the same name in different directories get different streams.
+    """
+    return np.random.default_rng([seed, zlib.crc32(getFileKey(filename, rootDir).encode())])
+
+def getOutputName(midiPath: str, rootDir: str = None) -> str:
+    """
+    Returns the name of the outputs of a file: its path relative to rootDir, without extension, with __ for separators.
+    """
+    return os.path.splitext(getFileKey(midiPath, rootDir))[0].replace("/", "__")
+
+def checkOutputNames(midiPaths: List[str], rootDir: str = None):
+    """
+    Raises a ValueError if two files would write to the same outputs (and share a random stream).
+    """
+    names = {}
+    for midiPath in midiPaths:
+        name = getOutputName(midiPath, rootDir)
+        if name in names and os.path.abspath(str(names[name])) != os.path.abspath(str(midiPath)):
+            hint = "" if rootDir is not None else " (give a rootDir to key files by their paths relative to it)"
+            raise ValueError(f"{names[name]} and {midiPath} would both write outputs named {name}_<k>.mid{hint}")
+        names[name] = midiPath
+
+def transformMidiFiles(midiPaths: List[str], outputDir: str, numReplacements: int, ser: SeedExamplesRetriever, seed: int, numAugmentations=1, trackIndex=0, preferredStyle=None, outOfStyleProb=0.0, channel=9, manifestPath=None, cache: DiskCache=None, writeWorkers=4, minHammingDistance=None, rootDir=None, debug=False) -> List[str]:
+    """
+    Batch version of transformMidiFile. Each input file is transformed numAugmentations times,
+    and each transformed file is written to outputDir as <name>_<k>.mid (see getOutputName).
+    params:
+    - midiPaths: the midi files to transform
+    - outputDir: the directory to which transformed files are written
+    - seed: used to derive a random number generator per input file (see getFileRng)
+    - manifestPath: if specified, the replacement info of every output is appended to a manifest at this path (see manifest.py)
+    - cache: if specified, transformations are served from and stored to this cache (see transformMidiFile)
+    - writeWorkers: the number of threads writing transformed files to disk
+    - minHammingDistance: if specified, transformed files whose onset hit maps differ from the input file's in fewer grid steps
+      (summed over voices, see augMetrics.py) are dropped: they are neither written nor recorded in the manifest.
+      The hit maps span the whole files, so hits moved by a bar or more count; but they are quantized to 16th notes and
+      ignore velocities, so outputs that only differ in their timing within a step or in their dynamics are dropped too
+    - rootDir: random streams and output names derive from the paths of the files relative to rootDir, or by default
+      from their names; either way, a file's outputs do not depend on the other files of the batch.
+      Files of the same name in different directories need a rootDir (see checkOutputNames)
+    - the remaining params are passed on to transformMidiFile
+    return: the paths of the transformed midi files that were written
+    """
+    checkOutputNames(midiPaths, rootDir)
+    manifest = ManifestWriter(manifestPath) if manifestPath is not None else None
+    writer = BatchMidiWriter(maxWorkers=writeWorkers)
+    outputPaths = []
+    try:
+        for midiPath in midiPaths:
+            mid = mido.MidiFile(midiPath)
+            rng = getFileRng(seed, midiPath, rootDir)
+            fileSer = ser.snapshot()
+            name = getOutputName(midiPath, rootDir)
+            for k in range(numAugmentations):
+                # choose the style here rather than in transformMidiFile so that it can be recorded
+                style = preferredStyle if preferredStyle is not None else rng.choice(fileSer.styles)
+                transformedMid, replacementInfo = transformMidiFile(mid, trackIndex, numReplacements, fileSer, rng, style, outOfStyleProb, channel, debug, cache)
+                if minHammingDistance is not None and compareMidiFiles(mid, transformedMid)["hammingDistance"].sum() < minHammingDistance:
+                    continue
+                outputPath = f"{outputDir}/{name}_{k}.mid"
+                writer.submit(outputPath, transformedMid)
+                outputPaths.append(outputPath)
+
+                if manifest is not None:
+                    outOfStyleFlags = [fileSer.getExampleStyle(filename) != style for filename, _ in replacementInfo]
+                    manifest.append(midiPath, outputPath, style, replacementInfo, outOfStyleFlags)
+    finally:
+        writer.close()
+        if manifest is not None:
+            manifest.close()
+
+    return outputPaths
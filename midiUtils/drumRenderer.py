@@ -0,0 +1,271 @@
+from midiUtils.constants import *
+from midiUtils.cache import DiskCache, hashKey, hashFile
+from midiUtils.eventTrack import EventMidiFile, readSmfFile, META_STATUS
+from midiUtils.synth import SR, SF_PATH
+
+import io
+import os
+import mido
+import numpy as np
+
+from typing import Dict, List, Tuple, Union
+
+"""
+A sample-based drum renderer, much faster than rendering every file with FluidSynth.
+One-shot samples of every (pitch, velocity layer) are rendered from the SoundFont once (see SampleBank.fromSoundFont).
+A clip is then mixed by adding a sample at every note_on onset:
+- the sample of the velocity layer at or above the note's velocity is used, scaled by (velocity / layer velocity) ** 2,
+  which follows FluidSynth's default velocity to amplitude curve
+- notes of a choke group (by default, the open and closed hi-hats) cut off the previous note of their group,
+  like the exclusive classes of a General MIDI drum kit
+- note_offs are ignored: drum samples are played as one-shots
+Like PrettyMIDI.fluidsynth, tempo changes are read from the first track, and the mix is normalized to [-1, 1].
+"""
+
+VELOCITY_LAYERS = [32, 64, 96, 127]
+CHOKE_GROUPS = [ROLAND_REDUCED_MAPPING["HH_CLOSED"] + ROLAND_REDUCED_MAPPING["HH_OPEN"]]
+DEFAULT_TEMPO = 500000
+SET_TEMPO_META_TYPE = 0x51
+# samples are trimmed after their last sample louder than this
+SILENCE_THRESHOLD = 1e-4
+
+def renderOneShot(pitch: int, velocity: int, sr: int = SR, sf2Path: str = SF_PATH, noteDuration: float = 0.1) -> np.ndarray:
+    """
+    Renders a single drum note with FluidSynth (through pretty_midi), without normalization, trimmed of trailing silence.
+    """
+    import pretty_midi
+
+    instrument = pretty_midi.Instrument(program=0, is_drum=True)
+    instrument.notes.append(pretty_midi.Note(velocity=velocity, pitch=pitch, start=0.0, end=noteDuration))
+    audio = instrument.fluidsynth(fs=sr, sf2_path=sf2Path) / 2 ** 15
+    loud = np.flatnonzero(np.abs(audio) > SILENCE_THRESHOLD)
+    return audio[:loud[-1] + 1].astype(np.float32) if len(loud) > 0 else np.zeros(0, dtype=np.float32)
+
+class SampleBank:
+    def __init__(self, samples: Dict[Tuple[int, int], np.ndarray], sr: int, velocityLayers: List[int] = VELOCITY_LAYERS):
+        """
+        samples maps (pitch, layer velocity) to a mono one-shot sample, for every layer velocity of velocityLayers.
+        """
+        self.samples = {(int(p), int(v)): np.asarray(s, dtype=np.float32) for (p, v), s in samples.items()}
+        self.sr = sr
+        self.velocityLayers = np.array(sorted(velocityLayers), dtype=np.int64)
+        self._hash = None
+
+    def getLayers(self, velocities: np.ndarray) -> np.ndarray:
+        """
+        Returns the velocity of the layer used for each velocity: the lowest layer at or above it.
+        """
+        i = np.searchsorted(self.velocityLayers, velocities, side="left")
+        return self.velocityLayers[np.minimum(i, len(self.velocityLayers) - 1)]
+
+    def getPitches(self) -> List[int]:
+        return sorted(set(p for p, _ in self.samples))
+
+    @staticmethod
+    def fromSoundFont(sf2Path: str = SF_PATH, sr: int = SR, velocityLayers: List[int] = VELOCITY_LAYERS, pitches: List[int] = None, noteDuration: float = 0.1, cache: DiskCache = None) -> "SampleBank":
+        """
+        Renders the one-shot samples of pitches (by default, every pitch of ROLAND_REDUCED_MAPPING) from a SoundFont.
+        If cache is given, the bank is stored in it, keyed by the SoundFont's contents and the other params.
+        """
+        if pitches is None:
+            pitches = sorted(set(p for ps in ROLAND_REDUCED_MAPPING.values() for p in ps))
+        if cache is not None:
+            key = hashKey("sampleBank", hashFile(sf2Path), sr, sorted(velocityLayers), sorted(pitches), noteDuration)
+            entryDir = cache.get(key)
+            if entryDir is not None:
+                return SampleBank.load(f"{entryDir}/bank.npz")
+
+        samples = {(p, v): renderOneShot(p, v, sr, sf2Path, noteDuration) for p in pitches for v in velocityLayers}
+        bank = SampleBank(samples, sr, velocityLayers)
+        if cache is not None:
+            cache.put(key, {"bank.npz": bank.toBytes()})
+        return bank
+
+    def toBytes(self) -> bytes:
+        keys = sorted(self.samples)
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            sr=self.sr,
+            velocityLayers=self.velocityLayers,
+            keys=np.array(keys, dtype=np.int64).reshape(len(keys), 2),
+            lengths=np.array([len(self.samples[k]) for k in keys], dtype=np.int64),
+            data=np.concatenate([self.samples[k] for k in keys]) if keys else np.zeros(0, dtype=np.float32),
+        )
+        return buffer.getvalue()
+
+    def getHash(self) -> str:
+        """
+        Returns a hash of the bank's contents, computed once (the bank must not be modified afterwards).
+        """
+        if self._hash is None:
+            self._hash = hashKey(self.toBytes())
+        return self._hash
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.toBytes())
+
+    @staticmethod
+    def load(path) -> "SampleBank":
+        with np.load(path) as npz:
+            starts = np.concatenate([[0], np.cumsum(npz["lengths"])])
+            data = npz["data"]
+            samples = {(int(p), int(v)): data[starts[i]:starts[i + 1]] for i, (p, v) in enumerate(npz["keys"])}
+            return SampleBank(samples, int(npz["sr"]), npz["velocityLayers"].tolist())
+
+    def __str__(self) -> str:
+        return f"SampleBank of {len(self.samples)} samples at {self.sr} Hz, velocity layers {self.velocityLayers.tolist()}"
+
+def toEventMidiFile(mid: Union[str, os.PathLike, mido.MidiFile, EventMidiFile]) -> EventMidiFile:
+    if isinstance(mid, EventMidiFile):
+        return mid
+    if isinstance(mid, mido.MidiFile):
+        return EventMidiFile.fromMidiFile(mid)
+    return readSmfFile(mid)
+
+def ticksToSeconds(ticks: np.ndarray, tempoTicks: np.ndarray, tempos: np.ndarray, ticksPerBeat: int) -> np.ndarray:
+    """
+    Converts absolute ticks to seconds, given the (sorted) ticks at which the tempo (in microseconds per beat) changes.
+    The first tempo change must be at tick 0.
+    """
+    secondsPerTick = tempos / (1e6 * ticksPerBeat)
+    changeSeconds = np.concatenate([[0.0], np.cumsum(np.diff(tempoTicks) * secondsPerTick[:-1])])
+    i = np.searchsorted(tempoTicks, ticks, side="right") - 1
+    return changeSeconds[i] + (ticks - tempoTicks[i]) * secondsPerTick[i]
+
+def getTempoChanges(eventMid: EventMidiFile) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the ticks and tempos of the set_tempo messages of the first track, starting with a tempo at tick 0.
+    """
+    tempoTicks, tempos = [0], [DEFAULT_TEMPO]
+    if eventMid.tracks:
+        track = eventMid.tracks[0]
+        for i in np.flatnonzero((track.status == META_STATUS) & (track.events["metaType"] == SET_TEMPO_META_TYPE)):
+            tick = int(track.times[i])
+            tempo = int.from_bytes(track.getPayload(i), "big")
+            if tick == tempoTicks[-1]:
+                tempos[-1] = tempo
+            else:
+                tempoTicks.append(tick)
+                tempos.append(tempo)
+    return np.array(tempoTicks, dtype=np.int64), np.array(tempos, dtype=np.float64)
+
+def getDrumHits(mid: Union[str, os.PathLike, mido.MidiFile, EventMidiFile]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """
+    Returns the onsets (in seconds), pitches and velocities of the note_ons (with a non-zero velocity) of every track,
+    sorted by onset, and the time of the last note message.
+    """
+    eventMid = toEventMidiFile(mid)
+    tempoTicks, tempos = getTempoChanges(eventMid)
+    ticks, pitches, velocities, noteTicks = [], [], [], []
+    for track in eventMid.tracks:
+        isNote = track.noteOnMask() | track.noteOffMask()
+        hits = track.noteOnMask() & (track.velocities > 0)
+        ticks.append(track.times[hits])
+        pitches.append(track.notes[hits])
+        velocities.append(track.velocities[hits])
+        noteTicks.append(track.times[isNote])
+    ticks = np.concatenate(ticks) if ticks else np.zeros(0, dtype=np.int64)
+    order = np.argsort(ticks, kind="stable")
+    onsets = ticksToSeconds(ticks[order], tempoTicks, tempos, eventMid.ticksPerBeat)
+    pitches = np.concatenate(pitches)[order].astype(np.int64) if ticks.size else np.zeros(0, dtype=np.int64)
+    velocities = np.concatenate(velocities)[order].astype(np.int64) if ticks.size else np.zeros(0, dtype=np.int64)
+    allNoteTicks = np.concatenate(noteTicks) if noteTicks else np.zeros(0, dtype=np.int64)
+    endTime = float(ticksToSeconds(np.array([allNoteTicks.max()]), tempoTicks, tempos, eventMid.ticksPerBeat)[0]) if allNoteTicks.size else 0.0
+    return onsets, pitches, velocities, endTime
+
+def getChokeLengths(onsets: np.ndarray, pitches: np.ndarray, chokeGroups: List[List[int]]) -> np.ndarray:
+    """
+    Returns how many samples each hit may ring for before the next hit of its choke group (-1 for no limit).
+    """
+    lengths = np.full(len(onsets), -1, dtype=np.int64)
+    for group in chokeGroups:
+        members = np.flatnonzero(np.isin(pitches, group))
+        members = members[np.argsort(onsets[members], kind="stable")]
+        lengths[members[:-1]] = onsets[members[1:]] - onsets[members[:-1]]
+    return lengths
+
+def mixHits(onsets: np.ndarray, pitches: np.ndarray, velocities: np.ndarray, bank: SampleBank, length: int, chokeGroups: List[List[int]] = CHOKE_GROUPS, chokeFade: int = 64, chokeLengths: np.ndarray = None) -> np.ndarray:
+    """
+    Overlap-adds the bank's samples at the given onsets (in samples) into a buffer of at least length samples.
+    Hits that ring out are added as whole, scaled samples, one array operation per onset. Choked hits of each
+    (pitch, layer) sample are mixed at once, as a matrix of copies that fade out over chokeFade samples before being cut off.
+    Pitches that are not in the bank are skipped.
+    chokeLengths (see getChokeLengths) are computed from chokeGroups unless given.
+    """
+    layers = bank.getLayers(velocities)
+    gains = (velocities / layers) ** 2
+    if chokeLengths is None:
+        chokeLengths = getChokeLengths(onsets, pitches, chokeGroups)
+    sampleLengths = np.array([len(bank.samples.get((p, l), ())) for p, l in zip(pitches.tolist(), layers.tolist())], dtype=np.int64)
+    length = int(max(length, (onsets + sampleLengths).max(initial=0)))
+    out = np.zeros(length, dtype=np.float64)
+
+    keys = pitches * 256 + layers
+    for key in np.unique(keys):
+        sample = bank.samples.get((int(key // 256), int(key % 256)))
+        if sample is None or len(sample) == 0:
+            continue
+        selected = keys == key
+        choked = selected & (chokeLengths >= 0) & (chokeLengths < len(sample))
+        free = selected & ~choked
+
+        # hits of the same sample at the same onset are mixed as one
+        freeOnsets, inverse = np.unique(onsets[free], return_inverse=True)
+        freeGains = np.bincount(inverse, weights=gains[free], minlength=len(freeOnsets))
+        for onset, gain in zip(freeOnsets.tolist(), freeGains.tolist()):
+            out[onset:onset + len(sample)] += gain * sample
+
+        if choked.any():
+            ringLengths = chokeLengths[choked]
+            k = np.arange(ringLengths.max())
+            envelopes = np.clip((ringLengths[:, None] - k[None, :]) / chokeFade, 0, 1)
+            values = gains[choked][:, None] * sample[None, :len(k)] * envelopes
+            positions = onsets[choked][:, None] + k[None, :]
+            out += np.bincount(positions.ravel(), weights=values.ravel(), minlength=length)[:length]
+    return out
+
+def renderDrums(mid: Union[str, os.PathLike, mido.MidiFile, EventMidiFile], bank: SampleBank, chokeGroups: List[List[int]] = CHOKE_GROUPS, chokeFade: float = 0.0015, normalize: bool = True) -> np.ndarray:
+    """
+    Renders a drum midi file (a path, mido.MidiFile or EventMidiFile) to mono audio at the bank's sample rate.
+    Like PrettyMIDI.fluidsynth, the audio lasts until one second after the last note message, or until the last sample ends.
+    chokeFade is in seconds.
+    """
+    onsets, pitches, velocities, endTime = getDrumHits(mid)
+    onsetSamples = (onsets * bank.sr).astype(np.int64)
+    length = int(np.ceil(bank.sr * (endTime + 1.0)))
+    audio = mixHits(onsetSamples, pitches, velocities, bank, length, chokeGroups, max(1, int(chokeFade * bank.sr)))
+    if normalize:
+        peak = np.abs(audio).max(initial=0)
+        if peak > 0:
+            audio /= peak
+    return audio
+
+def renderStems(mid: Union[str, os.PathLike, mido.MidiFile, EventMidiFile], bank: SampleBank, voices: Dict[str, List[int]] = PERC_VOICES_MAPPING, chokeGroups: List[List[int]] = CHOKE_GROUPS, chokeFade: float = 0.0015, normalize: bool = True) -> Tuple[List[str], np.ndarray]:
+    """
+    Renders one stem per voice (voices maps voice names to pitches, like PERC_VOICES_MAPPING) in a single pass:
+    the hits are read once and split by voice. Returns the voice names and a (voices, samples) array.
+    Chokes are computed on all the hits, so a stem is cut off by hits of other stems of its choke group.
+    With normalize, every stem is divided by the peak of their mix, which keeps their relative levels.
+    Hits of pitches that are in no voice are left out.
+    """
+    onsets, pitches, velocities, endTime = getDrumHits(mid)
+    onsetSamples = (onsets * bank.sr).astype(np.int64)
+    chokeLengths = getChokeLengths(onsetSamples, pitches, chokeGroups)
+    length = int(np.ceil(bank.sr * (endTime + 1.0)))
+    fadeSamples = max(1, int(chokeFade * bank.sr))
+
+    names = list(voices)
+    mixes = []
+    for name in names:
+        selected = np.isin(pitches, voices[name])
+        mixes.append(mixHits(onsetSamples[selected], pitches[selected], velocities[selected], bank, length, chokeGroups, fadeSamples, chokeLengths[selected]))
+    stems = np.zeros((len(names), max((len(m) for m in mixes), default=length)), dtype=np.float64)
+    for i, m in enumerate(mixes):
+        stems[i, :len(m)] = m
+    if normalize:
+        peak = np.abs(stems.sum(axis=0)).max(initial=0)
+        if peak > 0:
+            stems /= peak
+    return names, stems
@@ -0,0 +1,250 @@
+from midiUtils.eventTrack import EventTrack, EVENT_DTYPE, META_STATUS
+
+import mido
+import numpy as np
+
+from typing import List, Union
+
+"""
+A lazy pipeline of track edits.
+Chaining tools.deletePitches, mergeMultipleTracks, allMessagesToChannel and trimMidiTrack builds a full AbsoluteTimeTrack
+and a full mido.MidiTrack at every step. An EditPipeline only records the edits; when it is materialized, the track is
+converted to an EventTrack once, every edit runs as a few array operations on it, and the result is converted back once.
+Consecutive pitch deletions are fused into one, as are consecutive channel changes.
+The results are the same as those of the corresponding tools functions.
+"""
+
+NOTE_OFF_VELOCITY = 64
+
+def toEventTrack(track: Union[mido.MidiTrack, EventTrack]) -> EventTrack:
+    return track if isinstance(track, EventTrack) else EventTrack.fromMidiTrack(track)
+
+def deleteEventPitches(track: EventTrack, pitches: list) -> EventTrack:
+    """
+    Array version of tools.deletePitches.
+    """
+    isNote = track.noteOnMask() | track.noteOffMask()
+    return track.subset(~(isNote & np.isin(track.notes, np.asarray(list(pitches), dtype=np.int64))))
+
+def eventsToChannel(track: EventTrack, channel: int) -> EventTrack:
+    """
+    Array version of tools.allMessagesToChannel.
+    """
+    events = track.events.copy()
+    isChannelMessage = events["status"] < 0xF0
+    events["status"][isChannelMessage] = (events["status"][isChannelMessage] & 0xF0) | channel
+    return EventTrack(events, track.payload)
+
+def mergeEventTracks(track1: EventTrack, track2: EventTrack) -> EventTrack:
+    """
+    Array version of AbsoluteTimeTrack.mergeAbsoluteTimeTracks, with the same tie breaking rules and
+    the same removal of the first end of track message.
+
+    The two-pointer merge places track2's j-th event before the first remaining event of track1 that does not go
+    before it. At a tie in time, a track1 event goes first unless it is an end of track, or the track2 event is a
+    note_off (and not an end of track). So, for each track2 event, the first track1 event that does not go before it
+    is found with searchsorted, and a cumulative maximum enforces that track2 events stay in order.
+    """
+    n, m = len(track1), len(track2)
+    if n == 0:
+        return track2
+    if m == 0:
+        return track1
+
+    times1, times2 = track1.times, track2.times
+    eot1, eot2 = track1.endOfTrackMask(), track2.endOfTrackMask()
+    noteOff2 = track2.noteOffMask() & ~eot2
+
+    if (eot1[:-1] & ~eot1[1:] & (times1[:-1] == times1[1:])).any():
+        # an end of track followed by another event at the same time: the tie rule is not monotonic in track1
+        order = _mergeOrderLoop(times1, eot1, times2, eot2, noteOff2)
+    else:
+        lo = np.searchsorted(times1, times2, side="left")
+        hi = np.searchsorted(times1, times2, side="right")
+        # index of the next end of track of track1 at or after each position (n if there is none)
+        nextEot = np.where(eot1, np.arange(n), n)
+        nextEot = np.minimum.accumulate(nextEot[::-1])[::-1]
+        nextEot = np.append(nextEot, n)
+        firstNotBefore = np.where(noteOff2, lo, np.minimum(nextEot[lo], hi))
+        insertAt = np.maximum.accumulate(firstNotBefore)
+
+        # position in the merged track of every event of track1 and track2
+        positions2 = insertAt + np.arange(m)
+        positions1 = np.arange(n) + np.searchsorted(insertAt, np.arange(n), side="right")
+        order = np.empty(n + m, dtype=np.int64)
+        order[positions1] = np.arange(n)
+        order[positions2] = n + np.arange(m)
+
+    merged = _stack(track1, track2).subset(order)
+    eots = np.flatnonzero(merged.endOfTrackMask())
+    if len(eots) > 0:
+        merged = merged.subset(np.delete(np.arange(len(merged)), eots[0]))
+    return merged
+
+def _mergeOrderLoop(times1, eot1, times2, eot2, noteOff2) -> np.ndarray:
+    """
+    The two-pointer merge of mergeAbsoluteTimeTracks on arrays. Returns indices into track1 followed by track2.
+    """
+    n, m = len(times1), len(times2)
+    order = []
+    i = j = 0
+    while i < n and j < m:
+        if times1[i] < times2[j] or (times1[i] == times2[j] and not eot1[i] and (eot2[j] or not noteOff2[j])):
+            order.append(i)
+            i += 1
+        else:
+            order.append(n + j)
+            j += 1
+    order.extend(range(i, n))
+    order.extend(range(n + j, n + m))
+    return np.array(order, dtype=np.int64)
+
+def _stack(track1: EventTrack, track2: EventTrack) -> EventTrack:
+    """
+    EventTrack.concatenate, without copying payloads when track2 has none (e.g. a note track).
+    """
+    if (track2.events["length"] == 0).all():
+        events2 = track2.events.copy()
+        events2["offset"] = 0
+        return EventTrack(np.concatenate([track1.events, events2]), track1.payload)
+    return EventTrack.concatenate([track1, track2])
+
+def mergeEventNoteTracks(trackWithMetaData: EventTrack, noteTracks: List[EventTrack]) -> EventTrack:
+    """
+    Array version of tools.mergeMultipleTracks.
+    """
+    merged = trackWithMetaData
+    for noteTrack in noteTracks:
+        notesOnly = noteTrack.subset(noteTrack.noteOnMask() | noteTrack.noteOffMask() | noteTrack.endOfTrackMask())
+        merged = mergeEventTracks(merged, notesOnly)
+    return merged
+
+def trimEventTrack(track: EventTrack, startTime: int, endTime: int, keepMetaData: bool) -> EventTrack:
+    """
+    Array version of helpers.getMidiSlice, as called by tools.trimMidiTrack: keeps the events from startTime up to
+    (but excluding) endTime, shifted to start at 0, turns hanging notes off and ends the track.
+    With keepMetaData, the meta messages at the very beginning of the track (see helpers.getMetaDataAndIndex) are kept too.
+    """
+    n = len(track)
+    times = track.times
+    first = int(np.searchsorted(times, startTime, side="left"))
+    if n == 0 or first == n:
+        return EventTrack()
+    last = max(first, int(np.searchsorted(times, endTime, side="left")))
+
+    metaCount = 0
+    if keepMetaData:
+        isMetaData = (track.status == META_STATUS) & (times == 0) & ~track.endOfTrackMask()
+        notMetaData = np.flatnonzero(~isMetaData)
+        metaCount = int(notMetaData[0]) if len(notMetaData) > 0 else n
+
+    indices = np.concatenate([np.arange(metaCount), np.arange(first, last)])
+    events = track.events[indices]
+    events["time"][metaCount:] -= startTime
+
+    # hanging notes: the last note message of each pitch in the slice is a note_on
+    sliced = track.events[first:last]
+    kinds = np.where(sliced["status"] < 0xF0, sliced["status"] & 0xF0, sliced["status"])
+    noteIndices = np.flatnonzero((kinds == 0x90) | (kinds == 0x80))
+    notes = sliced["data1"][noteIndices]
+    # index of the last note message of every pitch
+    lastOfPitch = len(notes) - 1 - np.unique(notes[::-1], return_index=True)[1]
+    lastMessages = sliced[noteIndices[lastOfPitch]]
+    hanging = lastMessages[(lastMessages["status"] & 0xF0) == 0x90]
+    hanging = hanging[np.argsort(hanging["data1"], kind="stable")]
+
+    parts = [events]
+    if len(hanging) > 0:
+        # getMidiSlice times the first note_off from the message before the last one it copied
+        if last < n:
+            noteOffTime = endTime - 1 - startTime
+        else:
+            previousTime = int(times[n - 2]) if n - 1 > first else startTime
+            noteOffTime = int(times[n - 1]) - startTime + endTime - 1 - previousTime
+        noteOffs = np.zeros(len(hanging), dtype=EVENT_DTYPE)
+        noteOffs["time"] = noteOffTime
+        noteOffs["status"] = 0x80 | (hanging["status"] & 0x0F)
+        noteOffs["data1"] = hanging["data1"]
+        noteOffs["data2"] = NOTE_OFF_VELOCITY
+        parts.append(noteOffs)
+
+    trimmed = EventTrack(np.concatenate(parts), track.payload)
+    if len(trimmed) == 0 or not trimmed.endOfTrackMask()[-1]:
+        endOfTrack = np.zeros(1, dtype=EVENT_DTYPE)
+        endOfTrack["time"] = trimmed.getEndTime()
+        endOfTrack["status"] = META_STATUS
+        endOfTrack["metaType"] = 0x2F
+        trimmed = EventTrack(np.concatenate([trimmed.events, endOfTrack]), trimmed.payload)
+    return trimmed
+
+class EditPipeline:
+    """
+    Records edits of a track (a mido.MidiTrack or an EventTrack), and applies them all when materialized:
+
+        newTrack = EditPipeline(track).deletePitches([36]).merge([kickTrack]).toChannel(9).toMidiTrack()
+
+    Every edit returns a new pipeline, so a pipeline can be reused as the prefix of several others.
+    """
+    def __init__(self, track: Union[mido.MidiTrack, EventTrack], operations: list = None):
+        self.track = track
+        self.operations = operations or []
+
+    def __then(self, name: str, *args) -> "EditPipeline":
+        operations = list(self.operations)
+        # fuse with the previous edit when possible
+        if operations and operations[-1][0] == name == "deletePitches":
+            operations[-1] = (name, operations[-1][1] | args[0])
+        elif operations and operations[-1][0] == name == "toChannel":
+            operations[-1] = (name, args[0])
+        else:
+            operations.append((name, *args))
+        return EditPipeline(self.track, operations)
+
+    def deletePitches(self, pitches: list) -> "EditPipeline":
+        """
+        See tools.deletePitches.
+        """
+        return self.__then("deletePitches", frozenset(int(p) for p in pitches))
+
+    def merge(self, noteTracks: List[Union[mido.MidiTrack, EventTrack]]) -> "EditPipeline":
+        """
+        See tools.mergeMultipleTracks; the track being edited is the track with metadata.
+        """
+        return self.__then("merge", list(noteTracks))
+
+    def toChannel(self, channel: int) -> "EditPipeline":
+        """
+        See tools.allMessagesToChannel.
+        """
+        if not 0 <= channel <= 15:
+            raise ValueError("channel must be between 0 and 15")
+        return self.__then("toChannel", channel)
+
+    def trim(self, startBar: int, endBar: int, beatsPerBar: int, ticksPerBeat: int) -> "EditPipeline":
+        """
+        See tools.trimMidiTrack.
+        """
+        return self.__then("trim", startBar * beatsPerBar * ticksPerBeat, endBar * beatsPerBar * ticksPerBeat)
+
+    def toEventTrack(self) -> EventTrack:
+        track = toEventTrack(self.track)
+        for name, *args in self.operations:
+            if name == "deletePitches":
+                track = deleteEventPitches(track, args[0])
+            elif name == "merge":
+                track = mergeEventNoteTracks(track, [toEventTrack(t) for t in args[0]])
+            elif name == "toChannel":
+                track = eventsToChannel(track, args[0])
+            elif name == "trim":
+                startTime, endTime = args
+                track = trimEventTrack(track, startTime, endTime, keepMetaData=startTime != 0)
+        return track
+
+    def toMidiTrack(self) -> mido.MidiTrack:
+        return self.toEventTrack().toMidiTrack()
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __repr__(self):
+        return f"EditPipeline({[op[0] for op in self.operations]})"
@@ -0,0 +1,568 @@
+from __future__ import annotations
+from midiUtils.constants import *
+
+import io
+import mido
+import mmap
+import struct
+import threading
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from mido.midifiles.meta import build_meta_message
+from typing import Iterable, List, Tuple, Union
+
+"""
+Compact, array-based representation of Standard MIDI Files.
+Decoding a file into EventTracks avoids building a python object per message; a mido track is only built
+when toMidiTrack is called.
+"""
+
+META_STATUS = 0xFF
+SYSEX_STATUS = 0xF0
+ESCAPE_STATUS = 0xF7
+END_OF_TRACK_META_TYPE = 0x2F
+
+# One row per event. time is the absolute time in ticks.
+# Channel messages use status, data1 and data2 (data2 is 0 for two byte messages).
+# Meta and sysex events keep their payload in the track's payload buffer, at [offset, offset + length).
+EVENT_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("status", "u1"),
+    ("data1", "u1"),
+    ("data2", "u1"),
+    ("metaType", "u1"),
+    ("offset", "<i8"),
+    ("length", "<i4"),
+])
+
+def channelMessageLength(status: int) -> int:
+    """
+    Returns the length in bytes (status byte included) of a channel message.
+    """
+    kind = status & 0xF0
+    return 2 if kind == 0xC0 or kind == 0xD0 else 3
+
+class EventTrack():
+    """
+    Like an AbsoluteTimeTrack, but stored as a structured numpy array (see EVENT_DTYPE) instead of a list of messages.
+    The payload buffer may be shared between tracks, e.g. the bytes of the file the tracks were read from.
+    """
+    def __init__(self, events: np.ndarray = None, payload=b""):
+        self.events = np.zeros(0, dtype=EVENT_DTYPE) if events is None else events
+        self.payload = payload
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.events["time"]
+
+    @property
+    def status(self) -> np.ndarray:
+        return self.events["status"]
+
+    @property
+    def kinds(self) -> np.ndarray:
+        """
+        Status bytes with the channel masked out for channel messages (e.g. 0x90 for every note_on).
+        """
+        status = self.events["status"]
+        return np.where(status < 0xF0, status & 0xF0, status)
+
+    @property
+    def notes(self) -> np.ndarray:
+        return self.events["data1"]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        return self.events["data2"]
+
+    def noteOnMask(self) -> np.ndarray:
+        """
+        Mask of note_on messages. Like mido, a note_on of velocity 0 is still a note_on.
+        """
+        return self.kinds == 0x90
+
+    def noteOffMask(self) -> np.ndarray:
+        return self.kinds == 0x80
+
+    def endOfTrackMask(self) -> np.ndarray:
+        return (self.events["status"] == META_STATUS) & (self.events["metaType"] == END_OF_TRACK_META_TYPE)
+
+    def getPayload(self, index: int) -> bytes:
+        """
+        Returns the payload of the meta or sysex event at index.
+        """
+        offset, length = int(self.events["offset"][index]), int(self.events["length"][index])
+        return bytes(self.payload[offset:offset + length])
+
+    def getEndTime(self) -> int:
+        return int(self.events["time"][-1]) if len(self.events) > 0 else 0
+
+    def subset(self, mask: np.ndarray) -> EventTrack:
+        """
+        Returns a new EventTrack with only the events selected by mask (a boolean mask or index array).
+        """
+        return EventTrack(self.events[mask], self.payload)
+
+    def selectPitches(self, pitches: list, notesOnly: bool = False) -> EventTrack:
+        """
+        Array version of tools.getTrackWithSelectPitches:
+        keeps only note messages with the given pitches, and every other message unless notesOnly is True.
+        The end of track message is always kept.
+        """
+        isNote = self.noteOnMask() | self.noteOffMask()
+        inPitches = np.isin(self.events["data1"], np.asarray(pitches, dtype=np.int64))
+        keep = (isNote & inPitches)
+        if notesOnly:
+            keep |= self.endOfTrackMask()
+        else:
+            keep |= ~isNote
+        return self.subset(keep)
+
+    def hasNoteOn(self, pitches: list = None) -> bool:
+        """
+        Array version of not tools.isTrackEmpty; if pitches is specified, only note_ons of those pitches are considered.
+        """
+        mask = self.noteOnMask()
+        if pitches is not None:
+            mask &= np.isin(self.events["data1"], np.asarray(pitches, dtype=np.int64))
+        return bool(mask.any())
+
+    def toMidiTrack(self) -> mido.MidiTrack:
+        """
+        Builds the equivalent mido.MidiTrack.
+        """
+        track = mido.MidiTrack()
+        deltas = np.diff(self.events["time"], prepend=0).tolist()
+        for e, delta in zip(self.events.tolist(), deltas):
+            _, status, data1, data2, metaType, offset, length = e
+            if status == META_STATUS:
+                data = list(self.payload[offset:offset + length])
+                track.append(build_meta_message(metaType, data, delta))
+            elif status == SYSEX_STATUS or status == ESCAPE_STATUS:
+                data = list(self.payload[offset:offset + length])
+                if data and data[-1] == ESCAPE_STATUS:
+                    data = data[:-1]
+                track.append(mido.Message("sysex", data=data, time=delta))
+            elif channelMessageLength(status) == 2:
+                track.append(mido.Message.from_bytes([status, data1], time=delta))
+            else:
+                track.append(mido.Message.from_bytes([status, data1, data2], time=delta))
+        return track
+
+    @staticmethod
+    def fromMidiTrack(track: mido.MidiTrack) -> EventTrack:
+        """
+        Builds an EventTrack from a mido.MidiTrack (or any iterable of mido messages with delta times).
+        """
+        rows = []
+        payload = bytearray()
+        absTime = 0
+        for msg in track:
+            absTime += msg.time
+            if msg.is_meta:
+                data = msg.bytes()
+                # skip 0xFF, the meta type and the variable length int
+                i = 2
+                while data[i] & 0x80:
+                    i += 1
+                body = data[i + 1:]
+                rows.append((absTime, META_STATUS, 0, 0, data[1], len(payload), len(body)))
+                payload.extend(body)
+            elif msg.type == "sysex":
+                body = list(msg.data) + [ESCAPE_STATUS]
+                rows.append((absTime, SYSEX_STATUS, 0, 0, 0, len(payload), len(body)))
+                payload.extend(body)
+            else:
+                data = msg.bytes()
+                rows.append((absTime, data[0], data[1] if len(data) > 1 else 0, data[2] if len(data) > 2 else 0, 0, 0, 0))
+        return EventTrack(np.array(rows, dtype=EVENT_DTYPE), bytes(payload))
+
+    @staticmethod
+    def concatenate(tracks: List[EventTrack]) -> EventTrack:
+        """
+        Stacks the events of the given tracks into one track, without sorting them.
+        Payloads are concatenated and offsets adjusted accordingly.
+        """
+        if len(tracks) == 0:
+            return EventTrack()
+        payloads = [bytes(t.payload) for t in tracks]
+        payloadOffsets = np.cumsum([0] + [len(p) for p in payloads[:-1]])
+        parts = []
+        for t, payloadOffset in zip(tracks, payloadOffsets):
+            events = t.events.copy()
+            events["offset"] += payloadOffset
+            parts.append(events)
+        return EventTrack(np.concatenate(parts), b"".join(payloads))
+
+    def __len__(self):
+        return len(self.events)
+
+    def __repr__(self):
+        return f"EventTrack({len(self.events)} events)"
+
+class EventMidiFile():
+    """
+    Like a mido.MidiFile, with EventTracks instead of mido.MidiTracks.
+    """
+    def __init__(self, type: int = 1, ticksPerBeat: int = 480, tracks: List[EventTrack] = None):
+        self.type = type
+        self.ticksPerBeat = ticksPerBeat
+        self.tracks = [] if tracks is None else tracks
+
+    def toMidiFile(self) -> mido.MidiFile:
+        mid = mido.MidiFile(type=self.type, ticks_per_beat=self.ticksPerBeat)
+        for t in self.tracks:
+            mid.tracks.append(t.toMidiTrack())
+        return mid
+
+    def toBytes(self) -> bytes:
+        """
+        Encodes the file as Standard MIDI File bytes, identical to what mido.MidiFile.save writes.
+        """
+        return writeSmfBytes(self)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.toBytes())
+
+    @staticmethod
+    def fromMidiFile(mid: mido.MidiFile) -> EventMidiFile:
+        return EventMidiFile(mid.type, mid.ticks_per_beat, [EventTrack.fromMidiTrack(t) for t in mid.tracks])
+
+    def __repr__(self):
+        return f"EventMidiFile(type={self.type}, ticksPerBeat={self.ticksPerBeat}, tracks={self.tracks})"
+
+def readVariableInt(data, pos: int):
+    """
+    Returns the variable length int at data[pos] and the position after it.
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+def decodeTrackEvents(data, start: int, end: int, startTime: int = 0, runningStatus: int = None, eventOffsets: list = None) -> np.ndarray:
+    """
+    Decodes the track events in data[start:end] into an array of EVENT_DTYPE.
+    Meta and sysex offsets point into data.
+    Running status follows mido: channel messages set it, meta messages do not affect it.
+    If eventOffsets is given, the position in data at which each event (its delta time) starts is appended to it.
+    Raises an EOFError if data ends in the middle of an event.
+    """
+    rows = []
+    append = rows.append
+    pos = start
+    absTime = startTime
+    try:
+        while pos < end:
+            if eventOffsets is not None:
+                eventOffsets.append(pos)
+            # delta time
+            delta = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7F)
+                if byte < 0x80:
+                    break
+            absTime += delta
+
+            status = data[pos]
+            if status < 0x80:
+                if runningStatus is None:
+                    raise OSError(f"running status without last status at byte {pos}")
+                status = runningStatus
+            else:
+                pos += 1
+
+            if status == META_STATUS:
+                metaType = data[pos]
+                length, pos = readVariableInt(data, pos + 1)
+                append((absTime, status, 0, 0, metaType, pos, length))
+                pos += length
+            elif status == SYSEX_STATUS or status == ESCAPE_STATUS:
+                length, pos = readVariableInt(data, pos)
+                append((absTime, SYSEX_STATUS, 0, 0, 0, pos, length))
+                pos += length
+                runningStatus = None
+            elif status < 0xF0:
+                runningStatus = status
+                data1 = data[pos]
+                if status & 0xF0 == 0xC0 or status & 0xF0 == 0xD0:
+                    append((absTime, status, data1, 0, 0, 0, 0))
+                    pos += 1
+                else:
+                    append((absTime, status, data1, data[pos + 1], 0, 0, 0))
+                    pos += 2
+            else:
+                raise OSError(f"undefined status byte 0x{status:02x} at byte {pos - 1}")
+    except IndexError:
+        raise EOFError(f"track data ends in the middle of an event at byte {pos}")
+
+    return np.array(rows, dtype=EVENT_DTYPE)
+
+def iterTrackChunks(data):
+    """
+    Yields (start, end) of the data of every MTrk chunk in data, after validating the MThd header.
+    Unknown chunks are skipped.
+    """
+    if bytes(data[0:4]) != b"MThd":
+        raise OSError("MThd not found. Probably not a MIDI file")
+    headerSize = struct.unpack(">L", data[4:8])[0]
+    pos = 8 + headerSize
+    while pos + 8 <= len(data):
+        name = bytes(data[pos:pos + 4])
+        size = struct.unpack(">L", data[pos + 4:pos + 8])[0]
+        start = pos + 8
+        end = min(start + size, len(data))
+        if name == b"MTrk":
+            yield start, end
+        pos = start + size
+
+def readSmfHeader(data):
+    """
+    Returns (type, numTracks, ticksPerBeat) from a Standard MIDI File header.
+    """
+    if bytes(data[0:4]) != b"MThd":
+        raise OSError("MThd not found. Probably not a MIDI file")
+    return struct.unpack(">hhh", data[8:14])
+
+def readSmfBytes(data) -> EventMidiFile:
+    """
+    Decodes Standard MIDI File bytes (or any buffer, such as an mmap) into an EventMidiFile.
+    The tracks' payloads reference data, which is not copied.
+    """
+    type, numTracks, ticksPerBeat = readSmfHeader(data)
+    tracks = []
+    for start, end in iterTrackChunks(data):
+        if len(tracks) == numTracks:
+            break
+        tracks.append(EventTrack(decodeTrackEvents(data, start, end), data))
+    return EventMidiFile(type, ticksPerBeat, tracks)
+
+def readSmfFile(path, useMmap: bool = True) -> EventMidiFile:
+    """
+    Decodes a Standard MIDI File into an EventMidiFile.
+    If useMmap is True, the file is memory-mapped rather than read; the tracks' payloads then reference the map.
+    """
+    with open(path, "rb") as f:
+        if useMmap:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                data = f.read()
+        else:
+            data = f.read()
+    try:
+        return readSmfBytes(data)
+    except EOFError as e:
+        raise EOFError(f"{path}: {e}") from e
+
+def encodeVariableInt(value: int) -> bytes:
+    if value < 0:
+        raise ValueError("variable int must be a non-negative integer")
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+def encodeEvents(events: np.ndarray, payload, previousTime: int = 0, runningStatus: int = None) -> Tuple[bytearray, int]:
+    """
+    Encodes events as delta times and message bytes, without any end of track handling.
+    previousTime and runningStatus are those in effect before the first event, so that a track can be encoded in pieces.
+    Returns the encoded bytes and the running status after the last event.
+    """
+    times = events["time"]
+    deltas = np.diff(times, prepend=previousTime)
+    if (deltas < 0).any():
+        raise ValueError("message time must be non-negative in MIDI file")
+
+    data = bytearray()
+    for e, delta in zip(events.tolist(), deltas.tolist()):
+        _, status, data1, data2, metaType, offset, length = e
+        data += encodeVariableInt(delta)
+        if status == META_STATUS:
+            data.append(META_STATUS)
+            data.append(metaType)
+            data += encodeVariableInt(length)
+            data += payload[offset:offset + length]
+            runningStatus = None
+        elif status == SYSEX_STATUS or status == ESCAPE_STATUS:
+            sysex = bytes(payload[offset:offset + length])
+            if not sysex.endswith(bytes([ESCAPE_STATUS])):
+                sysex += bytes([ESCAPE_STATUS])
+            data.append(SYSEX_STATUS)
+            data += encodeVariableInt(len(sysex))
+            data += sysex
+            runningStatus = None
+        else:
+            if status != runningStatus:
+                data.append(status)
+            data.append(data1)
+            if channelMessageLength(status) == 3:
+                data.append(data2)
+            runningStatus = status
+    return data, runningStatus
+
+def encodeEndOfTrack(delta: int) -> bytes:
+    return encodeVariableInt(delta) + bytes([META_STATUS, END_OF_TRACK_META_TYPE, 0])
+
+def encodeTrackEvents(track: EventTrack) -> bytes:
+    """
+    Encodes the events of a track as the data of an MTrk chunk.
+    Like mido, all end of track events are dropped and a single one is written at the end,
+    and channel messages use running status.
+    """
+    events = track.events
+    isEot = track.endOfTrackMask()
+    body = events[~isEot]
+
+    lastTime = int(body["time"][-1]) if len(body) > 0 else 0
+    endTime = int(events["time"][-1]) if len(events) > 0 and isEot[-1] else lastTime
+
+    data, _ = encodeEvents(body, track.payload)
+    data += encodeEndOfTrack(endTime - lastTime)
+    return bytes(data)
+
+class StreamingTrackWriter():
+    """
+    Writes a single track midi file incrementally: events are encoded and written as they are given,
+    and the track's chunk length is patched in when the writer is closed.
+    Memory use does not depend on the length of the track.
+    """
+    def __init__(self, path, ticksPerBeat: int, type: int = 1):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(b"MThd" + struct.pack(">Lhhh", 6, type, 1, ticksPerBeat))
+        self._file.write(b"MTrk")
+        self._lengthPosition = self._file.tell()
+        self._file.write(struct.pack(">L", 0))
+        self._trackLength = 0
+        self._runningStatus = None
+        self.lastTime = 0
+
+    def writeEvents(self, events: np.ndarray, payload=b""):
+        """
+        Writes events (end of track events excluded), whose absolute times must not precede the last written event.
+        """
+        if len(events) == 0:
+            return
+        data, self._runningStatus = encodeEvents(events, payload, self.lastTime, self._runningStatus)
+        self._file.write(data)
+        self._trackLength += len(data)
+        self.lastTime = int(events["time"][-1])
+
+    def close(self, endTime: int = None):
+        """
+        Writes the end of track at endTime (or at the last event's time) and patches the chunk length.
+        """
+        if self._file.closed:
+            return
+        endTime = self.lastTime if endTime is None else max(endTime, self.lastTime)
+        data = encodeEndOfTrack(endTime - self.lastTime)
+        self._file.write(data)
+        self._trackLength += len(data)
+        self._file.seek(self._lengthPosition)
+        self._file.write(struct.pack(">L", self._trackLength))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+def writeSmfBytes(eventMid: EventMidiFile) -> bytes:
+    """
+    Encodes an EventMidiFile as Standard MIDI File bytes.
+    """
+    if eventMid.type == 0 and len(eventMid.tracks) != 1:
+        raise ValueError("type 0 file must have exactly 1 track")
+    out = bytearray(b"MThd")
+    out += struct.pack(">Lhhh", 6, eventMid.type, len(eventMid.tracks), eventMid.ticksPerBeat)
+    for t in eventMid.tracks:
+        trackData = encodeTrackEvents(t)
+        out += b"MTrk"
+        out += struct.pack(">L", len(trackData))
+        out += trackData
+    return bytes(out)
+
+def toSmfBytes(mid: Union[EventMidiFile, mido.MidiFile]) -> bytes:
+    """
+    Encodes either an EventMidiFile or a mido.MidiFile as Standard MIDI File bytes.
+    """
+    if isinstance(mid, EventMidiFile):
+        return writeSmfBytes(mid)
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+class BatchMidiWriter():
+    """
+    Writes midi files through a bounded thread pool.
+    Files are encoded in the calling thread, so that later changes to a submitted file do not affect what is written,
+    and written to disk by the pool. At most maxPending encoded files are held in memory; submit blocks beyond that.
+    Errors raised while writing are re-raised by close.
+    """
+    def __init__(self, maxWorkers: int = 4, maxPending: int = 64):
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self._slots = threading.BoundedSemaphore(maxPending)
+        self._futures = []
+        self.filesWritten = 0
+
+    def submit(self, path, mid: Union[EventMidiFile, mido.MidiFile]):
+        data = toSmfBytes(mid)
+        self._slots.acquire()
+        try:
+            self._futures.append(self._executor.submit(self._write, str(path), data))
+        except Exception:
+            self._slots.release()
+            raise
+        # drop references to finished writes so that the list does not grow with the batch
+        if len(self._futures) > 1024:
+            self._collect(wait=False)
+
+    def _write(self, path: str, data: bytes):
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        finally:
+            self._slots.release()
+
+    def _collect(self, wait: bool):
+        pending = []
+        for future in self._futures:
+            if wait or future.done():
+                future.result()
+                self.filesWritten += 1
+            else:
+                pending.append(future)
+        self._futures = pending
+
+    def close(self):
+        try:
+            self._collect(wait=True)
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+def saveMidiFiles(items: Iterable[Tuple[str, Union[EventMidiFile, mido.MidiFile]]], maxWorkers: int = 4, maxPending: int = 64) -> int:
+    """
+    Writes (path, midi file) pairs through a BatchMidiWriter. Returns the number of files written.
+    """
+    with BatchMidiWriter(maxWorkers, maxPending) as writer:
+        for path, mid in items:
+            writer.submit(path, mid)
+    return writer.filesWritten
@@ -1,9 +1,14 @@
 from midiUtils.constants import *
 from midiUtils.absTrack import AbsoluteTimeTrack
+from midiUtils.eventTrack import EventTrack, StreamingTrackWriter, readSmfFile, readSmfBytes, writeSmfBytes, META_STATUS
 
 import math
 import mido
 import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
 
 """
 A lot of these fuctions are not used in the current version of the project.
@@ -138,24 +143,110 @@ def getMidiSlice(track: mido.MidiTrack, startTime: int, endTime, metaData: list
     return newTrack
 
 def change_midi_tempo(midi_file_path, new_tempo):
-    # Load the MIDI file
-    mid = mido.MidiFile(midi_file_path)
+    """
+    Sets every set_tempo message of the file to new_tempo, keeping all tracks. See setMidiTempo.
+    """
+    setMidiTempo(midi_file_path, tempo=new_tempo)
+    return midi_file_path
 
-    # Create a new MIDI file with the adjusted tempo
-    new_mid = mido.MidiFile()
-    new_track = mido.MidiTrack()
-    new_mid.tracks.append(new_track)
+SET_TEMPO_META_TYPE = 0x51
+TIME_SIGNATURE_META_TYPE = 0x58
 
-    for msg in mid.tracks[0]:
-        # If we find a set_tempo message, change its tempo
-        if msg.type == 'set_tempo':
-            msg = mido.MetaMessage('set_tempo', tempo=new_tempo)
-        new_track.append(msg)
+def writeFileAtomically(path, data: bytes):
+    """
+    Writes data to a temporary file next to path, then renames it over path,
+    so that readers see either the old or the new file, never a partial one.
+    """
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(data)
+    os.replace(tmpPath, path)
 
-    # Save the new MIDI file
-    new_mid.save(midi_file_path)
+def checkTempoAndTimeSignature(tempo: int = None, timeSignature: Tuple[int, int] = None):
+    """
+    Raises a ValueError if the tempo or time signature cannot be written to a midi file.
+    """
+    if tempo is not None and not 0 < tempo < 1 << 24:
+        raise ValueError(f"Tempo {tempo} is not between 1 and {(1 << 24) - 1} microseconds per beat")
+    if timeSignature is not None:
+        numerator, denominator = timeSignature
+        if not 1 <= numerator <= 255:
+            raise ValueError(f"Time signature numerator {numerator} is not between 1 and 255")
+        if denominator < 1 or denominator & (denominator - 1) != 0 or denominator > 1 << 255:
+            raise ValueError(f"Time signature denominator {denominator} is not a power of two")
 
-    return midi_file_path
+def setMidiTempo(path, tempo: int = None, timeSignature: Tuple[int, int] = None, outputPath=None) -> str:
+    """
+    Sets the tempo (in microseconds per beat) and/or the time signature (numerator, denominator) of a midi file.
+    Existing set_tempo and time_signature messages in every track are patched directly in the file's bytes,
+    which is possible whenever they have their standard length. Otherwise, e.g. when the file has no such message,
+    the file is re-encoded with the message inserted after the beginning metadata of the first track.
+    The result is written atomically to outputPath, or over path if outputPath is not specified.
+    Returns "patched" or "rewritten". Raises a ValueError, before writing anything, for an invalid tempo or time signature.
+    """
+    if tempo is None and timeSignature is None:
+        raise ValueError("Specify a tempo, a time signature, or both.")
+    checkTempoAndTimeSignature(tempo, timeSignature)
+
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    eventMid = readSmfBytes(data)
+
+    patched = {SET_TEMPO_META_TYPE: False, TIME_SIGNATURE_META_TYPE: False}
+    for eventTrack in eventMid.tracks:
+        for i in np.flatnonzero(eventTrack.status == META_STATUS):
+            e = eventTrack.events[i]
+            metaType, offset, length = int(e["metaType"]), int(e["offset"]), int(e["length"])
+            if tempo is not None and metaType == SET_TEMPO_META_TYPE and length == 3:
+                data[offset:offset + 3] = tempo.to_bytes(3, "big")
+                patched[SET_TEMPO_META_TYPE] = True
+            elif timeSignature is not None and metaType == TIME_SIGNATURE_META_TYPE and length == 4:
+                numerator, denominator = timeSignature
+                data[offset:offset + 2] = bytes([numerator, denominator.bit_length() - 1])
+                patched[TIME_SIGNATURE_META_TYPE] = True
+
+    missing = []
+    if tempo is not None and not patched[SET_TEMPO_META_TYPE]:
+        missing.append(mido.MetaMessage('set_tempo', tempo=tempo))
+    if timeSignature is not None and not patched[TIME_SIGNATURE_META_TYPE]:
+        missing.append(mido.MetaMessage('time_signature', numerator=timeSignature[0], denominator=timeSignature[1]))
+
+    outputPath = path if outputPath is None else outputPath
+    if not missing:
+        writeFileAtomically(outputPath, bytes(data))
+        return "patched"
+
+    # re-decode so that the patched messages are kept, then insert the missing ones
+    eventMid = readSmfBytes(bytes(data))
+    firstTrack = eventMid.tracks[0]
+    insertAt = getBeginningMetaDataCount(firstTrack)
+    combined = EventTrack.concatenate([firstTrack, EventTrack.fromMidiTrack(missing)])
+    order = np.concatenate([np.arange(insertAt), np.arange(len(firstTrack), len(combined)), np.arange(insertAt, len(firstTrack))])
+    eventMid.tracks[0] = combined.subset(order)
+    writeFileAtomically(outputPath, writeSmfBytes(eventMid))
+    return "rewritten"
+
+def _setMidiTempoTask(args):
+    path, tempo, timeSignature = args
+    return setMidiTempo(path, tempo, timeSignature)
+
+def changeTempoBatch(paths: List[str], tempo: int = None, timeSignature: Tuple[int, int] = None, maxWorkers: int = None) -> List[str]:
+    """
+    Runs setMidiTempo over many files (in place) with a process pool.
+    Returns, for each path, whether it was "patched" or "rewritten".
+    """
+    checkTempoAndTimeSignature(tempo, timeSignature)
+    tasks = [(p, tempo, timeSignature) for p in paths]
+    if maxWorkers == 1:
+        return [_setMidiTempoTask(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        return list(executor.map(_setMidiTempoTask, tasks, chunksize=max(1, len(tasks) // 64)))
+
+def changeTempoDirectory(sourceDir: str, tempo: int = None, timeSignature: Tuple[int, int] = None, maxWorkers: int = None) -> List[str]:
+    """
+    Runs changeTempoBatch over every midi file in sourceDir.
+    """
+    return changeTempoBatch(getSortedMidiFiles(sourceDir), tempo, timeSignature, maxWorkers)
 
 def getMetaDataAndIndex(track: mido.MidiTrack):
     """
@@ -198,21 +289,81 @@ def concatenateTracks(track1: mido.MidiTrack, track2: mido.MidiTrack):
     newTrack.append(mido.MetaMessage(END_OF_TRACK))
     return newTrack
 
-def concatenateMidiFiles(sourceDir: str, outputDir: str):
+def getSortedMidiFiles(sourceDir: str, order="name") -> List[str]:
     """
-    Concatenates all midi files in midiDir into a single midi file
+    Returns the paths of the midi files in sourceDir.
+    order is one of "name", "mtime", None (directory listing order), or a key function taking a path.
     """
-    files = [f for f in os.listdir(sourceDir) if ".mid" in f]
-    firstMid = mido.MidiFile(f"{sourceDir}/{files[0]}")
-    concatTrack = getMetaDataAndIndex(firstMid.tracks[0])
-    for f in files:
-        mid = mido.MidiFile(f"{sourceDir}/{f}")
-        concatTrack = concatenateTracks(concatTrack, mid.tracks[0])
-    concatTrack.append(mido.MetaMessage(END_OF_TRACK))
-    
-    newMid = mido.MidiFile(ticks_per_beat=firstMid.ticks_per_beat)
-    newMid.tracks.append(concatTrack)
-    newMid.save(f"{outputDir}/concatenated.mid")
+    paths = [f"{sourceDir}/{f}" for f in os.listdir(sourceDir) if ".mid" in f]
+    if order is None:
+        return paths
+    if order == "name":
+        return sorted(paths)
+    if order == "mtime":
+        return sorted(paths, key=os.path.getmtime)
+    if callable(order):
+        return sorted(paths, key=order)
+    raise ValueError(f"Unknown order {order}. Expected 'name', 'mtime', None or a key function.")
+
+def getBeginningMetaDataCount(eventTrack: EventTrack) -> int:
+    """
+    Array version of getMetaDataAndIndex: returns the number of meta messages at time zero at the start of the track,
+    excluding the end of track.
+    """
+    isMetaData = (eventTrack.status == META_STATUS) & (eventTrack.times == 0) & ~eventTrack.endOfTrackMask()
+    notMetaData = np.flatnonzero(~isMetaData)
+    return int(notMetaData[0]) if len(notMetaData) > 0 else len(eventTrack)
+
+def streamConcatenateMidiFiles(midiPaths: List[str], outputPath: str, gapTicks: int = 0, alignToBars: bool = False, beatsPerBar: int = 4) -> str:
+    """
+    Concatenates the first track of each midi file into a single track midi file, in a single pass.
+    Only one input file is held in memory at a time.
+    The output keeps the beginning metadata of the first file; the beginning metadata of the other files is skipped.
+    Each file starts gapTicks after the end of the previous one (its end of track time).
+    If alignToBars is True, each file's start is then rounded up to the next bar line.
+    Files with a different ticks per beat than the first file are rescaled to the first file's resolution.
+    """
+    if len(midiPaths) == 0:
+        raise ValueError("No midi files to concatenate.")
+
+    ticksPerBeat = readSmfFile(midiPaths[0]).ticksPerBeat
+    barLength = ticksPerBeat * beatsPerBar
+
+    with StreamingTrackWriter(outputPath, ticksPerBeat) as writer:
+        startTime = 0
+        for i, path in enumerate(midiPaths):
+            eventMid = readSmfFile(path)
+            eventTrack = eventMid.tracks[0]
+            events = eventTrack.events.copy()
+            if eventMid.ticksPerBeat != ticksPerBeat:
+                events["time"] = np.round(events["time"] * (ticksPerBeat / eventMid.ticksPerBeat)).astype(np.int64)
+            endTime = int(events["time"][-1]) if len(events) > 0 else 0
+
+            keep = ~eventTrack.endOfTrackMask()
+            if i > 0:
+                keep[:getBeginningMetaDataCount(eventTrack)] = False
+            events = events[keep]
+            events["time"] += startTime
+            writer.writeEvents(events, eventTrack.payload)
+
+            trackEnd = startTime + endTime
+            startTime = trackEnd + gapTicks
+            if alignToBars:
+                startTime = math.ceil(startTime / barLength) * barLength
+        if alignToBars:
+            trackEnd = math.ceil(trackEnd / barLength) * barLength
+        writer.close(endTime=trackEnd)
+
+    return outputPath
+
+def concatenateMidiFiles(sourceDir: str, outputDir: str, outputName: str = "concatenated.mid", order="name", gapTicks: int = 0, alignToBars: bool = False, beatsPerBar: int = 4) -> str:
+    """
+    Concatenates all midi files in sourceDir into a single midi file at outputDir/outputName.
+    See getSortedMidiFiles for order and streamConcatenateMidiFiles for the remaining options.
+    Returns the path of the concatenated file.
+    """
+    files = getSortedMidiFiles(sourceDir, order)
+    return streamConcatenateMidiFiles(files, f"{outputDir}/{outputName}", gapTicks, alignToBars, beatsPerBar)
 
 def getEndTime(track: mido.MidiTrack):
     absTime = 0
@@ -0,0 +1,362 @@
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.cache import DiskCache, hashKey
+from midiUtils.dataAug import transformMidiFiles, checkOutputNames
+from midiUtils.sharedPool import SharedSeedPool, initSharedPoolWorker, getWorkerRetriever
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+"""
+Checkpointed, resumable batch augmentation jobs.
+A job shards its input files and keeps a journal (a SQLite database) of the job's params, its shards and their state.
+Workers claim pending shards from the journal, run them with transformMidiFiles and mark them as done; a job that
+stopped (or crashed) resumes from the shards that are not done yet. Every file gets the same random stream
+(see dataAug.getFileRng) whatever its shard and worker, so a resumed job writes the same outputs as an uninterrupted one.
+
+Several processes, on one machine or on several machines sharing a filesystem, can run the same job: claims are
+SQLite transactions, so every shard is claimed by one worker at a time. This relies on SQLite's file locking,
+which some network filesystems do not implement correctly.
+A claimed shard is leased for leaseSeconds, and its worker renews the lease while it runs (see LeaseRenewer); if the worker
+dies, the shard can be claimed again once the lease expires (or right away, after releaseShards). Running a shard again
+overwrites its outputs, so a shard that was cut short is simply redone. Every attempt writes its own manifest, which is
+moved into place only if its worker still holds the lease when the shard is marked as done.
+
+    job = AugmentationJob.create("job.sqlite", midiPaths, outputDir, ser, seed=0, numReplacements=2)
+    job.runWorker(ser)  # on any number of processes or machines, with a retriever of the same seed pool
+"""
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    worker TEXT,
+    leaseUntil REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS files (shard INTEGER NOT NULL, position INTEGER NOT NULL, path TEXT NOT NULL, PRIMARY KEY (shard, position));
+"""
+
+def getWorkerId() -> str:
+    """
+    Returns an id unique to this process: host name, process id and a random suffix.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class AugmentationJob:
+    def __init__(self, journalPath, timeout: float = 60.0):
+        """
+        Opens the journal of an existing job. Use create to start a new one.
+        timeout is how long to wait for another worker's lock on the journal, in seconds.
+        """
+        self.journalPath = str(journalPath)
+        if not os.path.exists(self.journalPath):
+            raise FileNotFoundError(f"Journal {self.journalPath} does not exist.")
+        # autocommit; write transactions are started explicitly
+        self._connection = sqlite3.connect(self.journalPath, timeout=timeout, isolation_level=None)
+        rows = self._connection.execute("SELECT key, value FROM job").fetchall()
+        if not rows:
+            raise ValueError(f"Journal {self.journalPath} holds no job.")
+        self.config = {key: json.loads(value) for key, value in rows}
+        self.numShards = self._connection.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+
+    @staticmethod
+    def create(journalPath, midiPaths: List[str], outputDir: str, ser: SeedExamplesRetriever, seed: int, numReplacements: int, shardSize: int = 64, manifestDir: str = None, rootDir: str = None, **params) -> "AugmentationJob":
+        """
+        Creates a job and its journal, or opens the job's journal if it already exists (to resume it).
+        params:
+        - midiPaths: the files to transform; they are sorted, so that the shards do not depend on the listing order
+        - outputDir, seed, numReplacements, rootDir and params (numAugmentations, trackIndex, preferredStyle, outOfStyleProb,
+          channel): see dataAug.transformMidiFiles
+        - ser: the job records the version and sampling config of its seed pool; workers must use the same
+        - shardSize: the number of input files per shard
+        - manifestDir: if specified, every shard writes its manifest (see manifest.py) to <manifestDir>/shard_<n>.npy
+        Raises a ValueError if the journal already holds a job with other params, or if two files would write to the same outputs.
+        """
+        if shardSize < 1:
+            raise ValueError("shardSize must be at least 1")
+        unknown = set(params) - {"numAugmentations", "trackIndex", "preferredStyle", "outOfStyleProb", "channel"}
+        if unknown:
+            raise ValueError(f"Unknown job params: {sorted(unknown)}")
+
+        paths = sorted(str(p) for p in midiPaths)
+        rootDir = None if rootDir is None else str(rootDir)
+        checkOutputNames(paths, rootDir)
+        config = {
+            "outputDir": str(outputDir),
+            "manifestDir": None if manifestDir is None else str(manifestDir),
+            "seed": seed,
+            "numReplacements": numReplacements,
+            "params": params,
+            "shardSize": shardSize,
+            "poolVersion": ser.getPoolVersion(),
+            "samplingConfig": json.loads(json.dumps(ser.getSamplingConfig(), sort_keys=True, default=str)),
+            "filesHash": hashKey(paths),
+            "rootDir": rootDir,
+        }
+
+        connection = sqlite3.connect(str(journalPath), isolation_level=None)
+        try:
+            connection.executescript(SCHEMA)
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute("SELECT key, value FROM job").fetchall()
+            if rows:
+                connection.execute("ROLLBACK")
+                existing = {key: json.loads(value) for key, value in rows}
+                if existing != config:
+                    changed = sorted(k for k in config if existing.get(k) != config[k])
+                    raise ValueError(f"Journal {journalPath} holds a job with other params: {changed}")
+            else:
+                connection.executemany("INSERT INTO job VALUES (?, ?)", [(k, json.dumps(v)) for k, v in config.items()])
+                numShards = (len(paths) + shardSize - 1) // shardSize
+                connection.executemany("INSERT INTO shards (shard, status) VALUES (?, ?)", [(s, PENDING) for s in range(numShards)])
+                connection.executemany("INSERT INTO files VALUES (?, ?, ?)", [(i // shardSize, i % shardSize, p) for i, p in enumerate(paths)])
+                connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return AugmentationJob(journalPath)
+
+    def getShardPaths(self, shard: int) -> List[str]:
+        return [row[0] for row in self._connection.execute("SELECT path FROM files WHERE shard = ? ORDER BY position", (shard,))]
+
+    def claimShard(self, workerId: str, leaseSeconds: float = 3600.0) -> Optional[int]:
+        """
+        Claims the first shard that is pending, or whose lease has expired. Returns None if there is none.
+        """
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute(
+                "SELECT shard FROM shards WHERE status = ? OR (status = ? AND leaseUntil < ?) ORDER BY shard LIMIT 1",
+                (PENDING, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE shards SET status = ?, worker = ?, leaseUntil = ?, attempts = attempts + 1 WHERE shard = ?",
+                    (RUNNING, workerId, now + leaseSeconds, row[0]),
+                )
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        return None if row is None else row[0]
+
+    def renewLease(self, shard: int, workerId: str, leaseSeconds: float = 3600.0) -> bool:
+        """
+        Extends the worker's lease of a running shard to leaseSeconds from now.
+        Returns False if the lease was lost (the shard was claimed by another worker).
+        """
+        cursor = self._connection.execute(
+            "UPDATE shards SET leaseUntil = ? WHERE shard = ? AND worker = ? AND status = ?",
+            (time.time() + leaseSeconds, shard, workerId, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def completeShard(self, shard: int, workerId: str) -> bool:
+        """
+        Marks a shard as done, and moves the manifest of the worker's attempt (see runShard) into place.
+        Returns False, and discards the attempt's manifest, if the worker's lease was lost (the shard was claimed by another worker).
+        """
+        attemptPath = self.__attemptManifestPath(shard, workerId) if self.config["manifestDir"] is not None else None
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self._connection.execute(
+                "UPDATE shards SET status = ?, leaseUntil = NULL, error = NULL WHERE shard = ? AND worker = ? AND status = ?",
+                (DONE, shard, workerId, RUNNING),
+            )
+            owned = cursor.rowcount == 1
+            # under the journal's write lock, so that no other worker completes the shard meanwhile
+            if owned and attemptPath is not None and os.path.exists(attemptPath):
+                os.replace(attemptPath, self.__manifestPath(shard))
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        if not owned and attemptPath is not None and os.path.exists(attemptPath):
+            os.remove(attemptPath)
+        return owned
+
+    def failShard(self, shard: int, workerId: str, error: str):
+        """
+        Puts a shard back to pending, recording the error.
+        """
+        self._connection.execute(
+            "UPDATE shards SET status = ?, worker = NULL, leaseUntil = NULL, error = ? WHERE shard = ? AND worker = ? AND status = ?",
+            (PENDING, error, shard, workerId, RUNNING),
+        )
+
+    def releaseShards(self) -> int:
+        """
+        Puts every running shard back to pending, without waiting for their leases to expire.
+        Only call this when no worker of the job is running. Returns the number of released shards.
+        """
+        cursor = self._connection.execute("UPDATE shards SET status = ?, worker = NULL, leaseUntil = NULL WHERE status = ?", (PENDING, RUNNING))
+        return cursor.rowcount
+
+    def getProgress(self) -> Dict[str, int]:
+        """
+        Returns the number of shards per status.
+        """
+        progress = {PENDING: 0, RUNNING: 0, DONE: 0}
+        for status, count in self._connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"):
+            progress[status] = count
+        return progress
+
+    def getErrors(self) -> Dict[int, str]:
+        return dict(self._connection.execute("SELECT shard, error FROM shards WHERE error IS NOT NULL"))
+
+    def isDone(self) -> bool:
+        return self.getProgress()[DONE] == self.numShards
+
+    def getManifestPaths(self) -> List[str]:
+        """
+        Returns the manifest paths of the shards that are done, in shard order.
+        """
+        if self.config["manifestDir"] is None:
+            return []
+        shards = [row[0] for row in self._connection.execute("SELECT shard FROM shards WHERE status = ? ORDER BY shard", (DONE,))]
+        return [self.__manifestPath(shard) for shard in shards]
+
+    def __manifestPath(self, shard: int) -> str:
+        return f"{self.config['manifestDir']}/shard_{shard:05d}.npy"
+
+    def __attemptManifestPath(self, shard: int, workerId: str) -> str:
+        return f"{self.config['manifestDir']}/shard_{shard:05d}.{hashKey(workerId)[:12]}.npy"
+
+    def checkRetriever(self, ser: SeedExamplesRetriever):
+        """
+        Raises a ValueError if ser does not have the seed pool and sampling config the job was created with.
+        """
+        if ser.getPoolVersion() != self.config["poolVersion"]:
+            raise ValueError("The retriever's seed pool is not the one the job was created with")
+        samplingConfig = self.config["samplingConfig"]
+        if (ser.dedupe, ser.maxDuplicateDistance) != (samplingConfig.get("dedupe"), samplingConfig.get("maxDuplicateDistance")):
+            raise ValueError(f"The retriever's dedupe settings are not the ones the job was created with: dedupe={samplingConfig.get('dedupe')}, maxDuplicateDistance={samplingConfig.get('maxDuplicateDistance')}")
+        if json.loads(json.dumps(ser.getSamplingConfig(), sort_keys=True, default=str)) != self.config["samplingConfig"]:
+            raise ValueError("The retriever's sampling config is not the one the job was created with")
+
+    def runShard(self, shard: int, ser: SeedExamplesRetriever, cache: DiskCache = None, workerId: str = None) -> List[str]:
+        """
+        Transforms the files of a shard, overwriting any outputs of a previous attempt.
+        With a workerId, the manifest is written to a file of the worker's own, which completeShard moves into place;
+        without one, it overwrites the shard's manifest.
+        """
+        config = self.config
+        manifestPath = None
+        if config["manifestDir"] is not None:
+            manifestPath = self.__manifestPath(shard) if workerId is None else self.__attemptManifestPath(shard, workerId)
+            # the manifest writer appends, so a previous attempt's rows must go
+            if os.path.exists(manifestPath):
+                os.remove(manifestPath)
+        return transformMidiFiles(self.getShardPaths(shard), config["outputDir"], config["numReplacements"], ser, config["seed"], manifestPath=manifestPath, cache=cache, rootDir=config["rootDir"], **config["params"])
+
+    def runWorker(self, ser: SeedExamplesRetriever, workerId: str = None, maxShards: int = None, leaseSeconds: float = 3600.0, cache: DiskCache = None) -> int:
+        """
+        Claims and runs shards until there are none left (or maxShards have been run). Returns the number of shards run.
+        A shard that raises is put back to pending with its error (see getErrors), and the exception is raised.
+        The lease of the running shard is renewed every leaseSeconds / 3 (see LeaseRenewer).
+        """
+        if leaseSeconds <= 0:
+            raise ValueError("leaseSeconds must be positive")
+        self.checkRetriever(ser)
+        workerId = workerId or getWorkerId()
+        os.makedirs(self.config["outputDir"], exist_ok=True)
+        if self.config["manifestDir"] is not None:
+            os.makedirs(self.config["manifestDir"], exist_ok=True)
+
+        shardsRun = 0
+        while maxShards is None or shardsRun < maxShards:
+            shard = self.claimShard(workerId, leaseSeconds)
+            if shard is None:
+                break
+            with LeaseRenewer(self.journalPath, shard, workerId, leaseSeconds):
+                try:
+                    self.runShard(shard, ser, cache, workerId)
+                except Exception as e:
+                    self.failShard(shard, workerId, f"{type(e).__name__}: {e}")
+                    raise
+            if not self.completeShard(shard, workerId):
+                print(f"Lost the lease of shard {shard}; it is being run by another worker")
+            shardsRun += 1
+        return shardsRun
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self) -> str:
+        progress = self.getProgress()
+        return f"AugmentationJob at {self.journalPath}: {progress[DONE]}/{self.numShards} shards done, {progress[RUNNING]} running"
+
+class LeaseRenewer:
+    def __init__(self, journalPath, shard: int, workerId: str, leaseSeconds: float):
+        """
+        Renews a worker's lease of a shard every leaseSeconds / 3, on a thread with its own connection to the journal,
+        from the start to the end of its with block. lost is set once the shard has been claimed by another worker.
+        """
+        self.journalPath = str(journalPath)
+        self.shard = shard
+        self.workerId = workerId
+        self.leaseSeconds = leaseSeconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __run(self):
+        with AugmentationJob(self.journalPath) as job:
+            while not self._stop.wait(self.leaseSeconds / 3):
+                try:
+                    if not job.renewLease(self.shard, self.workerId, self.leaseSeconds):
+                        self.lost = True
+                        return
+                except sqlite3.OperationalError as e:
+                    # the journal is locked by other workers for too long; the next renewal may get through
+                    print(f"Could not renew the lease of shard {self.shard}: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+def _runJobWorker(journalPath: str, leaseSeconds: float, cacheDir: str, cacheMaxBytes: int) -> int:
+    cache = DiskCache(cacheDir, cacheMaxBytes) if cacheDir is not None else None
+    with AugmentationJob(journalPath) as job:
+        return job.runWorker(getWorkerRetriever(), leaseSeconds=leaseSeconds, cache=cache)
+
+def runJobInProcesses(journalPath, ser: SeedExamplesRetriever, numProcesses: int = None, leaseSeconds: float = 3600.0, cache: DiskCache = None, retrieverKwargs: dict = None) -> int:
+    """
+    Runs the job on numProcesses local worker processes (by default, one per cpu), which share ser's parsed seed pool
+    (see sharedPool.py). retrieverKwargs are the sampling params of the workers' retrievers (see SeedExamplesRetriever).
+    Returns the number of shards run.
+    """
+    numProcesses = numProcesses or os.cpu_count() or 1
+    with AugmentationJob(journalPath) as job:
+        job.checkRetriever(ser)
+    cacheDir = cache.dir if cache is not None else None
+    cacheMaxBytes = cache.maxBytes if cache is not None else None
+    with SharedSeedPool.publish(ser) as shared:
+        with ProcessPoolExecutor(max_workers=numProcesses, initializer=initSharedPoolWorker, initargs=(shared.info, retrieverKwargs)) as executor:
+            futures = [executor.submit(_runJobWorker, str(journalPath), leaseSeconds, cacheDir, cacheMaxBytes) for _ in range(numProcesses)]
+            return sum(f.result() for f in futures)
@@ -0,0 +1,176 @@
+import os
+import numpy as np
+
+from typing import Dict, Iterator, List, Tuple
+
+"""
+Append-only columnar manifest for batch data augmentation.
+
+A manifest file is a sequence of chunks. Each chunk is a fixed sequence of numpy arrays
+(written with np.save, no pickling), one per column. Rows are buffered in memory until
+chunkSize rows have been collected, so memory is bounded regardless of how many rows are written.
+
+Row columns (one entry per augmented file):
+- sourceFile, outputFile, preferredStyle, numReplacements
+Replacement columns (one entry per replaced voice, in row order):
+- seedFilename, voice, outOfStyle
+
+The replacements belonging to row i are found through the cumulative sum of numReplacements.
+"""
+
+ROW_COLUMNS = ["sourceFile", "outputFile", "preferredStyle", "numReplacements"]
+REPLACEMENT_COLUMNS = ["seedFilename", "voice", "outOfStyle"]
+MANIFEST_COLUMNS = ROW_COLUMNS + REPLACEMENT_COLUMNS
+
+class ManifestWriter:
+    """
+    Incrementally writes augmentation replacement info to an append-only manifest file.
+    Appending to an existing manifest is supported; previously written chunks are left untouched, and a truncated
+    trailing chunk (e.g. from a crashed writer) is cut off first, so that the rows appended after it can be read.
+    """
+    def __init__(self, path, chunkSize: int = 4096):
+        if chunkSize < 1:
+            raise ValueError("chunkSize must be at least 1")
+        self.path = path
+        self.chunkSize = chunkSize
+        self.rowsWritten = 0
+        if os.path.exists(path):
+            self._file = open(path, "r+b")
+            end = 0
+            try:
+                for _, end in _readChunks(self._file):
+                    pass
+            except ValueError:
+                self._file.close()
+                raise
+            self._file.seek(end)
+            self._file.truncate()
+        else:
+            self._file = open(path, "wb")
+        self._resetBuffer()
+
+    def _resetBuffer(self):
+        self._buffer = {column: [] for column in MANIFEST_COLUMNS}
+        self._bufferedRows = 0
+
+    def append(self, sourceFile: str, outputFile: str, preferredStyle: str, replacementInfo: List[Tuple[str, str]], outOfStyleFlags: List[bool]):
+        """
+        Buffers one row. replacementInfo is the list of (seed filename, voice) tuples returned by transformMidiFile,
+        outOfStyleFlags holds, for each replacement, whether the seed example was not of the preferred style.
+        """
+        if len(replacementInfo) != len(outOfStyleFlags):
+            raise ValueError(f"Got {len(replacementInfo)} replacements but {len(outOfStyleFlags)} out-of-style flags.")
+
+        self._buffer["sourceFile"].append(str(sourceFile))
+        self._buffer["outputFile"].append(str(outputFile))
+        self._buffer["preferredStyle"].append(str(preferredStyle))
+        self._buffer["numReplacements"].append(len(replacementInfo))
+        for (seedFilename, voice), outOfStyle in zip(replacementInfo, outOfStyleFlags):
+            self._buffer["seedFilename"].append(str(seedFilename))
+            self._buffer["voice"].append(str(voice))
+            self._buffer["outOfStyle"].append(bool(outOfStyle))
+
+        self._bufferedRows += 1
+        if self._bufferedRows >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows as a new chunk.
+        """
+        if self._bufferedRows == 0:
+            return
+        for column in MANIFEST_COLUMNS:
+            np.save(self._file, _toArray(column, self._buffer[column]), allow_pickle=False)
+        self._file.flush()
+        self.rowsWritten += self._bufferedRows
+        self._resetBuffer()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def __str__(self) -> str:
+        return f'ManifestWriter at "{self.path}", {self.rowsWritten} rows written'
+
+def _toArray(column: str, values: list) -> np.ndarray:
+    if column == "numReplacements":
+        return np.asarray(values, dtype=np.int16)
+    if column == "outOfStyle":
+        return np.asarray(values, dtype=bool)
+    if len(values) == 0:
+        return np.zeros(0, dtype="U1")
+    return np.asarray(values, dtype=str)
+
+def _readChunks(f) -> Iterator[Tuple[Dict[str, np.ndarray], int]]:
+    """
+    Yields every complete chunk of an open manifest, with the offset of its end.
+    A truncated trailing chunk is skipped; a chunk that cannot be read before the end of the file raises a ValueError.
+    """
+    size = os.fstat(f.fileno()).st_size
+    while f.tell() < size:
+        start = f.tell()
+        chunk = {}
+        try:
+            for column in MANIFEST_COLUMNS:
+                chunk[column] = np.load(f, allow_pickle=False)
+        except (EOFError, ValueError, OSError) as e:
+            if f.tell() >= size:
+                # a partially written chunk, which the next writer cuts off
+                return
+            raise ValueError(f"Manifest {f.name} is corrupt at byte {start}: {e}") from e
+        yield chunk, f.tell()
+
+def iterManifestChunks(path, columns: List[str] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Yields the manifest chunk by chunk, as dicts of column name to numpy array.
+    If columns is specified, only those columns are returned (all columns are still read from disk).
+    A truncated trailing chunk (e.g. from a crashed writer) is ignored; corruption anywhere else raises a ValueError.
+    """
+    columns = MANIFEST_COLUMNS if columns is None else columns
+    for c in columns:
+        if c not in MANIFEST_COLUMNS:
+            raise ValueError(f"Unknown manifest column {c}. Expected one of {MANIFEST_COLUMNS}")
+
+    with open(path, "rb") as f:
+        for chunk, _ in _readChunks(f):
+            yield {c: chunk[c] for c in columns}
+
+def readManifest(path, columns: List[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Reads a whole manifest into a dict of column name to numpy array.
+    Row columns and replacement columns have different lengths; see module docstring.
+    """
+    columns = MANIFEST_COLUMNS if columns is None else columns
+    parts = {c: [] for c in columns}
+    for chunk in iterManifestChunks(path, columns):
+        for c in columns:
+            parts[c].append(chunk[c])
+    return {c: np.concatenate(parts[c]) if parts[c] else _toArray(c, []) for c in columns}
+
+def getStyleBalance(path) -> Dict[str, Dict[str, int]]:
+    """
+    Returns, for each preferred style in the manifest, the number of augmented files
+    and the number of in-style and out-of-style replacements.
+    """
+    balance = {}
+    for chunk in iterManifestChunks(path, ["preferredStyle", "numReplacements", "outOfStyle"]):
+        styles = chunk["preferredStyle"]
+        # the preferred style of each replacement's row
+        replacementStyles = np.repeat(styles, chunk["numReplacements"])
+        outOfStyle = chunk["outOfStyle"]
+        for style in np.unique(styles):
+            stats = balance.setdefault(str(style), {"files": 0, "inStyle": 0, "outOfStyle": 0})
+            stats["files"] += int(np.count_nonzero(styles == style))
+            isStyle = replacementStyles == style
+            stats["outOfStyle"] += int(np.count_nonzero(isStyle & outOfStyle))
+            stats["inStyle"] += int(np.count_nonzero(isStyle & ~outOfStyle))
+    return balance
@@ -0,0 +1,58 @@
+import numpy as np
+
+"""
+Weighted sampling with Walker's alias method.
+Building a table takes O(n); every draw afterwards takes O(1): one uniform integer and one uniform float.
+"""
+
+class AliasTable:
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or len(weights) == 0:
+            raise ValueError("weights must be a non-empty 1 dimensional sequence")
+        if (weights < 0).any() or not np.isfinite(weights).all():
+            raise ValueError("weights must be finite and non-negative")
+        total = weights.sum()
+        if total <= 0:
+            raise ValueError("At least one weight must be positive")
+
+        n = len(weights)
+        self.probabilities = weights / total
+        scaled = self.probabilities * n
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        # Vose's variant: pair every under-full column with an over-full one
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # whatever is left is full up to rounding errors
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng: np.random.Generator) -> int:
+        """
+        Returns one index, drawn with probability proportional to its weight.
+        """
+        i = int(rng.integers(len(self.prob)))
+        return i if rng.random() < self.prob[i] else int(self.alias[i])
+
+    def sampleMany(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """
+        Returns size indices, drawn independently with probability proportional to their weights.
+        """
+        columns = rng.integers(len(self.prob), size=size)
+        keep = rng.random(size) < self.prob[columns]
+        return np.where(keep, columns, self.alias[columns])
+
+    def __len__(self):
+        return len(self.prob)
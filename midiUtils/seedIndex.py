@@ -0,0 +1,293 @@
+from midiUtils import timing
+
+import os
+import numpy as np
+
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+"""
+Indexes of the per-voice tracks of a seed pool.
+Every (filename, voice) track is fingerprinted by its onset hit map on a 16th note grid.
+"""
+
+def getVoiceFingerprint(example, voice: str, stepsPerBeat: int = 4, numSteps: int = 32) -> np.ndarray:
+    """
+    Returns the onset hit map of a voice of an AugSeedExample (see timing.getOnsetGrid).
+    """
+    return timing.getOnsetGrid(example.getVoiceEvents(voice), example.ticksPerBeat, stepsPerBeat, numSteps)
+
+class SeedIndex:
+    """
+    Finds exact and near duplicate voice tracks in a seed pool.
+    Two tracks of the same style and voice are duplicates if their fingerprints differ in at most maxDistance steps.
+    Tracks of different styles are never duplicates, so that deduping never takes a style's own tracks away.
+
+    Candidates are found by locality sensitive hashing: fingerprints are split into maxDistance + 1 bands, and tracks
+    are compared only if they share a band. By the pigeonhole principle, tracks within maxDistance of each other always
+    share at least one band, so no duplicate is missed.
+    Deduping visits the tracks in key order and compares each one with the kept tracks only. Kept tracks of a style and
+    voice are more than maxDistance apart, so few of them share a band, even a silent one: sparse voices (crash, tom),
+    whose tracks mostly share their empty bands, are not compared pair by pair. Listing every duplicate pair
+    (getDuplicates) does compare them, and is only done on demand.
+    """
+    def __init__(self, examples: list, maxDistance: int = 0, stepsPerBeat: int = 4, numSteps: int = 32, fingerprintCache: dict = None):
+        """
+        fingerprintCache, if given, maps (filename, voice) to fingerprints computed before (with the same grid):
+        they are used instead of being computed again, and new fingerprints are added to it.
+        """
+        if maxDistance < 0 or maxDistance >= numSteps:
+            raise ValueError(f"maxDistance must be between 0 and {numSteps - 1}")
+        self.maxDistance = maxDistance
+        self.stepsPerBeat = stepsPerBeat
+        self.numSteps = numSteps
+
+        # track keys, sorted so that the first track of a duplicate group is deterministic
+        self.keys = []
+        self.styles = []
+        fingerprints = []
+        for ae in sorted(examples, key=lambda ae: ae.filename):
+            for voice in ae.voices:
+                self.keys.append((ae.filename, voice))
+                self.styles.append(ae.style)
+                fingerprint = None if fingerprintCache is None else fingerprintCache.get((ae.filename, voice))
+                if fingerprint is None:
+                    fingerprint = getVoiceFingerprint(ae, voice, stepsPerBeat, numSteps)
+                    if fingerprintCache is not None:
+                        fingerprintCache[(ae.filename, voice)] = fingerprint
+                fingerprints.append(fingerprint)
+        self.fingerprints = np.array(fingerprints, dtype=bool).reshape(len(self.keys), numSteps)
+
+        self.groupKeys = [(style, key[1]) for style, key in zip(self.styles, self.keys)]
+        bandEdges = np.linspace(0, numSteps, maxDistance + 2).astype(int)
+        self.bands = [np.packbits(self.fingerprints[:, bandEdges[b]:bandEdges[b + 1]], axis=1) for b in range(maxDistance + 1)]
+        # the number of fingerprints compared to find the kept tracks
+        self.numComparisons = 0
+        self._keptTracks = self.__assignKeptTracks()
+        # built on first use
+        self._duplicatePairs = None
+
+    def __findDuplicatePairs(self) -> List[Tuple[int, int, int]]:
+        """
+        Returns (i, j, distance) pairs of track indices. Exact duplicates are paired with the first track of their
+        group only, so that large groups of identical tracks do not produce a quadratic number of pairs.
+        """
+        groupKeys = self.groupKeys
+        packed = np.packbits(self.fingerprints, axis=1)
+
+        exactGroups = defaultdict(list)
+        for i in range(len(self.keys)):
+            exactGroups[(groupKeys[i], packed[i].tobytes())].append(i)
+
+        pairs = []
+        representatives = []
+        for members in exactGroups.values():
+            representatives.append(members[0])
+            pairs.extend((members[0], m, 0) for m in members[1:])
+
+        if self.maxDistance == 0:
+            return sorted(pairs)
+
+        buckets = defaultdict(list)
+        for b, bands in enumerate(self.bands):
+            for r in representatives:
+                buckets[(groupKeys[r], b, bands[r].tobytes())].append(r)
+
+        candidatePairs = set()
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    candidatePairs.add((min(members[x], members[y]), max(members[x], members[y])))
+
+        for i, j in candidatePairs:
+            distance = int(np.count_nonzero(self.fingerprints[i] != self.fingerprints[j]))
+            if distance <= self.maxDistance:
+                pairs.append((i, j, distance))
+        return sorted(pairs)
+
+    def getDuplicates(self) -> List[Tuple[Tuple[str, str], Tuple[str, str], int]]:
+        """
+        Returns every duplicate pair as ((filename, voice), (filename, voice), distance).
+        There can be a quadratic number of them in a sparse voice (see the class docstring).
+        """
+        if self._duplicatePairs is None:
+            self._duplicatePairs = self.__findDuplicatePairs()
+        return [(self.keys[i], self.keys[j], d) for i, j, d in self._duplicatePairs]
+
+    def __assignKeptTracks(self) -> List[int]:
+        """
+        Returns, for every track, the index of the track kept in its place (its own index if it is kept).
+        Tracks are visited in key order, and a track is skipped only if it is within maxDistance of a track kept before
+        it (the first one, in key order): being a duplicate is not transitive, so a chain of near duplicates does not
+        take away distinct tracks.
+        """
+        kept = list(range(len(self.keys)))
+        # the first track of every exact duplicate group, and the kept tracks by band
+        firstOfGroup = {}
+        buckets = defaultdict(list)
+        packed = np.packbits(self.fingerprints, axis=1)
+        for i in range(len(self.keys)):
+            exactKey = (self.groupKeys[i], packed[i].tobytes())
+            if exactKey in firstOfGroup:
+                # identical to an earlier track, so as close to the track kept in its place
+                kept[i] = kept[firstOfGroup[exactKey]]
+                continue
+            firstOfGroup[exactKey] = i
+
+            bandKeys = [(self.groupKeys[i], b, bands[i].tobytes()) for b, bands in enumerate(self.bands)]
+            if self.maxDistance > 0:
+                candidates = sorted(set(c for k in bandKeys for c in buckets.get(k, ())))
+                if candidates:
+                    self.numComparisons += len(candidates)
+                    distances = np.count_nonzero(self.fingerprints[candidates] != self.fingerprints[i], axis=1)
+                    close = np.flatnonzero(distances <= self.maxDistance)
+                    if len(close) > 0:
+                        kept[i] = candidates[close[0]]
+                        continue
+                for k in bandKeys:
+                    buckets[k].append(i)
+        return kept
+
+    def getDuplicateGroups(self) -> List[List[Tuple[str, str]]]:
+        """
+        Returns the groups of a kept track and the tracks skipped in its place (see getRedundantTracks), each sorted by filename.
+        """
+        groups = defaultdict(list)
+        for i, k in enumerate(self._keptTracks):
+            groups[k].append(i)
+        return [[self.keys[i] for i in sorted(g)] for g in groups.values() if len(g) > 1]
+
+    def getRedundantTracks(self) -> Set[Tuple[str, str]]:
+        """
+        Returns the tracks that can be skipped: tracks within maxDistance of a track that is kept, of the same style
+        and voice and first in filename order.
+        """
+        return set(self.keys[i] for i, k in enumerate(self._keptTracks) if k != i)
+
+    def getRedundantFiles(self) -> List[str]:
+        """
+        Returns the filenames whose every voice track is redundant.
+        """
+        redundant = self.getRedundantTracks()
+        voicesByFile = defaultdict(list)
+        for key in self.keys:
+            voicesByFile[key[0]].append(key)
+        return sorted(f for f, keys in voicesByFile.items() if all(k in redundant for k in keys))
+
+    def getReport(self) -> Dict[str, int]:
+        return {
+            "tracks": len(self.keys),
+            "duplicateGroups": len(self.getDuplicateGroups()),
+            "comparisons": self.numComparisons,
+            "redundantTracks": len(self.getRedundantTracks()),
+            "redundantFiles": len(self.getRedundantFiles()),
+        }
+
+    def __str__(self) -> str:
+        return f"SeedIndex of {len(self.keys)} tracks with maxDistance {self.maxDistance}: {self.getReport()}"
+
+def removeRedundantFiles(dir: str, index: SeedIndex, dryRun: bool = True) -> List[str]:
+    """
+    Deletes the files of dir whose every voice is a duplicate of another file's (see SeedIndex.getRedundantFiles).
+    With dryRun, only returns the paths that would be deleted.
+    """
+    paths = [f"{dir}/{f}" for f in index.getRedundantFiles()]
+    if not dryRun:
+        for p in paths:
+            os.remove(p)
+    return paths
+
+def getMetricalLevels(numSteps: int, stepsPerBeat: int) -> np.ndarray:
+    """
+    Returns the metrical level of every grid step: 0 on the beat, 1 on the half beat, 2 anywhere else.
+    """
+    position = np.arange(numSteps) % stepsPerBeat
+    halfBeat = stepsPerBeat // 2 if stepsPerBeat % 2 == 0 else -1
+    return np.where(position == 0, 0, np.where(position == halfBeat, 1, 2))
+
+def getRhythmFeatures(track, ticksPerBeat: int, pitches: list = None, stepsPerBeat: int = 4, beatsPerBar: int = 4, numSteps: int = 32) -> np.ndarray:
+    """
+    Returns a rhythm feature vector of an EventTrack (optionally only of the given pitches):
+    - onset density: the fraction of grid steps with an onset
+    - syncopation: the mean metrical level of the onsets (see getMetricalLevels), from 0 (all on the beat) to 1
+    - the onset histogram over the grid steps of a bar, normalized to sum to 1
+    """
+    grid = timing.getOnsetGrid(track, ticksPerBeat, stepsPerBeat, numSteps, pitches)
+    stepsPerBar = stepsPerBeat * beatsPerBar
+    features = np.zeros(2 + stepsPerBar)
+    hits = np.flatnonzero(grid)
+    if len(hits) == 0:
+        return features
+
+    features[0] = len(hits) / numSteps
+    features[1] = getMetricalLevels(numSteps, stepsPerBeat)[hits].mean() / 2
+    features[2:] = np.bincount(hits % stepsPerBar, minlength=stepsPerBar) / len(hits)
+    return features
+
+class VoiceFeatureIndex:
+    """
+    Nearest neighbour index of the rhythm features (see getRhythmFeatures) of every (filename, voice) track in a seed pool.
+    """
+    def __init__(self, examples: list, featureCache: dict = None):
+        """
+        featureCache, if given, maps (filename, voice) to features computed before: they are used instead of being
+        computed again, and new features are added to it.
+        """
+        self.keys = []
+        features = []
+        for ae in sorted(examples, key=lambda ae: ae.filename):
+            for voice in ae.voices:
+                self.keys.append((ae.filename, voice))
+                feature = None if featureCache is None else featureCache.get((ae.filename, voice))
+                if feature is None:
+                    feature = getRhythmFeatures(ae.getVoiceEvents(voice), ae.ticksPerBeat)
+                    if featureCache is not None:
+                        featureCache[(ae.filename, voice)] = feature
+                features.append(feature)
+        self.features = np.array(features, dtype=np.float64).reshape(len(self.keys), -1)
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+
+    def getRows(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        return np.array([self._rows[k] for k in keys], dtype=np.int64)
+
+    def getDistances(self, query: np.ndarray, keys: List[Tuple[str, str]] = None) -> np.ndarray:
+        """
+        Returns the squared euclidean distances from query to the features of keys (or of every track).
+        If query is 2 dimensional (one query per row), returns a (queries, tracks) matrix.
+        """
+        features = self.features if keys is None else self.features[self.getRows(keys)]
+        query = np.asarray(query, dtype=np.float64)
+        if query.ndim == 1:
+            return ((features - query) ** 2).sum(axis=1)
+        distances = (query ** 2).sum(axis=1)[:, None] - 2 * query @ features.T + (features ** 2).sum(axis=1)[None, :]
+        return np.maximum(distances, 0)
+
+    def topK(self, query: np.ndarray, k: int, keys: List[Tuple[str, str]] = None) -> List[Tuple[str, str]]:
+        """
+        Returns the k tracks (among keys, or among all tracks) closest to query, closest first.
+        """
+        keys = self.keys if keys is None else keys
+        distances = self.getDistances(query, keys)
+        k = min(k, len(keys))
+        if k == 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.lexsort((nearest, distances[nearest]))]
+        return [keys[i] for i in nearest]
+
+    def topKByVoice(self, queries: Dict[str, np.ndarray], k: int, keys: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        Like topK, but each track is compared to the query of its own voice.
+        """
+        k = min(k, len(keys))
+        if k == 0:
+            return []
+        features = self.features[self.getRows(keys)]
+        queryMatrix = np.array([queries[voice] for _, voice in keys], dtype=np.float64)
+        distances = ((features - queryMatrix) ** 2).sum(axis=1)
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.lexsort((nearest, distances[nearest]))]
+        return [keys[i] for i in nearest]
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,242 @@
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.dataAug import transformMidiFile, midiFileToBytes
+from midiUtils.sharedPool import SharedSeedPool, initSharedPoolWorker, getWorkerRetriever
+
+import asyncio
+import functools
+import io
+import os
+import tempfile
+import mido
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+"""
+An asyncio front-end for augmentation (transformMidiFile) and preview rendering (synth.midi_to_audio),
+for services whose event loop must not block on CPU work.
+- CPU work runs in a process pool, whose workers share the parsed seed pool (see sharedPool.py).
+- At most maxConcurrency calls run at once; at most maxPending requests wait for one. When the queue is full,
+  callers wait for room (or get ServiceBusy with wait=False), which pushes back on whoever feeds the service.
+- Concurrent transform requests are coalesced into batches of up to batchSize, waiting at most batchDelay seconds
+  for a batch to fill, so that many small requests share one round trip to a worker.
+- Cancelling a request that has not been dispatched yet drops it from its batch. A dispatched request cannot be
+  interrupted in its worker; its result is discarded. Closing the service cancels every request not dispatched yet,
+  including those of the batch being filled, and waits for the dispatched ones.
+With inProcess=True, calls run in a thread pool of this process instead, which is enough to test a service locally.
+"""
+
+class ServiceBusy(Exception):
+    pass
+
+def transformRequests(requests: List[dict], ser: SeedExamplesRetriever = None) -> List[Tuple[bool, object]]:
+    """
+    Runs a batch of transform requests (see AugmentationService.transform). Uses the worker's shared retriever if ser is None.
+    Returns (True, (midi bytes, replacement info)) or (False, exception) for every request, so that one bad request
+    does not fail its whole batch.
+    """
+    ser = ser if ser is not None else getWorkerRetriever()
+    results = []
+    for r in requests:
+        try:
+            mid = mido.MidiFile(file=io.BytesIO(r["midiBytes"]))
+            rng = np.random.default_rng(r["seed"])
+            newMid, replacementInfo = transformMidiFile(mid, r["trackIndex"], r["numReplacements"], ser, rng, r["preferredStyle"], r["outOfStyleProb"], r["channel"], similarityTopK=r["similarityTopK"])
+            results.append((True, (midiFileToBytes(newMid), replacementInfo)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+def renderMidiBytes(midiBytes: bytes, sr: int) -> bytes:
+    """
+    Renders midi file contents to wav file contents with synth.midi_to_audio.
+    """
+    from midiUtils import synth
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        sourcePath = f"{tmpDir}/preview.mid"
+        with open(sourcePath, "wb") as f:
+            f.write(midiBytes)
+        synth.midi_to_audio(sourcePath, tmpDir, prefix="", sr=sr)
+        with open(f"{tmpDir}/preview.wav", "rb") as f:
+            return f.read()
+
+class AugmentationService:
+    def __init__(self, ser: SeedExamplesRetriever, maxWorkers: int = None, maxConcurrency: int = None, maxPending: int = 256, batchSize: int = 8, batchDelay: float = 0.005, inProcess: bool = False, renderer: Callable[[bytes, int], bytes] = renderMidiBytes, retrieverKwargs: dict = None):
+        """
+        - ser: the seed examples retriever; published to the workers once, when the service starts
+        - maxWorkers: the number of worker processes (or threads with inProcess); defaults to the number of cpus
+        - maxConcurrency: the maximum number of batches and renders running at once; defaults to maxWorkers
+        - renderer: turns midi bytes and a sample rate into audio bytes; must be picklable unless inProcess
+        - retrieverKwargs: overrides of ser's sampling params (see SeedExamplesRetriever); by default, requests are
+          sampled like ser would, in worker processes as in process
+        """
+        if batchSize < 1:
+            raise ValueError("batchSize must be at least 1")
+        self.ser = ser
+        self.maxWorkers = maxWorkers or os.cpu_count() or 1
+        self.maxConcurrency = maxConcurrency or self.maxWorkers
+        self.maxPending = maxPending
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.inProcess = inProcess
+        self.renderer = renderer
+        self.retrieverKwargs = retrieverKwargs or {}
+
+        self.submitted = 0
+        self.completed = 0
+        self.batches = 0
+        self.cancelled = 0
+
+        self._executor = None
+        self._sharedPool = None
+        self._queue = None
+        self._slots = None
+        self._dispatcher = None
+        self._retriever = None
+        # the requests taken off the queue by the dispatcher but not handed to a batch yet
+        self._batch = []
+        self._running = set()
+
+    async def start(self):
+        if self._executor is not None:
+            return
+        if self.inProcess:
+            self._executor = ThreadPoolExecutor(max_workers=self.maxWorkers)
+            self._retriever = self.ser
+            if self.retrieverKwargs:
+                ser = self.ser
+                self._retriever = SeedExamplesRetriever(ser.dir, ser.dedupe, ser.maxDuplicateDistance, pool=ser._pool, **{**ser.getSamplingParams(), **self.retrieverKwargs})
+        else:
+            self._sharedPool = SharedSeedPool.publish(self.ser)
+            self._executor = ProcessPoolExecutor(max_workers=self.maxWorkers, initializer=initSharedPoolWorker, initargs=(self._sharedPool.info, self.retrieverKwargs))
+        self._queue = asyncio.Queue(maxsize=self.maxPending)
+        self._slots = asyncio.Semaphore(self.maxConcurrency)
+        self._dispatcher = asyncio.create_task(self.__dispatch())
+
+    async def close(self):
+        """
+        Cancels pending requests, waits for running calls to finish, and shuts the workers down.
+        """
+        if self._executor is None:
+            return
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        for _, future in self._batch:
+            future.cancel()
+        self._batch = []
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        if self._sharedPool is not None:
+            self._sharedPool.close()
+            self._sharedPool = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def transform(self, midiBytes: bytes, numReplacements: int, seed: int, trackIndex: int = 0, preferredStyle: str = None, outOfStyleProb: float = 0.0, channel: int = 9, similarityTopK: int = None, wait: bool = True) -> Tuple[bytes, list]:
+        """
+        Async version of transformMidiFile on midi file contents, with a random number generator seeded by seed.
+        Returns the transformed file's contents and the replacement info.
+        If wait is False and the queue is full, raises ServiceBusy instead of waiting for room.
+        """
+        if self._executor is None:
+            raise Exception("The service must be started first.")
+        request = {
+            "midiBytes": bytes(midiBytes),
+            "numReplacements": numReplacements,
+            "seed": seed,
+            "trackIndex": trackIndex,
+            "preferredStyle": preferredStyle,
+            "outOfStyleProb": outOfStyleProb,
+            "channel": channel,
+            "similarityTopK": similarityTopK,
+        }
+        future = asyncio.get_running_loop().create_future()
+        if wait:
+            await self._queue.put((request, future))
+        else:
+            try:
+                self._queue.put_nowait((request, future))
+            except asyncio.QueueFull:
+                raise ServiceBusy(f"{self.maxPending} requests are already pending")
+        self.submitted += 1
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            future.cancel()
+            raise
+
+    async def render(self, midiBytes: bytes, sr: int = 44100) -> bytes:
+        """
+        Async preview rendering of midi file contents (see renderMidiBytes). Renders are not batched.
+        """
+        if self._executor is None:
+            raise Exception("The service must be started first.")
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.renderer, bytes(midiBytes), sr)
+
+    async def __dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self.batchDelay
+            while len(batch) < self.batchSize:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self._batch = batch = [(request, future) for request, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            # waiting for a free slot here stops the queue from draining, which is what pushes back on callers
+            await self._slots.acquire()
+            self._batch = []
+            task = asyncio.create_task(self.__runBatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def __runBatch(self, batch):
+        try:
+            requests = [request for request, _ in batch]
+            if self.inProcess:
+                call = functools.partial(transformRequests, requests, self._retriever)
+            else:
+                call = functools.partial(transformRequests, requests)
+            self.batches += 1
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, call)
+            for (_, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                    self.completed += 1
+                else:
+                    future.set_exception(value)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def __str__(self) -> str:
+        return f"AugmentationService with {self.maxWorkers} workers: {self.submitted} submitted, {self.completed} completed in {self.batches} batches, {self.cancelled} cancelled"
@@ -0,0 +1,141 @@
+from midiUtils.augExamples import AugSeedExample, SeedExamplesRetriever, SeedPool
+from midiUtils.eventTrack import EVENT_DTYPE, EventTrack
+
+import numpy as np
+
+from multiprocessing import shared_memory
+from typing import List
+
+"""
+A seed pool that is parsed once and shared between worker processes.
+The parent publishes the voice tracks of every example as one structured array (see EVENT_DTYPE) in shared memory.
+Workers attach to it by name: their voice tracks are read-only views of the shared array, so memory use per worker
+does not grow with the seed pool, and the seed files are never parsed again.
+
+    with SharedSeedPool.publish(ser) as shared:
+        with ProcessPoolExecutor(initializer=initSharedPoolWorker, initargs=(shared.info,)) as executor:
+            ...  # in the workers, getWorkerRetriever() returns a SeedExamplesRetriever over the shared pool
+"""
+
+class SharedSeedPool:
+    def __init__(self, shm: shared_memory.SharedMemory, info: dict, owner: bool):
+        self._shm = shm
+        self.info = info
+        self.owner = owner
+        self.events = np.ndarray((info["numEvents"],), dtype=EVENT_DTYPE, buffer=shm.buf)
+        if not owner:
+            self.events.flags.writeable = False
+
+    @staticmethod
+    def publish(ser: SeedExamplesRetriever, name: str = None) -> "SharedSeedPool":
+        """
+        Copies the voice tracks of every example of ser into a new shared memory block.
+        The returned pool owns the block: it is unlinked when the pool is closed (or its with block ends).
+        """
+        examples = sorted((ae for style in ser.styles for ae in ser.getExamplesByStyle(style)), key=lambda ae: ae.filename)
+        tracks = []
+        exampleInfo = []
+        start = 0
+        for ae in examples:
+            voices = {}
+            for voice in ae.voices:
+                events = ae.getVoiceEvents(voice).events
+                voices[voice] = (start, start + len(events))
+                tracks.append(events)
+                start += len(events)
+            exampleInfo.append({"filename": ae.filename, "style": ae.style, "midi_path": str(ae.midi_path), "ticksPerBeat": ae.ticksPerBeat, "contentHash": ae.contentHash, "voices": voices})
+
+        allEvents = np.concatenate(tracks) if tracks else np.zeros(0, dtype=EVENT_DTYPE)
+        # voice tracks only hold notes and the end of track, so there is no payload to share
+        if (allEvents["length"] > 0).any():
+            raise ValueError("Voice tracks must not have meta or sysex payloads")
+        allEvents["offset"] = 0
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(allEvents.nbytes, 1))
+        pool = ser._pool
+        info = {
+            "name": shm.name,
+            "numEvents": len(allEvents),
+            "dir": str(ser.dir),
+            "fileStats": dict(pool.fileStats),
+            "dedupe": ser.dedupe,
+            "maxDuplicateDistance": ser.maxDuplicateDistance,
+            "samplingParams": ser.getSamplingParams(),
+            "poolVersion": ser.getPoolVersion(),
+            "examples": exampleInfo,
+        }
+        shared = SharedSeedPool(shm, info, owner=True)
+        shared.events[:] = allEvents
+        return shared
+
+    @staticmethod
+    def attach(info: dict) -> "SharedSeedPool":
+        """
+        Attaches to a pool published by another process, given its info.
+        """
+        return SharedSeedPool(shared_memory.SharedMemory(name=info["name"]), info, owner=False)
+
+    def getExamples(self) -> List[AugSeedExample]:
+        """
+        Returns AugSeedExamples whose voice tracks are views of the shared array.
+        """
+        examples = []
+        for e in self.info["examples"]:
+            voiceEvents = {voice: EventTrack(self.events[start:stop], b"") for voice, (start, stop) in e["voices"].items()}
+            examples.append(AugSeedExample(e["midi_path"], e["style"], voiceEvents=voiceEvents, ticksPerBeat=e["ticksPerBeat"], contentHash=e["contentHash"]))
+        return examples
+
+    def getRetriever(self, **kwargs) -> SeedExamplesRetriever:
+        """
+        Returns a SeedExamplesRetriever over the shared examples, which samples like the published retriever.
+        kwargs override its sampling params (see SeedExamplesRetriever).
+        Reloading the retriever reads changed files from disk into process memory, like a regular retriever.
+        """
+        info = self.info
+        pool = SeedPool(info["dir"], self.getExamples(), info["fileStats"], info["dedupe"], info["maxDuplicateDistance"])
+        pool.poolVersion = info["poolVersion"]
+        return SeedExamplesRetriever(info["dir"], info["dedupe"], info["maxDuplicateDistance"], pool=pool, **{**info["samplingParams"], **kwargs})
+
+    def close(self):
+        """
+        Detaches from the shared memory, and frees it if this process published it.
+        Views returned by getExamples or getRetriever must not be used afterwards.
+        """
+        if self._shm is None:
+            return
+        self.events = None
+        if self.owner:
+            self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            # views are still referenced; the mapping is released when they are garbage collected
+            pass
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self) -> str:
+        return f'SharedSeedPool "{self.info["name"]}" of {len(self.info["examples"])} examples and {self.info["numEvents"]} events'
+
+# the shared pool and retriever of a worker process, set by initSharedPoolWorker
+_workerPool = None
+_workerRetriever = None
+
+def initSharedPoolWorker(info: dict, retrieverKwargs: dict = None):
+    """
+    Process pool initializer: attaches the worker to a published pool and builds its retriever.
+    retrieverKwargs override the sampling params of the published retriever (see SharedSeedPool.getRetriever).
+    """
+    global _workerPool, _workerRetriever
+    _workerPool = SharedSeedPool.attach(info)
+    _workerRetriever = _workerPool.getRetriever(**(retrieverKwargs or {}))
+
+def getWorkerRetriever() -> SeedExamplesRetriever:
+    if _workerRetriever is None:
+        raise Exception("This process was not initialized with initSharedPoolWorker.")
+    return _workerRetriever
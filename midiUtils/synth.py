@@ -1,32 +1,198 @@
-import soundfile as sf
 import sys
 import os
+import io
+import shutil
+import functools
 
-from pretty_midi import PrettyMIDI
+# pretty_midi and soundfile are imported on first use, so that importing this module stays cheap
 
 SR = 44100
 SF_PATH = os.path.dirname(__file__) + "/Standard_Drum_Kit.sf2"
+AUDIO_FORMAT = "WAV"
+AUDIO_SUBTYPE = "PCM_24"
+CACHE_FILENAME = "audio.wav"
 
-def synthesize_all(source_dir, audio_dir, prefix=""):
+def synthesize_all(source_dir, audio_dir, prefix="", sr=SR, bank=None, cache=None):
+    """
+    If cache (a cache.DiskCache) is given, renders are looked up in and stored to it (see midi_to_audio).
+    Give the cache a maxBytes to bound its size; the least recently used renders are evicted first.
+    """
     if not os.path.exists(source_dir):
         raise FileNotFoundError(f"Directory {source_dir} does not exist.")
-    
+
     filesSytnhesized = 0
+    hitsBefore = cache.hits if cache is not None else 0
     for filename in os.listdir(source_dir):
         if filename.endswith(".mid"):
             midi_path = f"{source_dir}/{filename}"
-            midi_to_audio(midi_path, audio_dir, prefix=prefix)
+            midi_to_audio(midi_path, audio_dir, prefix=prefix, sr=sr, bank=bank, cache=cache)
             filesSytnhesized += 1
-    
-    print(f"Synthesized {filesSytnhesized} files to {audio_dir}")
 
-def midi_to_audio(source_path, audio_dir, prefix,sr=SR):
+    if cache is not None:
+        print(f"Synthesized {filesSytnhesized} files to {audio_dir} ({cache.hits - hitsBefore} from the cache)")
+    else:
+        print(f"Synthesized {filesSytnhesized} files to {audio_dir}")
+
+def midi_to_audio(source_path, audio_dir, prefix,sr=SR, bank=None, cache=None):
+    """
+    If bank (a drumRenderer.SampleBank) is given, the file is rendered from its samples instead of with FluidSynth.
+    If cache is given, a cached render of the same midi events (see get_render_cache_key) is hard linked
+    (or copied, where linking fails) to the output path instead of rendering the file again.
+    """
+    audio_path = f'{audio_dir}/{prefix}{getFilename(source_path)}.wav'
+    if cache is None:
+        with open(audio_path, "wb") as f:
+            f.write(render_audio_bytes(source_path, sr, bank))
+        return
+
+    key = get_render_cache_key(source_path, sr, bank)
+    entry_dir = cache.get(key)
+    if entry_dir is not None:
+        try:
+            link_or_copy(f"{entry_dir}/{CACHE_FILENAME}", audio_path)
+            return
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            pass
+    data = render_audio_bytes(source_path, sr, bank)
+    with open(audio_path, "wb") as f:
+        f.write(data)
+    cache.put(key, {CACHE_FILENAME: data})
+
+def midi_to_audio_bytes(source_path, sr=SR, bank=None, cache=None):
+    """
+    Like midi_to_audio, but returns the wav file's contents instead of writing them.
+    """
+    if cache is None:
+        return render_audio_bytes(source_path, sr, bank)
+
+    key = get_render_cache_key(source_path, sr, bank)
+    entry_dir = cache.get(key)
+    if entry_dir is not None:
+        try:
+            with open(f"{entry_dir}/{CACHE_FILENAME}", "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            pass
+    data = render_audio_bytes(source_path, sr, bank)
+    cache.put(key, {CACHE_FILENAME: data})
+    return data
+
+def render_audio_bytes(source_path, sr=SR, bank=None):
+    import soundfile as sf
+
+    if bank is not None:
+        from midiUtils.drumRenderer import renderDrums
+        if bank.sr != sr:
+            raise ValueError(f"The sample bank's rate {bank.sr} does not match sr {sr}")
+        audio = renderDrums(source_path, bank)
+    else:
+        from pretty_midi import PrettyMIDI
+        pm = PrettyMIDI(source_path)
+        audio = pm.fluidsynth(fs=sr, sf2_path=SF_PATH)
+
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sr, AUDIO_SUBTYPE, format=AUDIO_FORMAT)
+    return buffer.getvalue()
+
+def _synthesize_notes(notes, sr):
+    """
+    Synthesizes (velocity, pitch, start, end) drum notes with FluidSynth.
+    """
+    from pretty_midi import Instrument, Note
+    import numpy as np
+
+    if not notes:
+        return np.zeros(0)
+    instrument = Instrument(program=0, is_drum=True)
+    instrument.notes = [Note(*note) for note in notes]
+    return instrument.fluidsynth(fs=sr, sf2_path=SF_PATH)
+
+def render_stems(source_path, sr=SR, bank=None, voices=None, executor=None):
+    """
+    Renders one stem per voice of voices (by default, PERC_VOICES_MAPPING) from a single read of the midi file.
+    Returns the voice names and a (voices, samples) array, normalized by the peak of the stems' mix.
+    With a bank, all stems are mixed in one pass (see drumRenderer.renderStems). Otherwise FluidSynth still takes one
+    pass per voice, from the same parsed file: in this process, one voice after the other, or concurrently on executor
+    (a concurrent.futures executor, e.g. a process pool kept for a whole batch of files).
+    """
+    from midiUtils.constants import PERC_VOICES_MAPPING
+    import numpy as np
+
+    voices = voices if voices is not None else PERC_VOICES_MAPPING
+    if bank is not None:
+        from midiUtils.drumRenderer import renderStems
+        if bank.sr != sr:
+            raise ValueError(f"The sample bank's rate {bank.sr} does not match sr {sr}")
+        return renderStems(source_path, bank, voices)
+
+    from pretty_midi import PrettyMIDI
     pm = PrettyMIDI(source_path)
-    audio = pm.fluidsynth(fs=sr, sf2_path=SF_PATH)
+    notes = [(note.velocity, note.pitch, note.start, note.end) for instrument in pm.instruments for note in instrument.notes]
+    names = list(voices)
+    voice_notes = [[note for note in notes if note[1] in voices[name]] for name in names]
+    if executor is None:
+        waveforms = [_synthesize_notes(n, sr) for n in voice_notes]
+    else:
+        waveforms = list(executor.map(_synthesize_notes, voice_notes, [sr] * len(names)))
+    # like PrettyMIDI.fluidsynth, which lasts one second longer than the last note
+    length = max([len(w) for w in waveforms] + [int(np.ceil(sr * (pm.get_end_time() + 1)))])
+    stems = np.zeros((len(names), length))
+    for i, w in enumerate(waveforms):
+        stems[i, :len(w)] = w
+    peak = np.abs(stems.sum(axis=0)).max(initial=0)
+    if peak > 0:
+        stems /= peak
+    return names, stems
+
+def midi_to_stems(source_path, audio_dir, prefix, sr=SR, bank=None, voices=None, multichannel=True, executor=None):
+    """
+    Writes the stems of render_stems, either as one multichannel file (with a channel per voice, in the order of
+    the returned names) or as one file per voice. Returns the voice names.
+    """
+    import soundfile as sf
+
+    names, stems = render_stems(source_path, sr, bank, voices, executor)
+    filename = f'{audio_dir}/{prefix}{getFilename(source_path)}'
+    if multichannel:
+        sf.write(f'{filename}_stems.wav', stems.T, sr, AUDIO_SUBTYPE)
+    else:
+        for name, stem in zip(names, stems):
+            sf.write(f'{filename}_{name}.wav', stem, sr, AUDIO_SUBTYPE)
+    return names
+
+def get_render_cache_key(source_path, sr=SR, bank=None):
+    """
+    Returns the cache key of a render: a hash of the midi file's events, the SoundFont (or sample bank),
+    the sample rate and the output format. Files that only differ in their encoding (e.g. running status) share a key.
+    """
+    from midiUtils.cache import hashKey
+    from midiUtils.eventTrack import readSmfFile, writeSmfBytes
+
+    midi_bytes = writeSmfBytes(readSmfFile(source_path, useMmap=False))
+    instrument = ("bank", bank.getHash()) if bank is not None else ("soundfont", get_soundfont_hash(SF_PATH))
+    return hashKey("render", midi_bytes, instrument, sr, AUDIO_FORMAT, AUDIO_SUBTYPE)
+
+def get_soundfont_hash(sf2_path):
+    stat = os.stat(sf2_path)
+    return _hash_file(sf2_path, stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=8)
+def _hash_file(path, mtime_ns, size):
+    # keyed by mtime and size, so that a SoundFont is only hashed again when it changes
+    from midiUtils.cache import hashFile
+    return hashFile(path)
 
-    sf.write(f'{audio_dir}/{prefix}{getFilename(source_path)}.wav', audio, sr, 'PCM_24')
+def link_or_copy(source_path, target_path):
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
 
 def getFilename(midi_path):
     filename = midi_path.split("/")[-1]
     filename = filename.split(".")[0]
-    return filename
\ No newline at end of file
+    return filename
@@ -0,0 +1,158 @@
+from midiUtils.eventTrack import EventTrack
+
+import numpy as np
+
+from typing import List, Tuple, Union
+
+"""
+Vectorized timing transformations on EventTracks.
+Every function takes a list of tracks and processes all of their events in one set of array operations.
+Per-track parameters may be given as a scalar (same for every track) or as a sequence with one value per track.
+All of the maps used here are non-decreasing in time, so the order of events within a track is preserved.
+"""
+
+def stackTimes(tracks: List[EventTrack]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the absolute times of all tracks concatenated, and the index of the track each time belongs to.
+    """
+    if len(tracks) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    times = np.concatenate([t.times for t in tracks])
+    trackIndices = np.repeat(np.arange(len(tracks)), [len(t) for t in tracks])
+    return times, trackIndices
+
+def splitTimes(tracks: List[EventTrack], newTimes: np.ndarray) -> List[EventTrack]:
+    """
+    Inverse of stackTimes: returns copies of tracks with their times replaced by newTimes.
+    """
+    newTracks = []
+    start = 0
+    for t in tracks:
+        events = t.events.copy()
+        events["time"] = newTimes[start:start + len(t)]
+        newTracks.append(EventTrack(events, t.payload))
+        start += len(t)
+    return newTracks
+
+def perTrack(value: Union[float, List[float]], trackIndices: np.ndarray, numTracks: int) -> np.ndarray:
+    """
+    Broadcasts a scalar or per-track parameter to one value per event.
+    """
+    values = np.asarray(value, dtype=np.float64)
+    if values.ndim == 0:
+        return np.full(len(trackIndices), float(values))
+    if len(values) != numTracks:
+        raise ValueError(f"Expected a scalar or {numTracks} values, got {len(values)}.")
+    return values[trackIndices]
+
+def roundTicks(times: np.ndarray) -> np.ndarray:
+    """
+    Rounds half up (np.rint rounds half to even, which would snap 0.5 and 1.5 ticks differently).
+    """
+    return np.floor(times + 0.5).astype(np.int64)
+
+def scaleTime(tracks: List[EventTrack], factor: Union[float, List[float]]) -> List[EventTrack]:
+    """
+    Multiplies every absolute time by factor. A factor above 1 slows the tracks down (in ticks), below 1 speeds them up.
+    """
+    times, trackIndices = stackTimes(tracks)
+    factors = perTrack(factor, trackIndices, len(tracks))
+    if (factors <= 0).any():
+        raise ValueError("factor must be positive")
+    return splitTimes(tracks, roundTicks(times * factors))
+
+def requantizeResolution(tracks: List[EventTrack], fromTicksPerBeat: Union[int, List[int]], toTicksPerBeat: int) -> List[EventTrack]:
+    """
+    Rescales tracks from their ticks per beat to toTicksPerBeat.
+    """
+    times, trackIndices = stackTimes(tracks)
+    factors = toTicksPerBeat / perTrack(fromTicksPerBeat, trackIndices, len(tracks))
+    return splitTimes(tracks, roundTicks(times * factors))
+
+def swingTimes(times: np.ndarray, ratio: np.ndarray, gridTicks: np.ndarray) -> np.ndarray:
+    """
+    Maps times so that, within every pair of grid cells, the second cell starts at ratio of the pair instead of half way.
+    ratio 0.5 leaves the times unchanged; 2/3 gives a triplet swing.
+    Positions between grid lines are interpolated linearly, so the map is non-decreasing.
+    """
+    pairLength = 2 * gridTicks
+    position = np.mod(times, pairLength)
+    pairStart = times - position
+    onbeat = position < gridTicks
+    swungPosition = np.where(
+        onbeat,
+        position * 2 * ratio,
+        pairLength * ratio + (position - gridTicks) * 2 * (1 - ratio),
+    )
+    return pairStart + swungPosition
+
+def applySwing(tracks: List[EventTrack], ratio: Union[float, List[float]], gridTicks: Union[int, List[int]]) -> List[EventTrack]:
+    """
+    Applies swing (see swingTimes) on a grid of gridTicks (e.g. ticksPerBeat // 4 for 16th note swing).
+    """
+    times, trackIndices = stackTimes(tracks)
+    ratios = perTrack(ratio, trackIndices, len(tracks))
+    grids = perTrack(gridTicks, trackIndices, len(tracks))
+    if ((ratios <= 0) | (ratios >= 1)).any():
+        raise ValueError("ratio must be between 0 and 1")
+    if (grids <= 0).any():
+        raise ValueError("gridTicks must be positive")
+    return splitTimes(tracks, roundTicks(swingTimes(times.astype(np.float64), ratios, grids)))
+
+def quantize(tracks: List[EventTrack], gridTicks: Union[int, List[int]], strength: Union[float, List[float]] = 1.0, swing: Union[float, List[float]] = 0.5) -> List[EventTrack]:
+    """
+    Snaps note_on and note_off messages to the nearest line of a grid of gridTicks.
+    - strength: how far each note moves towards its grid line, from 0 (not at all) to 1 (fully snapped)
+    - swing: the grid lines are swung with this ratio (see swingTimes); 0.5 is a straight grid
+    Other messages keep their times; messages are then stably sorted by time, so that a note_off still follows its note_on,
+    and the end of track is moved after the last message if needed.
+    """
+    times, trackIndices = stackTimes(tracks)
+    grids = perTrack(gridTicks, trackIndices, len(tracks))
+    strengths = perTrack(strength, trackIndices, len(tracks))
+    swings = perTrack(swing, trackIndices, len(tracks))
+    if (grids <= 0).any():
+        raise ValueError("gridTicks must be positive")
+    if ((strengths < 0) | (strengths > 1)).any():
+        raise ValueError("strength must be between 0 and 1")
+    if ((swings <= 0) | (swings >= 1)).any():
+        raise ValueError("swing must be between 0 and 1")
+
+    floatTimes = times.astype(np.float64)
+    gridLines = np.floor(floatTimes / grids + 0.5) * grids
+    gridLines = swingTimes(gridLines, swings, grids)
+    snapped = roundTicks(floatTimes + strengths * (gridLines - floatTimes))
+
+    newTimes = times.copy()
+    isNote = np.concatenate([t.noteOnMask() | t.noteOffMask() for t in tracks]) if tracks else np.zeros(0, dtype=bool)
+    newTimes[isNote] = snapped[isNote]
+
+    newTracks = []
+    for t in splitTimes(tracks, newTimes):
+        isEot = t.endOfTrackMask()
+        if isEot.any() and (~isEot).any():
+            lastTime = t.times[~isEot].max()
+            t.events["time"][isEot] = np.maximum(t.times[isEot], lastTime)
+        # end of track messages sort after everything at the same time
+        order = np.lexsort((isEot, t.times))
+        newTracks.append(t.subset(order))
+    return newTracks
+
+def getOnsetSteps(track: EventTrack, ticksPerBeat: int, stepsPerBeat: int = 4, pitches: list = None) -> np.ndarray:
+    """
+    Returns the grid step (rounded to the nearest step) of every note_on with a non-zero velocity,
+    optionally only for the given pitches.
+    """
+    mask = track.noteOnMask() & (track.velocities > 0)
+    if pitches is not None:
+        mask &= np.isin(track.notes, np.asarray(pitches, dtype=np.int64))
+    return roundTicks(track.times[mask] * (stepsPerBeat / ticksPerBeat))
+
+def getOnsetGrid(track: EventTrack, ticksPerBeat: int, stepsPerBeat: int = 4, numSteps: int = 32, pitches: list = None) -> np.ndarray:
+    """
+    Returns a boolean hit map of numSteps grid steps (32 16th notes, i.e. 2 bars of 4/4, by default).
+    Onsets past the last step wrap around, so that a hit rounded up to the end of a pattern counts as its first step.
+    """
+    grid = np.zeros(numSteps, dtype=bool)
+    grid[np.mod(getOnsetSteps(track, ticksPerBeat, stepsPerBeat, pitches), numSteps)] = True
+    return grid
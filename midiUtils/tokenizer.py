@@ -0,0 +1,191 @@
+from midiUtils.constants import *
+from midiUtils.eventTrack import EventTrack, EVENT_DTYPE, META_STATUS, END_OF_TRACK_META_TYPE
+from midiUtils.timing import roundTicks
+
+import mido
+import numpy as np
+
+from typing import Dict, List, Tuple, Union
+
+"""
+Tokenization of drum tracks for sequence models, on batches of EventTracks at once.
+A track becomes BOS, then for every hit (a note_on of non-zero velocity of a vocabulary voice) the time shifts since the
+previous hit, a voice token and a velocity token, then the time shifts to the end of the track and EOS:
+
+    BOS SHIFT_4 KICK VEL_5 HH VEL_3 SHIFT_2 SNARE VEL_6 ... SHIFT_1 EOS
+
+Times are quantized to stepsPerBeat steps per beat; a shift longer than maxShiftSteps is split into several tokens.
+Hits at the same step are ordered by voice. Note offs are not encoded: drum hits are one-shots, and decoding gives
+every hit a fixed length.
+All tracks of a batch are encoded with one set of array operations over all their hits, and returned as a padded
+(tracks, length) array with an attention mask.
+"""
+
+PAD = 0
+BOS = 1
+EOS = 2
+NUM_SPECIAL_TOKENS = 3
+
+class EventTokenizer:
+    def __init__(self, voices: Dict[str, List[int]] = PERC_VOICES_MAPPING, stepsPerBeat: int = 12, maxShiftSteps: int = None, numVelocityBins: int = 8):
+        """
+        - voices: the voice vocabulary, voice names to pitches; hits of other pitches are dropped.
+          Decoding plays every voice on its first pitch.
+        - stepsPerBeat: the time resolution (12 fits both 16th notes and triplets)
+        - maxShiftSteps: the longest shift token, one bar of 4/4 by default
+        - numVelocityBins: velocities 1 to 127 are split into this many bins of equal width
+        """
+        if not 1 <= numVelocityBins <= 127:
+            raise ValueError("numVelocityBins must be between 1 and 127")
+        self.voices = list(voices)
+        self.voicePitches = np.array([voices[v][0] for v in self.voices], dtype=np.int64)
+        self.stepsPerBeat = stepsPerBeat
+        self.maxShiftSteps = maxShiftSteps if maxShiftSteps is not None else 4 * stepsPerBeat
+        self.numVelocityBins = numVelocityBins
+
+        self.voiceOfPitch = np.full(128, -1, dtype=np.int64)
+        for i, voice in enumerate(self.voices):
+            if (self.voiceOfPitch[voices[voice]] >= 0).any():
+                raise ValueError(f"Voice {voice} shares pitches with another voice")
+            self.voiceOfPitch[voices[voice]] = i
+
+        # token ranges: shift k (1 <= k <= maxShiftSteps), then voices, then velocity bins
+        self.shiftOffset = NUM_SPECIAL_TOKENS - 1
+        self.voiceOffset = NUM_SPECIAL_TOKENS + self.maxShiftSteps
+        self.velocityOffset = self.voiceOffset + len(self.voices)
+        self.vocabSize = self.velocityOffset + numVelocityBins
+
+    def getTokenNames(self) -> List[str]:
+        names = ["PAD", "BOS", "EOS"]
+        names += [f"SHIFT_{k}" for k in range(1, self.maxShiftSteps + 1)]
+        names += self.voices
+        names += [f"VEL_{b}" for b in range(self.numVelocityBins)]
+        return names
+
+    def velocityToBin(self, velocities: np.ndarray) -> np.ndarray:
+        return (np.clip(np.asarray(velocities, dtype=np.int64), 1, 127) - 1) * self.numVelocityBins // 127
+
+    def binToVelocity(self, bins: np.ndarray) -> np.ndarray:
+        """
+        Returns the velocity in the middle of each bin.
+        """
+        return 1 + (2 * bins + 1) * 127 // (2 * self.numVelocityBins)
+
+    def encode(self, tracks: List[Union[EventTrack, mido.MidiTrack]], ticksPerBeat: Union[int, List[int]], maxLength: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the tokens of every track as a (tracks, length) int32 array padded with PAD, and its attention mask.
+        The length is that of the longest sequence, or maxLength, in which case longer sequences are cut off (and lose EOS).
+        ticksPerBeat is the resolution of every track, or a list with one per track.
+        """
+        tracks = [t if isinstance(t, EventTrack) else EventTrack.fromMidiTrack(t) for t in tracks]
+        numTracks = len(tracks)
+        tpb = np.broadcast_to(np.asarray(ticksPerBeat, dtype=np.float64), (numTracks,))
+
+        # the hits of all tracks, in one array
+        lengths = np.array([len(t) for t in tracks], dtype=np.int64)
+        events = np.concatenate([t.events for t in tracks]) if numTracks > 0 else np.zeros(0, dtype=EVENT_DTYPE)
+        trackOfEvent = np.repeat(np.arange(numTracks), lengths)
+        kinds = np.where(events["status"] < 0xF0, events["status"] & 0xF0, events["status"])
+        voices = self.voiceOfPitch[events["data1"].astype(np.int64)]
+        isHit = (kinds == 0x90) & (events["data2"] > 0) & (voices >= 0)
+        steps = roundTicks(events["time"] * (self.stepsPerBeat / tpb[trackOfEvent]))
+
+        # the end of every track, as the step of its last event (at least that of its last hit)
+        endSteps = np.zeros(numTracks, dtype=np.int64)
+        np.maximum.at(endSteps, trackOfEvent, steps)
+
+        hitTracks = trackOfEvent[isHit]
+        hitSteps = steps[isHit]
+        hitVoices = voices[isHit]
+        hitBins = self.velocityToBin(events["data2"][isHit])
+
+        # one row per BOS, hit and EOS, sorted by track, then step, then BOS / hits / EOS, then voice
+        rowTracks = np.concatenate([np.arange(numTracks), hitTracks, np.arange(numTracks)])
+        rowSteps = np.concatenate([np.zeros(numTracks, dtype=np.int64), hitSteps, endSteps])
+        rowKinds = np.concatenate([np.zeros(numTracks, dtype=np.int64), np.ones(len(hitTracks), dtype=np.int64), np.full(numTracks, 2)])
+        rowVoices = np.concatenate([np.zeros(numTracks, dtype=np.int64), hitVoices, np.zeros(numTracks, dtype=np.int64)])
+        order = np.lexsort((rowVoices, rowKinds, rowSteps, rowTracks))
+        rowTracks, rowSteps, rowKinds = rowTracks[order], rowSteps[order], rowKinds[order]
+        firstToken = np.concatenate([np.full(numTracks, BOS), self.voiceOffset + hitVoices, np.full(numTracks, EOS)])[order]
+        secondToken = np.concatenate([np.full(numTracks, -1), self.velocityOffset + hitBins, np.full(numTracks, -1)])[order]
+
+        # shifts since the previous row of the same track (BOS rows start every track at step 0)
+        gaps = np.diff(rowSteps, prepend=0)
+        gaps[rowKinds == 0] = 0
+        fullShifts, remainder = np.divmod(gaps, self.maxShiftSteps)
+        numShifts = fullShifts + (remainder > 0)
+        rowLengths = numShifts + 1 + (secondToken >= 0)
+        rowStarts = np.cumsum(rowLengths) - rowLengths
+
+        tokens = np.empty(int(rowLengths.sum()), dtype=np.int32)
+        rowOfShift = np.repeat(np.arange(len(rowLengths)), numShifts)
+        shiftIndex = np.arange(len(rowOfShift)) - np.repeat(np.cumsum(numShifts) - numShifts, numShifts)
+        shiftSteps = np.where(shiftIndex < fullShifts[rowOfShift], self.maxShiftSteps, remainder[rowOfShift])
+        tokens[rowStarts[rowOfShift] + shiftIndex] = self.shiftOffset + shiftSteps
+        tokens[rowStarts + numShifts] = firstToken
+        hasSecond = secondToken >= 0
+        tokens[(rowStarts + numShifts + 1)[hasSecond]] = secondToken[hasSecond]
+
+        # split the token stream into padded rows
+        trackLengths = np.bincount(rowTracks, weights=rowLengths, minlength=numTracks).astype(np.int64)
+        trackStarts = np.cumsum(trackLengths) - trackLengths
+        length = int(trackLengths.max(initial=0)) if maxLength is None else maxLength
+        tokenTracks = np.repeat(np.arange(numTracks), trackLengths)
+        positions = np.arange(len(tokens)) - trackStarts[tokenTracks]
+        keep = positions < length
+        batch = np.full((numTracks, length), PAD, dtype=np.int32)
+        batch[tokenTracks[keep], positions[keep]] = tokens[keep]
+        mask = np.zeros((numTracks, length), dtype=bool)
+        mask[tokenTracks[keep], positions[keep]] = True
+        return batch, mask
+
+    def decode(self, tokens: np.ndarray, mask: np.ndarray = None, ticksPerBeat: int = 480, noteLength: int = None, channel: int = 9) -> List[EventTrack]:
+        """
+        Inverse of encode: returns an EventTrack per row of tokens (a (tracks, length) array, or a single sequence).
+        Every hit becomes a note_on on its voice's first pitch and a note_off noteLength ticks later
+        (by default one step, at most until the end of the track); the track ends at its last time shift.
+        A voice token without a velocity token after it gets the velocity of the middle bin. Special tokens are skipped.
+        """
+        tokens = np.atleast_2d(np.asarray(tokens, dtype=np.int64))
+        mask = np.ones(tokens.shape, dtype=bool) if mask is None else np.atleast_2d(mask)
+        numTracks, length = tokens.shape
+        ticksPerStep = ticksPerBeat / self.stepsPerBeat
+        noteLength = noteLength if noteLength is not None else max(1, int(round(ticksPerStep)))
+
+        isShift = mask & (tokens > self.shiftOffset) & (tokens < self.voiceOffset)
+        shifts = np.where(isShift, tokens - self.shiftOffset, 0)
+        steps = np.cumsum(shifts, axis=1)
+        isVoice = mask & (tokens >= self.voiceOffset) & (tokens < self.velocityOffset)
+        isVelocity = mask & (tokens >= self.velocityOffset) & (tokens < self.vocabSize)
+        nextIsVelocity = np.zeros_like(isVelocity)
+        nextIsVelocity[:, :-1] = isVelocity[:, 1:]
+        nextTokens = np.zeros_like(tokens)
+        nextTokens[:, :-1] = tokens[:, 1:]
+        bins = np.where(nextIsVelocity, nextTokens - self.velocityOffset, self.numVelocityBins // 2)
+
+        endTimes = roundTicks(steps[:, -1] * ticksPerStep) if length > 0 else np.zeros(numTracks, dtype=np.int64)
+        rows, columns = np.nonzero(isVoice)
+        onTimes = roundTicks(steps[rows, columns] * ticksPerStep)
+        offTimes = np.minimum(onTimes + noteLength, np.maximum(endTimes[rows], onTimes))
+        pitches = self.voicePitches[tokens[rows, columns] - self.voiceOffset]
+        velocities = self.binToVelocity(bins[rows, columns])
+
+        numHits = len(rows)
+        events = np.zeros(2 * numHits + numTracks, dtype=EVENT_DTYPE)
+        events["time"] = np.concatenate([onTimes, offTimes, endTimes])
+        events["status"] = np.concatenate([np.full(numHits, 0x90 | channel), np.full(numHits, 0x80 | channel), np.full(numTracks, META_STATUS)])
+        events["data1"] = np.concatenate([pitches, pitches, np.zeros(numTracks, dtype=np.int64)])
+        events["data2"] = np.concatenate([velocities, np.full(numHits, 64), np.zeros(numTracks, dtype=np.int64)])
+        events["metaType"][2 * numHits:] = END_OF_TRACK_META_TYPE
+        eventTracks = np.concatenate([rows, rows, np.arange(numTracks)])
+        # at a tie, note_offs go before note_ons, and the end of track goes last
+        tieOrder = np.concatenate([np.ones(numHits, dtype=np.int64), np.zeros(numHits, dtype=np.int64), np.full(numTracks, 2)])
+        sequence = np.concatenate([columns, columns, np.zeros(numTracks, dtype=np.int64)])
+        order = np.lexsort((sequence, tieOrder, events["time"], eventTracks))
+        events, eventTracks = events[order], eventTracks[order]
+
+        bounds = np.searchsorted(eventTracks, np.arange(numTracks + 1))
+        return [EventTrack(events[bounds[i]:bounds[i + 1]].copy()) for i in range(numTracks)]
+
+    def __str__(self) -> str:
+        return f"EventTokenizer of {self.vocabSize} tokens: {len(self.voices)} voices, {self.stepsPerBeat} steps per beat, shifts of up to {self.maxShiftSteps} steps, {self.numVelocityBins} velocity bins"
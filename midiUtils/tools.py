@@ -1,10 +1,12 @@
-from midiUtils import helpers
 from midiUtils.constants import *
 from midiUtils.absTrack import AbsoluteTimeTrack
 
 import mido
 import copy
 
+# helpers, timing and eventTrack (and through them numpy) are imported by the functions that use them,
+# so that this module and absTrack only need mido
+
 def isTrackEmpty(track : mido.MidiTrack):
     """
     Returns true if the track is empty, aka if it has any note on messages.
@@ -47,6 +49,8 @@ def trimMidiTrack(track: mido.MidiTrack, startBar: int, endBar: int, beatsPerBar
     """
     Trims a midi track to the specified bars.
     """
+    from midiUtils import helpers
+
     metaData, _ = helpers.getMetaDataAndIndex(track)
 
     startTime = startBar * beatsPerBar * ticksPerBeat
@@ -67,4 +71,14 @@ def allMessagesToChannel(track: mido.MidiTrack, channel: int) -> mido.MidiTrack:
             newMsg.channel = channel
         newTrack.append(newMsg)
 
-    return newTrack
\ No newline at end of file
+    return newTrack
+
+def quantizeTrack(track: mido.MidiTrack, gridTicks: int, strength: float = 1.0, swing: float = 0.5) -> mido.MidiTrack:
+    """
+    Returns a copy of the track with its note messages snapped to a grid of gridTicks. See timing.quantize.
+    """
+    from midiUtils import timing
+    from midiUtils.eventTrack import EventTrack
+
+    eventTrack = EventTrack.fromMidiTrack(track)
+    return timing.quantize([eventTrack], gridTicks, strength, swing)[0].toMidiTrack()
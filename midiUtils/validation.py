@@ -0,0 +1,195 @@
+from midiUtils.dataAug import checkOutputNames, getOutputName
+from midiUtils.eventTrack import EventMidiFile, EventTrack, EVENT_DTYPE, META_STATUS, END_OF_TRACK_META_TYPE, readSmfFile
+
+import json
+import os
+import mido
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Union
+
+"""
+Validation and repair of midi corpora, to run before batch jobs instead of failing half way through them.
+Every track is checked with a few array scans (see checkTrack) for:
+- negative delta times (in tracks built in memory; a file cannot encode them)
+- data bytes (notes, velocities, controller values) above 127, which mido refuses to read
+- a missing end_of_track, or end_of_track messages before the last event
+- hanging notes: note_ons (of non-zero velocity) that are never turned off
+All of these can be repaired (see repairTrack). Files that cannot be decoded at all are reported as unreadable.
+validateFiles runs over a process pool and writes a JSON report; getUsablePaths turns it into a list of files to process.
+"""
+
+NEGATIVE_DELTA = "negativeDelta"
+DATA_OUT_OF_RANGE = "dataOutOfRange"
+MISSING_END_OF_TRACK = "missingEndOfTrack"
+MISPLACED_END_OF_TRACK = "misplacedEndOfTrack"
+HANGING_NOTES = "hangingNotes"
+
+OK = "ok"
+REPAIRED = "repaired"
+INVALID = "invalid"
+UNREADABLE = "unreadable"
+
+NOTE_OFF_VELOCITY = 64
+
+def getHangingNotes(events: np.ndarray) -> np.ndarray:
+    """
+    Returns the channel * 128 + note of every note whose last note message is a note_on of non-zero velocity.
+    """
+    kinds = np.where(events["status"] < 0xF0, events["status"] & 0xF0, events["status"])
+    noteIndices = np.flatnonzero((kinds == 0x90) | (kinds == 0x80))
+    keys = (events["status"][noteIndices] & 0x0F).astype(np.int64) * 128 + events["data1"][noteIndices]
+    # index of the last note message of every key
+    lastOfKey = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+    last = events[noteIndices[lastOfKey]]
+    isOn = ((last["status"] & 0xF0) == 0x90) & (last["data2"] > 0)
+    return np.sort(keys[lastOfKey][isOn])
+
+def checkTrack(track: EventTrack) -> Dict[str, int]:
+    """
+    Returns the number of problems of each kind found in the track (only kinds that were found).
+    """
+    events = track.events
+    isChannel = events["status"] < 0xF0
+    isEndOfTrack = track.endOfTrackMask()
+    issues = {
+        NEGATIVE_DELTA: int((np.diff(events["time"]) < 0).sum()),
+        DATA_OUT_OF_RANGE: int((isChannel & ((events["data1"] > 127) | (events["data2"] > 127))).sum()),
+        MISSING_END_OF_TRACK: int(not isEndOfTrack.any()),
+        # every end_of_track but a single one at the very end
+        MISPLACED_END_OF_TRACK: int(isEndOfTrack.sum() - (1 if len(events) > 0 and isEndOfTrack[-1] else 0)),
+        HANGING_NOTES: len(getHangingNotes(events[~isEndOfTrack])),
+    }
+    return {issue: count for issue, count in issues.items() if count > 0}
+
+def repairTrack(track: EventTrack) -> EventTrack:
+    """
+    Returns a copy of the track without the problems checkTrack reports:
+    negative delta times become 0, data bytes are clamped to 127, hanging notes are turned off at the end of the track,
+    and the track ends with a single end_of_track, at the time of the last event or end_of_track.
+    """
+    events = track.events.copy()
+    times = events["time"]
+    deltas = np.diff(times, prepend=0)
+    if (deltas < 0).any():
+        events["time"] = np.cumsum(np.maximum(deltas, 0))
+
+    isChannel = events["status"] < 0xF0
+    for column in ["data1", "data2"]:
+        events[column][isChannel] = np.minimum(events[column][isChannel], 127)
+
+    isEndOfTrack = EventTrack(events).endOfTrackMask()
+    endTime = int(events["time"].max()) if len(events) > 0 else 0
+    events = events[~isEndOfTrack]
+
+    hanging = getHangingNotes(events)
+    noteOffs = np.zeros(len(hanging), dtype=EVENT_DTYPE)
+    noteOffs["time"] = endTime
+    noteOffs["status"] = 0x80 | (hanging // 128)
+    noteOffs["data1"] = hanging % 128
+    noteOffs["data2"] = NOTE_OFF_VELOCITY
+
+    endOfTrack = np.zeros(1, dtype=EVENT_DTYPE)
+    endOfTrack["time"] = endTime
+    endOfTrack["status"] = META_STATUS
+    endOfTrack["metaType"] = END_OF_TRACK_META_TYPE
+    return EventTrack(np.concatenate([events, noteOffs, endOfTrack]), track.payload)
+
+def toEventMidiFile(mid: Union[mido.MidiFile, EventMidiFile]) -> EventMidiFile:
+    return mid if isinstance(mid, EventMidiFile) else EventMidiFile.fromMidiFile(mid)
+
+def checkMidiFile(mid: Union[mido.MidiFile, EventMidiFile]) -> List[dict]:
+    """
+    Returns the problems of every track of the file, as a list of {"track", "issue", "count"}.
+    """
+    return [{"track": i, "issue": issue, "count": count} for i, track in enumerate(toEventMidiFile(mid).tracks) for issue, count in checkTrack(track).items()]
+
+def repairMidiFile(mid: Union[mido.MidiFile, EventMidiFile]) -> EventMidiFile:
+    eventMid = toEventMidiFile(mid)
+    return EventMidiFile(eventMid.type, eventMid.ticksPerBeat, [repairTrack(track) for track in eventMid.tracks])
+
+def validateFile(path: str, repairDir: str = None, rootDir: str = None) -> dict:
+    """
+    Checks a midi file, and writes a repaired copy of it to repairDir if it has problems, named after the file's path
+    relative to rootDir like the outputs of transformMidiFiles (see dataAug.getOutputName).
+    Returns its report: the path, a status (OK, REPAIRED, INVALID if it has problems but no repairDir was given,
+    or UNREADABLE), the problems found and the path of the repaired copy.
+    """
+    report = {"path": str(path), "status": OK, "issues": [], "repairedPath": None, "error": None}
+    try:
+        mid = readSmfFile(path, useMmap=False)
+        report["issues"] = checkMidiFile(mid)
+        if report["issues"] and repairDir is not None:
+            repairedPath = f"{repairDir}/{getOutputName(path, rootDir)}.mid"
+            repairMidiFile(mid).save(repairedPath)
+            report["repairedPath"] = repairedPath
+    except (OSError, EOFError, ValueError) as e:
+        report["status"] = UNREADABLE
+        report["error"] = f"{type(e).__name__}: {e}"
+        return report
+    if report["issues"]:
+        report["status"] = REPAIRED if repairDir is not None else INVALID
+    return report
+
+def _validateFiles(paths: List[str], repairDir: str, rootDir: str) -> List[dict]:
+    return [validateFile(path, repairDir, rootDir) for path in paths]
+
+def validateFiles(midiPaths: List[str], repairDir: str = None, reportPath: str = None, maxWorkers: int = None, chunkSize: int = 32, rootDir: str = None) -> List[dict]:
+    """
+    Runs validateFile on every file, over a process pool of maxWorkers processes (by default, one per cpu;
+    with maxWorkers=1, in this process), in chunks of chunkSize files.
+    If reportPath is given, the reports are written to it as JSON. Returns the reports, in the order of midiPaths.
+    With a repairDir, raises a ValueError if two files would get the same repaired copy (see dataAug.checkOutputNames).
+    """
+    paths = [str(p) for p in midiPaths]
+    if repairDir is not None:
+        checkOutputNames(paths, rootDir)
+        os.makedirs(repairDir, exist_ok=True)
+    chunks = [paths[i:i + chunkSize] for i in range(0, len(paths), chunkSize)]
+    if maxWorkers == 1:
+        reports = [r for chunk in chunks for r in _validateFiles(chunk, repairDir, rootDir)]
+    else:
+        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            reports = [r for chunkReports in executor.map(_validateFiles, chunks, [repairDir] * len(chunks), [rootDir] * len(chunks)) for r in chunkReports]
+
+    if reportPath is not None:
+        with open(reportPath, "w") as f:
+            json.dump({"summary": getSummary(reports), "files": reports}, f, indent=1)
+    return reports
+
+def validateDirectory(sourceDir: str, repairDir: str = None, reportPath: str = None, maxWorkers: int = None) -> List[dict]:
+    """
+    validateFiles on the .mid files of a directory, whose repaired copies are named relative to it.
+    """
+    if not os.path.exists(sourceDir):
+        raise FileNotFoundError(f"Directory {sourceDir} does not exist.")
+    paths = sorted(f"{sourceDir}/{f}" for f in os.listdir(sourceDir) if f.endswith(".mid"))
+    return validateFiles(paths, repairDir, reportPath, maxWorkers, rootDir=sourceDir)
+
+def getSummary(reports: List[dict]) -> dict:
+    """
+    Returns the number of files of each status, and the number of files with each kind of problem.
+    """
+    summary = {"statuses": {OK: 0, REPAIRED: 0, INVALID: 0, UNREADABLE: 0}, "issues": {}}
+    for report in reports:
+        summary["statuses"][report["status"]] += 1
+        for issue in set(i["issue"] for i in report["issues"]):
+            summary["issues"][issue] = summary["issues"].get(issue, 0) + 1
+    return summary
+
+def readReport(reportPath: str) -> List[dict]:
+    with open(reportPath) as f:
+        return json.load(f)["files"]
+
+def getUsablePaths(reports: List[dict]) -> List[str]:
+    """
+    Returns the files a batch job can safely process: valid files, and the repaired copies of repaired files.
+    """
+    usable = []
+    for report in reports:
+        if report["status"] == OK:
+            usable.append(report["path"])
+        elif report["status"] == REPAIRED:
+            usable.append(report["repairedPath"])
+    return usable
@@ -14,6 +14,10 @@ setup(
         "numpy",
         "mido"
     ],
+    extras_require={
+        # only needed by synth.py, which imports them on first use
+        'synth': ["pretty_midi", "soundfile", "pyfluidsynth"]
+    },
     include_package_data=True,
     package_data={
         'midiUtils' : ['Standard_Drum_Kit.sf2']
@@ -167,6 +167,23 @@ def test_randomly_offset_velocities():
     mid.save(OFFSET_VELOCITY_OUT)
     print(f"test_randomly_offset_velocities output must be inspected manually.")
 
+def test_randomly_offset_velocities_clamped():
+    print("///////////////////////////////////////////////")
+    print("Testing randomly_offset_velocities near the ends of the velocity range...")
+    track = mido.MidiTrack()
+    for velocity in [1, 127]:
+        track.append(mido.Message('note_on', note=36, velocity=velocity, time=10))
+        track.append(mido.Message('note_off', note=36, velocity=velocity, time=10))
+    noteAtt = AbsoluteTimeTrack.getNoteMessagesAbsTrack(AbsoluteTimeTrack(track), True)
+    for _ in range(20):
+        offsetNoteAtt = AbsoluteTimeTrack.randomlyOffsetVelocities(noteAtt, 50)
+        for am in offsetNoteAtt:
+            if am.msg.type == NOTE_ON:
+                assert 1 <= am.msg.velocity <= 127, f"Expected note_on velocities between 1 and 127, got {am.msg.velocity}"
+            elif am.msg.type == NOTE_OFF:
+                assert 0 <= am.msg.velocity <= 127, f"Expected note_off velocities between 0 and 127, got {am.msg.velocity}"
+    print("As expected, offset velocities stay within the midi range.")
+
 
 if __name__ == '__main__':
     clearOutputDir(OUTPUT_DIR)
@@ -180,3 +197,4 @@ if __name__ == '__main__':
     test_get_note_messages_abs_track()
     test_randomly_offset_time()
     test_randomly_offset_velocities()
+    test_randomly_offset_velocities_clamped()
@@ -1,9 +1,18 @@
 from tests.constants import *
 from tests.utils import *
 
+from midiUtils import augExamples
 from midiUtils.augExamples import SeedExamplesRetriever, AugSeedExample
+from midiUtils.constants import PERC_VOICES_MAPPING
+from midiUtils.dataAug import transformMidiFile
 
 import mido
+import numpy as np
+import os
+import shutil
+import time
+
+from collections import Counter
 
 EXAMPLES_DIR = TEST_DATA_DIR / "examples"
 OUTPUT_DIR = TEST_OUT_DIR / "augExamples"
@@ -31,6 +40,7 @@ def test_example():
 
     tomTrack = example.getVoice('TOM')
     assert len(tomTrack) == 0, f"Expected empty tom track, got track of length {len(tomTrack)}"
+    assert isinstance(example._events.payload, bytes), "Expected the example not to keep a memory map of its file open"
 
     print("AugExample test passed")
 
@@ -105,6 +115,172 @@ def test_retriever_getTrack_fileDoesNotExist():
     assert len(track) == 0, "Expected empty track"
     print("getTrack fileDoesNotExist test passed")
 
+def test_retriever_uniformSampling():
+    print("//////////////////////")
+    print("Testing retriever uniform sampling")
+    ser = SeedExamplesRetriever(EXAMPLES_DIR)
+    candidates = ser.getCandidateTracksInfo('mambo', outOfStyle=False, voicesToExclude=[])
+    expected = tuple(np.random.default_rng(3).choice(candidates))
+    actual = ser.sampleCandidateTrack('mambo', False, [], np.random.default_rng(3))
+    assert tuple(actual) == expected, f"Expected uniform sampling to match rng.choice, got {actual} instead of {expected}"
+    assert ser.sampleCandidateTrack('mambo', True, list(PERC_VOICES_MAPPING.keys()), np.random.default_rng(3)) is None, "Expected no candidates"
+    print("uniform sampling test passed")
+
+def test_retriever_weightedSampling():
+    print("//////////////////////")
+    print("Testing retriever weighted and stratified sampling")
+    rng = np.random.default_rng(0)
+    ser = SeedExamplesRetriever(EXAMPLES_DIR, voiceWeights={'KICK': 0})
+    for _ in range(200):
+        _, voice = ser.sampleCandidateTrack('mambo', False, [], rng)
+        assert voice != 'KICK', "Expected a zero weight voice to never be sampled"
+
+    # candidates whose weights are all 0 are no candidates
+    onlyKick = {v: 0 for v in PERC_VOICES_MAPPING if v != 'KICK'}
+    ser = SeedExamplesRetriever(EXAMPLES_DIR, voiceWeights=onlyKick)
+    assert ser.sampleCandidateTrack('mambo', False, ['KICK'], rng) is None, "Expected no candidates of positive weight"
+    candidates = ser.getCandidateTracksInfo('mambo', outOfStyle=False, voicesToExclude=['KICK'])
+    assert candidates and ser.sampleFromCandidates(candidates, rng) is None, "Expected no candidates of positive weight"
+    mid = mido.MidiFile(TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid")
+    for similarityTopK in [None, 2]:
+        _, replacementInfo = transformMidiFile(mid, 0, 2, ser, np.random.default_rng(0), 'mambo', 0.0, similarityTopK=similarityTopK)
+        assert [v for _, v in replacementInfo] == ['KICK'], f"Expected only the kick to be replaced, got {replacementInfo}"
+
+    # the alias table of a candidate set is built once
+    ser = SeedExamplesRetriever(EXAMPLES_DIR, voiceWeights={'KICK': 2})
+    candidates = ser.getCandidateTracksInfo('mambo', outOfStyle=False, voicesToExclude=[])
+    ser.sampleFromCandidates(candidates, rng)
+    numSamplers = len(ser._pool.samplers)
+    for _ in range(10):
+        ser.sampleFromCandidates(candidates, rng)
+    assert len(ser._pool.samplers) == numSamplers, "Expected the alias table to be reused"
+
+    ser = SeedExamplesRetriever(EXAMPLES_DIR, stratify='voice')
+    candidates = ser.getCandidateTracksInfo('mambo', outOfStyle=False, voicesToExclude=[])
+    voices = set(v for _, v in candidates)
+    draws = Counter(ser.sampleCandidateTrack('mambo', False, [], rng)[1] for _ in range(6000))
+    for v in voices:
+        assert abs(draws[v] / 6000 - 1 / len(voices)) < 0.03, f"Expected every voice to be drawn equally often, got {draws}"
+
+    usage = ser.getUsage()
+    assert list(usage.keys()) == ['mambo'] and usage['mambo']['count'] == 6000, f"Unexpected usage {usage}"
+    ser.resetUsage()
+    assert ser.getUsage() == {}, "Expected usage to be reset"
+
+    try:
+        SeedExamplesRetriever(EXAMPLES_DIR, stratify='filename')
+        assert False, "Expected a ValueError for an unknown stratum"
+    except ValueError:
+        pass
+    print("weighted and stratified sampling test passed")
+
+def test_retriever_reload():
+    print("//////////////////////")
+    print("Testing retriever reload")
+    poolDir = OUTPUT_DIR / "pool"
+    shutil.rmtree(poolDir, ignore_errors=True)
+    shutil.copytree(EXAMPLES_DIR, poolDir)
+    ser = SeedExamplesRetriever(poolDir)
+    assert not ser.reload(), "Expected no change without modified files"
+
+    before = ser.snapshot()
+    mamboExample = ser.getExamplesByStyle('mambo')[0]
+    shutil.copy(poolDir / "songo_kit.mid", poolDir / "songo_kit2.mid")
+    assert ser.reload(), "Expected the new file to be picked up"
+    assert len(ser.getExamplesByStyle('songo')) == 2, "Expected 2 songo examples after reload"
+    assert mamboExample in ser.getExamplesByStyle('mambo'), "Expected unchanged examples to be reused"
+    assert len(before.getExamplesByStyle('songo')) == 1, "Expected the snapshot to keep its pool"
+    assert before.getPoolVersion() != ser.getPoolVersion(), "Expected the pool version to change"
+
+    os.remove(poolDir / "songo_kit2.mid")
+    assert ser.reload() and ser.getExampleStyle("songo_kit2.mid") is None, "Expected the removed file to be dropped"
+    assert ser.getPoolVersion() == before.getPoolVersion(), "Expected the original pool version"
+
+    # a half written file is skipped until it is complete
+    with open(poolDir / "songo_partial.mid", "wb") as f:
+        f.write(b"MTh")
+    ser.reload()
+    assert ser.getExampleStyle("songo_partial.mid") is None, "Expected an unreadable file to be skipped"
+    shutil.copy(poolDir / "songo_kit.mid", poolDir / "songo_partial.mid")
+    assert ser.reload() and ser.getExampleStyle("songo_partial.mid") == 'songo', "Expected the completed file to be picked up"
+
+    os.remove(poolDir / "songo_kit.mid")
+    os.remove(poolDir / "songo_partial.mid")
+    try:
+        ser.reload()
+        assert False, "Expected reloading a single style pool to fail"
+    except Exception:
+        pass
+    assert 'songo' in ser.styles, "Expected the previous pool to be kept"
+    print("reload test passed")
+
+def test_retriever_incrementalReload():
+    print("//////////////////////")
+    print("Testing that reload only processes changed files")
+    poolDir = OUTPUT_DIR / "pool"
+    shutil.rmtree(poolDir, ignore_errors=True)
+    shutil.copytree(EXAMPLES_DIR, poolDir)
+    ser = SeedExamplesRetriever(poolDir, dedupe=True)
+    ser.getPoolVersion()
+    ser.getFeatureIndex()
+    fingerprints = dict(ser._pool.fingerprints)
+    features = dict(ser._pool.features)
+
+    hashed = []
+    originalHashBytes = augExamples.hashBytes
+    augExamples.hashBytes = lambda data: hashed.append(len(data)) or originalHashBytes(data)
+    try:
+        shutil.copy(poolDir / "songo_kit.mid", poolDir / "songo_kit2.mid")
+        assert ser.reload(), "Expected the new file to be picked up"
+        version = ser.getPoolVersion()
+    finally:
+        augExamples.hashBytes = originalHashBytes
+    assert hashed == [os.path.getsize(poolDir / "songo_kit2.mid")], f"Expected only the new file to be hashed, got {hashed}"
+    for key, fingerprint in fingerprints.items():
+        assert ser._pool.fingerprints[key] is fingerprint, f"Expected the fingerprint of {key} to be reused"
+    ser.getFeatureIndex()
+    for key, feature in features.items():
+        assert ser._pool.features[key] is feature, f"Expected the features of {key} to be reused"
+    assert version == SeedExamplesRetriever(poolDir, dedupe=True).getPoolVersion(), "Expected the pool version of a full scan"
+
+    os.remove(poolDir / "songo_kit2.mid")
+    assert ser.reload() and not any(k[0] == "songo_kit2.mid" for k in ser._pool.fingerprints), "Expected the removed file's data to be dropped"
+    print("incremental reload test passed")
+
+def test_retriever_poolVersionOfParsedFiles():
+    print("//////////////////////")
+    print("Testing that the pool version hashes the parsed files")
+    poolDir = OUTPUT_DIR / "pool"
+    shutil.rmtree(poolDir, ignore_errors=True)
+    shutil.copytree(EXAMPLES_DIR, poolDir)
+    expected = SeedExamplesRetriever(poolDir).getPoolVersion()
+
+    # files that change or go away before the version is first asked for do not change it until the next reload
+    ser = SeedExamplesRetriever(poolDir)
+    shutil.copy(poolDir / "mambo_simple.mid", poolDir / "songo_kit.mid")
+    os.remove(poolDir / "mambo_bell1.mid")
+    assert ser.getPoolVersion() == expected, "Expected the version of the files as they were parsed"
+    assert ser.reload() and ser.getPoolVersion() != expected, "Expected the reloaded pool to have another version"
+    print("pool version of parsed files test passed")
+
+def test_retriever_watching():
+    print("//////////////////////")
+    print("Testing retriever watching")
+    poolDir = OUTPUT_DIR / "watchedPool"
+    shutil.rmtree(poolDir, ignore_errors=True)
+    shutil.copytree(EXAMPLES_DIR, poolDir)
+    ser = SeedExamplesRetriever(poolDir)
+    ser.startWatching(interval=0.01)
+    try:
+        shutil.copy(poolDir / "songo_kit.mid", poolDir / "songo_kit2.mid")
+        deadline = time.time() + 5
+        while ser.getExampleStyle("songo_kit2.mid") is None and time.time() < deadline:
+            time.sleep(0.01)
+        assert ser.getExampleStyle("songo_kit2.mid") == 'songo', "Expected the watcher to pick up the new file"
+    finally:
+        ser.stopWatching()
+    print("watching test passed")
+
 if __name__ == "__main__":
     clearOutputDir(OUTPUT_DIR)
 
@@ -116,3 +292,9 @@ if __name__ == "__main__":
     test_retriever_getCandidateTracksInfo_OutOfStyle()
     test_retriever_getTrack()
     test_retriever_getTrack_fileDoesNotExist()
+    test_retriever_uniformSampling()
+    test_retriever_weightedSampling()
+    test_retriever_reload()
+    test_retriever_incrementalReload()
+    test_retriever_poolVersionOfParsedFiles()
+    test_retriever_watching()
@@ -0,0 +1,148 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.augMetrics import PAIR_METRICS, computePairMetrics, computeManifestMetrics, compareMidiFiles, getLowDiversityMask
+from midiUtils.constants import PERC_VOICES_MAPPING
+from midiUtils.corpusStats import VOICES
+from midiUtils.dataAug import transformMidiFiles
+from midiUtils.manifest import readManifest
+
+import glob
+import math
+import mido
+import numpy as np
+
+OUTPUT_DIR = TEST_OUT_DIR / "augMetrics"
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+MIDI_TO_TRANSFORM = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+PATHS = sorted(glob.glob(str(TEST_DATA_DIR / "*" / "*.mid")))
+
+def getFeaturesNaively(path, stepsPerBeat=4, numSteps=None, numVelocityBins=8):
+    """
+    Per-voice sets of onset steps and velocity bin counts, with mido.
+    """
+    mid = mido.MidiFile(path)
+    steps = {v: set() for v in VOICES}
+    bins = {v: [0] * numVelocityBins for v in VOICES}
+    for track in mid.tracks:
+        time = 0
+        for msg in track:
+            time += msg.time
+            if msg.type != "note_on" or msg.velocity == 0:
+                continue
+            for voice in VOICES:
+                if msg.note in PERC_VOICES_MAPPING[voice]:
+                    step = int(math.floor(time * stepsPerBeat / mid.ticks_per_beat + 0.5))
+                    steps[voice].add(step % numSteps if numSteps is not None else step)
+                    bins[voice][(msg.velocity - 1) * numVelocityBins // 127] += 1
+    return steps, bins
+
+def compareNaively(sourcePath, outputPath, numSteps=None) -> dict:
+    sourceSteps, sourceBins = getFeaturesNaively(sourcePath, numSteps=numSteps)
+    outputSteps, outputBins = getFeaturesNaively(outputPath, numSteps=numSteps)
+    metrics = {name: [] for name in PAIR_METRICS}
+    for voice in VOICES:
+        a, b = sourceSteps[voice], outputSteps[voice]
+        metrics["onsetOverlap"].append(len(a & b) / len(a | b) if a | b else 1.0)
+        metrics["hammingDistance"].append(len(a ^ b))
+        p, q = sourceBins[voice], outputBins[voice]
+        if sum(p) == 0 or sum(q) == 0:
+            metrics["velocityDivergence"].append(0.0 if sum(p) == sum(q) else 1.0)
+            continue
+        p, q = [x / sum(p) for x in p], [x / sum(q) for x in q]
+        m = [(x + y) / 2 for x, y in zip(p, q)]
+        kl = lambda u: sum(x * math.log2(x / y) for x, y in zip(u, m) if x > 0)
+        metrics["velocityDivergence"].append((kl(p) + kl(q)) / 2)
+    return metrics
+
+def test_augMetrics_pairs():
+    print("///////////////////////////////////////////////")
+    print("Testing augMetrics pair metrics...")
+    sourcePaths = [p for p in PATHS for _ in PATHS]
+    outputPaths = [p for _ in PATHS for p in PATHS]
+    metrics = computePairMetrics(sourcePaths, outputPaths, maxWorkers=1)
+    for name in PAIR_METRICS:
+        assert metrics[name].shape == (len(sourcePaths), len(VOICES)), f"Expected a {name} per pair and voice"
+    for i, (sourcePath, outputPath) in enumerate(zip(sourcePaths, outputPaths)):
+        expected = compareNaively(sourcePath, outputPath)
+        for name in PAIR_METRICS:
+            assert np.allclose(metrics[name][i], expected[name]), f"Unexpected {name} between {sourcePath} and {outputPath}"
+
+    same = np.array(sourcePaths) == np.array(outputPaths)
+    assert (metrics["onsetOverlap"][same] == 1).all() and (metrics["hammingDistance"][same] == 0).all(), "Expected a file to match itself"
+    assert np.allclose(metrics["velocityDivergence"][same], 0), "Expected no velocity divergence of a file from itself"
+    assert not getLowDiversityMask(metrics)[~same].all() and getLowDiversityMask(metrics)[same].all(), "Expected only identical pairs to have low diversity"
+
+    wrapped = computePairMetrics(sourcePaths, outputPaths, numSteps=32, maxWorkers=1)
+    assert wrapped["hammingDistance"].shape == (len(sourcePaths), len(VOICES)), "Expected a hamming distance per pair and voice"
+    for i, (sourcePath, outputPath) in enumerate(zip(sourcePaths, outputPaths)):
+        assert np.array_equal(wrapped["hammingDistance"][i], compareNaively(sourcePath, outputPath, numSteps=32)["hammingDistance"]), f"Unexpected wrapped hamming distance between {sourcePath} and {outputPath}"
+
+    pooled = computePairMetrics(sourcePaths, outputPaths, maxWorkers=2, chunkSize=4)
+    for name in PAIR_METRICS:
+        assert np.array_equal(metrics[name], pooled[name]), f"Expected the same {name} over a process pool"
+
+    single = compareMidiFiles(mido.MidiFile(PATHS[0]), mido.MidiFile(PATHS[1]))
+    i = sourcePaths.index(PATHS[0]) + 1
+    for name in PAIR_METRICS:
+        assert np.allclose(single[name], metrics[name][i]), f"Expected compareMidiFiles to compute the same {name}"
+    print("augMetrics pair metrics passed")
+
+def makeKickFile(beats, numBeats=16) -> mido.MidiFile:
+    mid = mido.MidiFile(ticks_per_beat=480)
+    track = mido.MidiTrack()
+    time = 0
+    for beat in beats:
+        track.append(mido.Message("note_on", note=36, velocity=100, time=beat * 480 - time, channel=9))
+        time = beat * 480
+    track.append(mido.MetaMessage("end_of_track", time=numBeats * 480 - time))
+    mid.tracks.append(track)
+    return mid
+
+def test_augMetrics_fullLength():
+    print("///////////////////////////////////////////////")
+    print("Testing augMetrics full-length hit maps...")
+    # 4 bars, with a kick on the first beats of bars 1 and 3, or of bar 1 only
+    source, output = makeKickFile([0, 8]), makeKickFile([0])
+    kick = VOICES.index("KICK")
+    metrics = compareMidiFiles(source, output)
+    assert metrics["hammingDistance"][kick] == 1 and metrics["onsetOverlap"][kick] == 0.5, "Expected the kick of bar 3 to differ"
+    assert metrics["hammingDistance"].sum() == 1, "Expected the other voices to match"
+    wrapped = compareMidiFiles(source, output, numSteps=32)
+    assert wrapped["hammingDistance"].sum() == 0, "Expected bars 1 and 3 to share a wrapped 2-bar grid"
+
+    # the hit maps of longer files are padded, whichever side of the pair they are on
+    longer = makeKickFile([0, 60], numBeats=64)
+    assert compareMidiFiles(source, longer)["hammingDistance"][kick] == 2, "Expected the hits of the longer file to count"
+    assert compareMidiFiles(longer, source)["hammingDistance"][kick] == 2, "Expected the hits of the longer file to count"
+    print("augMetrics full-length hit maps passed")
+
+def test_augMetrics_pipeline():
+    print("///////////////////////////////////////////////")
+    print("Testing augMetrics in the augmentation pipeline...")
+    clearOutputDir(OUTPUT_DIR)
+    ser = SeedExamplesRetriever(EXAMPLES_DIR)
+    manifestPath = OUTPUT_DIR / "manifest.npy"
+    outputPaths = transformMidiFiles([MIDI_TO_TRANSFORM], str(OUTPUT_DIR), 1, ser, SEED, numAugmentations=6, manifestPath=manifestPath)
+    metrics = computeManifestMetrics(manifestPath, maxWorkers=1)
+    expected = computePairMetrics([MIDI_TO_TRANSFORM] * len(outputPaths), outputPaths, maxWorkers=1)
+    for name in PAIR_METRICS:
+        assert np.array_equal(metrics[name], expected[name]), f"Expected the {name} of the manifest's pairs"
+    distances = metrics["hammingDistance"].sum(axis=1)
+    print(f"Hamming distances: {distances.tolist()}")
+
+    # the same augmentations, minus those below the threshold
+    minHammingDistance = int(distances.max())
+    clearOutputDir(OUTPUT_DIR)
+    keptPaths = transformMidiFiles([MIDI_TO_TRANSFORM], str(OUTPUT_DIR), 1, ser, SEED, numAugmentations=6, manifestPath=manifestPath, minHammingDistance=minHammingDistance)
+    expectedPaths = [p for p, d in zip(outputPaths, distances) if d >= minHammingDistance]
+    assert 0 < len(keptPaths) < len(outputPaths) and keptPaths == expectedPaths, f"Expected the outputs at least {minHammingDistance} steps away, got {keptPaths}"
+    assert sorted(glob.glob(f"{OUTPUT_DIR}/*.mid")) == sorted(expectedPaths), "Expected only the kept outputs to be written"
+    assert readManifest(manifestPath, ["outputFile"])["outputFile"].tolist() == expectedPaths, "Expected only the kept outputs in the manifest"
+    print("augMetrics in the augmentation pipeline passed")
+
+if __name__ == "__main__":
+    test_augMetrics_pairs()
+    test_augMetrics_fullLength()
+    test_augMetrics_pipeline()
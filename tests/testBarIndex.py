@@ -0,0 +1,180 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import tools
+from midiUtils.barIndex import BarIndex
+from midiUtils.editPipeline import EditPipeline
+from midiUtils.eventTrack import EventMidiFile
+
+import mido
+import numpy as np
+import random
+import shutil
+
+OUTPUT_DIR = TEST_OUT_DIR / "barIndex"
+CORPUS_DIR = OUTPUT_DIR / "corpus"
+INDEX_PATH = OUTPUT_DIR / "index.npz"
+TICKS_PER_BEAT = 96
+BEATS_PER_BAR = 4
+PITCHES = [36, 38, 42, 46, 49, 51]
+
+def getRandomTrack(rng: random.Random, numBars: int) -> mido.MidiTrack:
+    """
+    A random performance of about numBars bars, with metadata, sysex and two byte messages between the notes.
+    """
+    track = mido.MidiTrack()
+    track.append(mido.MetaMessage('set_tempo', tempo=500000))
+    track.append(mido.MetaMessage('track_name', name='random'))
+    time = 0
+    while time < numBars * BEATS_PER_BAR * TICKS_PER_BEAT:
+        r = rng.random()
+        delta = rng.choice([0, 0, 1, 12, 24, 48, 96, 200])
+        time += delta
+        note = rng.choice(PITCHES)
+        channel = rng.choice([9, 9, 0])
+        if r < 0.5:
+            track.append(mido.Message('note_on', note=note, velocity=rng.choice([0, 64, 100]), channel=channel, time=delta))
+        elif r < 0.85:
+            track.append(mido.Message('note_off', note=note, velocity=64, channel=channel, time=delta))
+        elif r < 0.9:
+            track.append(mido.Message('program_change', program=rng.randint(0, 10), channel=channel, time=delta))
+        elif r < 0.95:
+            track.append(mido.Message('sysex', data=[1, 2, 3], time=delta))
+        else:
+            track.append(mido.MetaMessage('marker', text='m', time=delta))
+    track.append(mido.MetaMessage('end_of_track', time=rng.choice([0, 10, 500])))
+    return track
+
+def writeCorpus(rng: random.Random, numFiles: int) -> list:
+    """
+    Writes random files, half with mido and half with eventTrack's writer (which uses running status).
+    """
+    shutil.rmtree(CORPUS_DIR, ignore_errors=True)
+    os.makedirs(CORPUS_DIR)
+    paths = []
+    for i in range(numFiles):
+        mid = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+        for _ in range(rng.randint(1, 3)):
+            mid.tracks.append(getRandomTrack(rng, rng.randint(0, 12)))
+        path = str(CORPUS_DIR / f"performance_{i}.mid")
+        if i % 2 == 0:
+            mid.save(path)
+        else:
+            EventMidiFile.fromMidiFile(mid).save(path)
+        paths.append(path)
+    return paths
+
+def asStrings(track):
+    return [str(m) for m in track]
+
+def test_barIndex_windows():
+    print("///////////////////////////////////////////////")
+    print("Testing BarIndex windows against trimMidiTrack...")
+    rng = random.Random(SEED)
+    paths = writeCorpus(rng, 20)
+    index = BarIndex.build(paths, BEATS_PER_BAR)
+    index.save(INDEX_PATH)
+    index = BarIndex.load(INDEX_PATH)
+    print(index)
+    assert index.getPaths() == paths, "Expected every file to be indexed"
+
+    for path in paths:
+        mid = mido.MidiFile(path)
+        for trackIndex, track in enumerate(mid.tracks):
+            numBars = index.getNumBars(path, trackIndex)
+            for startBar in range(numBars + 2):
+                endBar = startBar + rng.randint(1, 3)
+                expected = EditPipeline(track).trim(startBar, endBar, BEATS_PER_BAR, TICKS_PER_BEAT).toMidiTrack()
+                actual = index.getWindowMidiTrack(path, startBar, endBar, trackIndex)
+                assert asStrings(actual) == asStrings(expected), f"Window {startBar}-{endBar} of track {trackIndex} of {path} differs"
+                try:
+                    expected = tools.trimMidiTrack(track, startBar, endBar, BEATS_PER_BAR, TICKS_PER_BEAT)
+                except IndexError:
+                    # getMidiSlice fails on slices with nothing to copy
+                    continue
+                assert asStrings(actual) == asStrings(expected), f"Window {startBar}-{endBar} of track {trackIndex} of {path} differs from trimMidiTrack"
+    print("BarIndex windows against trimMidiTrack passed")
+
+def test_barIndex_activeNotes():
+    print("///////////////////////////////////////////////")
+    print("Testing BarIndex active notes...")
+    rng = random.Random(SEED + 1)
+    paths = writeCorpus(rng, 5)
+    index = BarIndex.build(paths, BEATS_PER_BAR)
+    barTicks = BEATS_PER_BAR * TICKS_PER_BEAT
+    for path in paths:
+        for trackIndex, track in enumerate(mido.MidiFile(path).tracks):
+            expected = np.full(128, -1)
+            absTime = 0
+            bar = 0
+            for msg in track:
+                absTime += msg.time
+                while bar * barTicks <= absTime:
+                    assert np.array_equal(index.getActiveNotes(path, bar, trackIndex), expected), f"Active notes of bar {bar} of {path} differ"
+                    bar += 1
+                if msg.type == "note_on" and msg.velocity > 0:
+                    expected[msg.note] = msg.channel
+                elif msg.type in ["note_on", "note_off"]:
+                    expected[msg.note] = -1
+    print("BarIndex active notes passed")
+
+def test_barIndex_sampleWindow():
+    print("///////////////////////////////////////////////")
+    print("Testing BarIndex sampleWindow...")
+    rng = random.Random(SEED + 2)
+    paths = writeCorpus(rng, 5)
+    index = BarIndex.build(paths + [str(TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid")], BEATS_PER_BAR)
+    npRng = np.random.default_rng(SEED)
+    for _ in range(50):
+        path, startBar, window = index.sampleWindow(npRng, numBars=2)
+        mid = mido.MidiFile(path)
+        expected = EditPipeline(mid.tracks[0]).trim(startBar, startBar + 2, BEATS_PER_BAR, mid.ticks_per_beat).toMidiTrack()
+        assert asStrings(window.toMidiTrack()) == asStrings(expected), f"Sampled window {startBar} of {path} differs"
+        assert startBar == 0 or startBar + 2 <= index.getNumBars(path), "Expected sampled windows to lie within the track"
+
+    # a file that changed since it was indexed
+    with open(paths[0], "ab") as f:
+        f.write(b"\x00")
+    try:
+        index.getWindow(paths[0], 0, 2)
+        assert False, "Expected a ValueError for a changed file"
+    except ValueError:
+        pass
+    print("BarIndex sampleWindow passed")
+
+def test_barIndex_barLines():
+    print("///////////////////////////////////////////////")
+    print("Testing BarIndex tracks that end on a bar line...")
+    barTicks = BEATS_PER_BAR * TICKS_PER_BEAT
+    paths = []
+    for name, endTime in [("twoBars", 2 * barTicks), ("pastTwoBars", 2 * barTicks + 10), ("empty", 0)]:
+        mid = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+        track = mido.MidiTrack([mido.Message('note_on', note=36, velocity=100, channel=9, time=0)] if endTime > 0 else [])
+        track.append(mido.Message('note_off', note=36, velocity=64, channel=9, time=endTime // 2) if endTime > 0 else mido.MetaMessage('marker', text='m', time=0))
+        track.append(mido.MetaMessage('end_of_track', time=endTime - endTime // 2))
+        mid.tracks.append(track)
+        path = str(OUTPUT_DIR / f"{name}.mid")
+        mid.save(path)
+        paths.append(path)
+    index = BarIndex.build(paths, BEATS_PER_BAR)
+    assert [index.getNumBars(p) for p in paths] == [2, 3, 0], f"Unexpected bar counts {[index.getNumBars(p) for p in paths]}"
+
+    # the only 2-bar window of a 2-bar clip is the whole clip
+    twoBars = BarIndex.build(paths[:1], BEATS_PER_BAR)
+    npRng = np.random.default_rng(SEED)
+    for _ in range(20):
+        path, startBar, window = twoBars.sampleWindow(npRng, numBars=2)
+        assert startBar == 0, f"Expected the window of a 2-bar clip to start at bar 0, got {startBar}"
+        assert [m.type for m in window.toMidiTrack()][:2] == ["note_on", "note_off"], "Expected the notes of the whole clip"
+    for p in paths:
+        mid = mido.MidiFile(p)
+        for startBar in range(4):
+            expected = tools.trimMidiTrack(mid.tracks[0], startBar, startBar + 2, BEATS_PER_BAR, TICKS_PER_BEAT)
+            assert asStrings(index.getWindowMidiTrack(p, startBar, startBar + 2)) == asStrings(expected), f"Window {startBar} of {p} differs"
+    print("BarIndex tracks that end on a bar line passed")
+
+if __name__ == "__main__":
+    test_barIndex_windows()
+    test_barIndex_activeNotes()
+    test_barIndex_sampleWindow()
+    test_barIndex_barLines()
@@ -0,0 +1,81 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.cache import DiskCache, hashKey
+
+import time
+
+OUTPUT_DIR = TEST_OUT_DIR / "cache"
+CACHE_DIR = OUTPUT_DIR / "diskCache"
+
+def newCache(maxBytes=None):
+    cache = DiskCache(CACHE_DIR, maxBytes=maxBytes)
+    cache.clear()
+    return cache
+
+def test_hashKey():
+    print("///////////////////////////////////////////////")
+    print("Testing hashKey...")
+    assert hashKey(b"abc", {"a": 1, "b": 2}) == hashKey(b"abc", {"b": 2, "a": 1}), "Expected dict key order not to matter"
+    assert hashKey("ab", "c") != hashKey("a", "bc"), "Expected different parts to hash differently"
+    print("hashKey passed")
+
+def test_putAndGet():
+    print("///////////////////////////////////////////////")
+    print("Testing DiskCache put and get...")
+    cache = newCache()
+    key = hashKey("entry")
+    assert cache.get(key) is None, "Expected a miss on an empty cache"
+
+    cache.put(key, {"a.txt": b"hello"})
+    entryDir = cache.get(key)
+    assert entryDir is not None, "Expected a hit after put"
+    with open(f"{entryDir}/a.txt", "rb") as f:
+        assert f.read() == b"hello", "Unexpected entry contents"
+    assert cache.hits == 1 and cache.misses == 1, f"Expected 1 hit and 1 miss, got {cache.hits} and {cache.misses}"
+    print("DiskCache put and get passed")
+
+def test_evictLeastRecentlyUsed():
+    print("///////////////////////////////////////////////")
+    print("Testing DiskCache eviction...")
+    cache = newCache(maxBytes=250)
+    keys = [hashKey(i) for i in range(3)]
+    for key in keys[:2]:
+        cache.put(key, {"data": bytes(100)})
+        time.sleep(0.01)
+    # use the first entry so that the second one is the least recently used
+    cache.get(keys[0])
+    time.sleep(0.01)
+    cache.put(keys[2], {"data": bytes(100)})
+
+    assert cache.size() <= 250, f"Cache size {cache.size()} exceeds maxBytes"
+    assert cache.get(keys[1]) is None, "Expected the least recently used entry to be evicted"
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None, "Expected recently used entries to be kept"
+    print("DiskCache eviction passed")
+
+def test_evictionScans():
+    print("///////////////////////////////////////////////")
+    print("Testing DiskCache eviction scans...")
+    cache = newCache(maxBytes=10000)
+    scans = []
+    entries = cache._entries
+    cache._entries = lambda: scans.append(1) or entries()
+    for i in range(200):
+        cache.put(hashKey(i), {"data": bytes(100)})
+    # one scan on the first put, then one per eviction, each of which frees room for 10 more puts
+    assert len(scans) <= 12, f"Expected the cache size to be tracked between scans, got {len(scans)} scans"
+    assert cache.size() <= 10000, f"Cache size {cache.size()} exceeds maxBytes"
+    assert all(cache.get(hashKey(i)) is not None for i in range(190, 200)), "Expected the latest entries to be kept"
+
+    # an entry larger than maxBytes is kept until the next put
+    big = hashKey("big")
+    entryDir = cache.put(big, {"data": bytes(20000)})
+    assert cache.get(big) == entryDir and os.path.exists(f"{entryDir}/data"), "Expected the entry just stored to be kept"
+    assert len(cache) == 1, "Expected every other entry to be evicted"
+    print("DiskCache eviction scans passed")
+
+if __name__ == "__main__":
+    test_hashKey()
+    test_putAndGet()
+    test_evictLeastRecentlyUsed()
+    test_evictionScans()
@@ -0,0 +1,125 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.constants import PERC_VOICES_MAPPING
+from midiUtils.corpusStats import CorpusStats, VOICES, computeStats
+from midiUtils.dataAug import transformMidiFiles
+from midiUtils.manifest import readManifest
+
+import glob
+import mido
+import numpy as np
+
+OUTPUT_DIR = TEST_OUT_DIR / "corpusStats"
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+PATHS = sorted(glob.glob(str(TEST_DATA_DIR / "*" / "*.mid")))
+STYLES = ["rock" if "rock" in p else os.path.basename(p).split("_")[0] for p in PATHS]
+
+def countNaively(paths, styles) -> dict:
+    """
+    Hits and velocity sums per (style, voice), with mido.
+    """
+    counts = {}
+    for path, style in zip(paths, styles):
+        for track in mido.MidiFile(path).tracks:
+            for msg in track:
+                if msg.type != "note_on" or msg.velocity == 0:
+                    continue
+                for voice, pitches in PERC_VOICES_MAPPING.items():
+                    if msg.note in pitches:
+                        hits, velocities = counts.get((style, voice), (0, 0))
+                        counts[(style, voice)] = (hits + 1, velocities + msg.velocity)
+    return counts
+
+def assertSameStats(stats1: CorpusStats, stats2: CorpusStats):
+    assert sorted(stats1.styles) == sorted(stats2.styles) and stats1.keys == stats2.keys, "Expected the same styles and files"
+    for style in stats1.styles:
+        i, j = stats1.styles.index(style), stats2.styles.index(style)
+        for name in CorpusStats.ARRAYS:
+            assert np.allclose(getattr(stats1, name)[i], getattr(stats2, name)[j]), f"Expected the same {name} for {style}"
+
+def test_corpusStats_counts():
+    print("///////////////////////////////////////////////")
+    print("Testing CorpusStats counts...")
+    stats = CorpusStats()
+    assert stats.addFiles(PATHS, STYLES) == len(set(PATHS)), "Expected every file to be counted"
+    expected = countNaively(PATHS, STYLES)
+    for i, style in enumerate(stats.styles):
+        for v, voice in enumerate(VOICES):
+            hits, velocitySum = expected.get((style, voice), (0, 0))
+            assert stats.hits[i, v] == hits, f"Expected {hits} {voice} hits in {style}, got {stats.hits[i, v]}"
+            assert (stats.velocities[i, v] * np.arange(128)).sum() == velocitySum, f"Unexpected {voice} velocities in {style}"
+            assert stats.onsets[i, v].sum() == hits, f"Expected every {voice} hit of {style} on the onset grid"
+
+    assert stats.getVelocityHistogram().sum() == stats.hits.sum(), "Expected the velocity histogram to count every hit"
+    assert np.isclose(stats.getOnsetDistribution("rock", "KICK").sum(), 1), "Expected an onset distribution"
+    densities = stats.getDensities()
+    i = stats.styles.index("rock")
+    assert np.isclose(densities["rock"]["KICK"], stats.hits[i, 0] / stats.beats[i]), "Expected hits per beat"
+    print(stats.getSummary()["rock"])
+    print("CorpusStats counts passed")
+
+def test_corpusStats_incremental():
+    print("///////////////////////////////////////////////")
+    print("Testing incremental and merged CorpusStats...")
+    full = CorpusStats()
+    full.addFiles(PATHS, STYLES)
+
+    half = len(PATHS) // 2
+    incremental = CorpusStats()
+    incremental.addFiles(PATHS[:half], STYLES[:half])
+    assert incremental.addFiles(PATHS, STYLES) == len(PATHS) - half, "Expected only the new files to be counted"
+    assert incremental.addFiles(PATHS, STYLES) == 0, "Expected no file to be counted twice"
+    assertSameStats(incremental, full)
+
+    part1, part2 = CorpusStats(), CorpusStats()
+    part1.addFiles(PATHS[:half], STYLES[:half])
+    part2.addFiles(PATHS[half:], STYLES[half:])
+    assertSameStats(part1.merge(part2), full)
+    try:
+        part1.merge(full)
+        assert False, "Expected a ValueError when merging stats that share files"
+    except ValueError:
+        pass
+
+    assertSameStats(computeStats(PATHS, STYLES, maxWorkers=2, chunkSize=3), full)
+    assertSameStats(computeStats(PATHS, STYLES, stats=part1, maxWorkers=1), full)
+
+    full.save(OUTPUT_DIR / "stats.npz")
+    assertSameStats(CorpusStats.load(OUTPUT_DIR / "stats.npz"), full)
+    print("incremental and merged CorpusStats passed")
+
+def test_corpusStats_retriever():
+    print("///////////////////////////////////////////////")
+    print("Testing CorpusStats of a seed pool...")
+    ser = SeedExamplesRetriever(EXAMPLES_DIR)
+    stats = CorpusStats()
+    assert stats.addRetriever(ser) == 3 and stats.addRetriever(ser) == 0, "Expected every seed example to be counted once"
+    examples = [ae for style in ser.styles for ae in ser.getExamplesByStyle(style)]
+    expected = countNaively([ae.midi_path for ae in examples], [ae.style for ae in examples])
+    for (style, voice), (hits, _) in expected.items():
+        assert stats.hits[stats.styles.index(style), VOICES.index(voice)] == hits, f"Expected {hits} {voice} hits in {style}"
+    print("CorpusStats of a seed pool passed")
+
+def test_corpusStats_manifest():
+    print("///////////////////////////////////////////////")
+    print("Testing CorpusStats of augmented outputs...")
+    ser = SeedExamplesRetriever(EXAMPLES_DIR)
+    manifestPath = OUTPUT_DIR / "manifest.npy"
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+    outputPaths = transformMidiFiles([TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"], str(OUTPUT_DIR), 2, ser, SEED, numAugmentations=3, manifestPath=manifestPath)
+    stats = CorpusStats()
+    assert stats.addManifest(manifestPath) == 3 and stats.keys == set(outputPaths), "Expected every output to be counted"
+    styles = readManifest(manifestPath)["preferredStyle"]
+    expected = CorpusStats()
+    expected.addFiles(outputPaths, styles)
+    assertSameStats(stats, expected)
+    print("CorpusStats of augmented outputs passed")
+
+if __name__ == "__main__":
+    test_corpusStats_counts()
+    test_corpusStats_incremental()
+    test_corpusStats_retriever()
+    test_corpusStats_manifest()
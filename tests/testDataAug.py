@@ -1,4 +1,5 @@
 import random
+import shutil
 import numpy as np
 import mido
 from collections import Counter
@@ -9,6 +10,8 @@ from tests.utils import *
 from midiUtils import dataAug
 from midiUtils.constants import PERC_VOICES_MAPPING
 from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.manifest import readManifest
+from midiUtils.cache import DiskCache
 
 SOURCE_DIR = TEST_DATA_DIR / "dataAug"
 OUTPUT_DIR = TEST_OUT_DIR / "dataAug"
@@ -81,7 +84,118 @@ def testTransformMidiFile_exhaustCandidates():
     print("We expect the messages: 'Ran out of candidate tracks without repeating voices.' and 'Completely ran out of candidate tracks.' in the output.")
     print(f"Output file written to {OUTPUT_DIR}.")
     print(f"Replacement info: {replacementInfo}")
- 
+
+def testTransformMidiFiles_manifest():
+    print("///////////////////////////////////////////////")
+    print("Testing transformMidiFiles with a manifest...")
+
+    manifestPath = OUTPUT_DIR / "manifest.npy"
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+    numAugmentations = 3
+    outputPaths = dataAug.transformMidiFiles([MIDI_TO_TRANSFORM], OUTPUT_DIR, NUM_REPLACEMENTS, SER, SEED, numAugmentations=numAugmentations, outOfStyleProb=0.5, manifestPath=manifestPath)
+    assert len(outputPaths) == numAugmentations, f"Expected {numAugmentations} outputs, got {len(outputPaths)}."
+
+    manifest = readManifest(manifestPath)
+    assert list(manifest["outputFile"]) == outputPaths, f"Manifest output files {manifest['outputFile']} do not match {outputPaths}."
+    assert manifest["numReplacements"].sum() == len(manifest["voice"]), "Replacement columns do not match numReplacements."
+    replacementStyles = np.repeat(manifest["preferredStyle"], manifest["numReplacements"])
+    for seedFilename, style, outOfStyle in zip(manifest["seedFilename"], replacementStyles, manifest["outOfStyle"]):
+        assert outOfStyle == (SER.getExampleStyle(seedFilename) != style), f"Wrong out-of-style flag for {seedFilename} with preferred style {style}."
+
+    # same seed, same outputs
+    firstRunTracks = [mido.MidiFile(p).tracks[0] for p in outputPaths]
+    rerunPaths = dataAug.transformMidiFiles([MIDI_TO_TRANSFORM], OUTPUT_DIR, NUM_REPLACEMENTS, SER, SEED, numAugmentations=numAugmentations, outOfStyleProb=0.5)
+    for track, p in zip(firstRunTracks, rerunPaths):
+        assert track == mido.MidiFile(p).tracks[0], f"Rerun with the same seed produced a different {p}."
+    print(f"Manifest written to {manifestPath}")
+
+def testTransformMidiFile_cache():
+    print("///////////////////////////////////////////////")
+    print("Testing transformMidiFile with a cache...")
+
+    cache = DiskCache(OUTPUT_DIR / "cache")
+    cache.clear()
+    rng1 = np.random.default_rng(SEED)
+    rng2 = np.random.default_rng(SEED)
+
+    newMid1, replacementInfo1 = dataAug.transformMidiFile(MIDO_MID, TRACK_INDEX, NUM_REPLACEMENTS, SER, rng1, 'songo', 0.5, cache=cache)
+    assert cache.misses == 1 and len(cache) == 1, "Expected the first call to be stored in the cache"
+    newMid2, replacementInfo2 = dataAug.transformMidiFile(MIDO_MID, TRACK_INDEX, NUM_REPLACEMENTS, SER, rng2, 'songo', 0.5, cache=cache)
+    assert cache.hits == 1, "Expected the second call to be a cache hit"
+
+    assert replacementInfo1 == replacementInfo2, f"Cached replacement info {replacementInfo2} differs from {replacementInfo1}"
+    assert newMid1.tracks[TRACK_INDEX] == newMid2.tracks[TRACK_INDEX], "Cached track differs from the computed one"
+    assert rng1.bit_generator.state == rng2.bit_generator.state, "Expected a cache hit to advance the rng like a computation would"
+
+    # different parameters, different entry
+    dataAug.transformMidiFile(MIDO_MID, TRACK_INDEX, NUM_REPLACEMENTS, SER, rng1, 'mambo', 0.5, cache=cache)
+    assert len(cache) == 2, f"Expected 2 cache entries, got {len(cache)}"
+
+    # an entry evicted by another process between get and reading its files is a miss
+    for key in os.listdir(cache.dir):
+        os.remove(f"{cache.dir}/{key}/output.mid")
+    rng3 = np.random.default_rng(SEED)
+    newMid3, replacementInfo3 = dataAug.transformMidiFile(MIDO_MID, TRACK_INDEX, NUM_REPLACEMENTS, SER, rng3, 'songo', 0.5, cache=cache)
+    assert replacementInfo3 == replacementInfo1 and newMid3.tracks[TRACK_INDEX] == newMid1.tracks[TRACK_INDEX], "Expected an evicted entry to be computed again"
+    print("transformMidiFile cache test passed")
+
+def testTransformMidiFile_similarity():
+    print("///////////////////////////////////////////////")
+    print("Testing transformMidiFile with similarity-aware retrieval...")
+
+    targetFeatures = dataAug.getTargetFeatures(MIDO_MID.tracks[TRACK_INDEX], MIDO_MID.ticks_per_beat)
+    candidates = SER.getCandidateTracksInfo('songo', outOfStyle=False, voicesToExclude=[])
+    expected = SER.getFeatureIndex().topKByVoice(targetFeatures, 1, candidates)[0]
+    for seed in range(3):
+        rng = np.random.default_rng(seed)
+        _, replacementInfo = dataAug.transformMidiFile(MIDO_MID, TRACK_INDEX, 1, SER, rng, 'songo', 0.0, similarityTopK=1)
+        assert replacementInfo[0] == expected, f"Expected the closest candidate {expected}, got {replacementInfo[0]}"
+
+    newMid, replacementInfo = dataAug.transformMidiFile(MIDO_MID, TRACK_INDEX, NUM_REPLACEMENTS, SER, RNG, 'songo', 0.2, similarityTopK=2, debug=True)
+    assert NUM_REPLACEMENTS == len(replacementInfo), f"Expected {NUM_REPLACEMENTS} replacements, got {len(replacementInfo)}."
+    newMid.save(f"{OUTPUT_DIR}/rock_testbeat_transf_similarity.mid")
+    print(f"Replacement info: {replacementInfo}")
+
+def testTransformMidiFiles_sameNames():
+    print("///////////////////////////////////////////////")
+    print("Testing transformMidiFiles with files of the same name in different directories...")
+
+    baseDir = OUTPUT_DIR / "sameName"
+    shutil.rmtree(baseDir, ignore_errors=True)
+    midiPaths = []
+    for d in ["a", "b"]:
+        os.makedirs(baseDir / d)
+        midiPaths.append(str(baseDir / d / "rock_testbeat.mid"))
+        shutil.copy(MIDI_TO_TRANSFORM, midiPaths[-1])
+    os.makedirs(baseDir / "out")
+
+    rng1, rng2 = [dataAug.getFileRng(SEED, p, str(baseDir)) for p in midiPaths]
+    assert rng1.integers(1 << 30) != rng2.integers(1 << 30), "Expected files of the same name to get different random streams"
+    try:
+        dataAug.transformMidiFiles(midiPaths, str(baseDir / "out"), NUM_REPLACEMENTS, SER, SEED, numAugmentations=2)
+        assert False, "Expected files of the same name without a rootDir to raise"
+    except ValueError as e:
+        print(f"Raised: {e}")
+    outputPaths = dataAug.transformMidiFiles(midiPaths, str(baseDir / "out"), NUM_REPLACEMENTS, SER, SEED, numAugmentations=2, rootDir=str(baseDir))
+    expected = [f"{baseDir}/out/{d}__rock_testbeat_{k}.mid" for d in ["a", "b"] for k in range(2)]
+    assert outputPaths == expected, f"Expected outputs named after the files' relative paths, got {outputPaths}"
+    assert all(os.path.exists(p) for p in outputPaths), "Expected every output to be written"
+    outputs = [mido.MidiFile(p).tracks for p in outputPaths]
+
+    # a file's outputs do not depend on the other files of the batch
+    single = dataAug.transformMidiFiles(midiPaths[1:], str(baseDir / "out"), NUM_REPLACEMENTS, SER, SEED, numAugmentations=2, rootDir=str(baseDir))
+    assert single == expected[2:] and [mido.MidiFile(p).tracks for p in single] == outputs[2:], "Expected the same outputs in a batch of one"
+    byName = dataAug.transformMidiFiles(midiPaths[:1], str(baseDir / "out"), NUM_REPLACEMENTS, SER, SEED)
+    assert byName == [f"{baseDir}/out/rock_testbeat_0.mid"], f"Expected outputs named after the file without a rootDir, got {byName}"
+
+    try:
+        dataAug.checkOutputNames([baseDir / "a__x.mid", baseDir / "a" / "x.mid"], str(baseDir))
+        assert False, "Expected colliding output names to raise"
+    except ValueError as e:
+        print(f"Raised: {e}")
+    print("transformMidiFiles with files of the same name passed")
+
 if __name__ == '__main__':
     clearOutputDir(OUTPUT_DIR)
 
@@ -90,5 +204,9 @@ if __name__ == '__main__':
     testTransformMidiFile_withOutOfStyleProb()
     testTransformMidiFile_tooManyReplacements()
     testTransformMidiFile_exhaustCandidates()
+    testTransformMidiFiles_manifest()
+    testTransformMidiFile_cache()
+    testTransformMidiFile_similarity()
+    testTransformMidiFiles_sameNames()
 
     synthesizeOutputDir(OUTPUT_DIR)
@@ -0,0 +1,189 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import synth
+from midiUtils.drumRenderer import SampleBank, VELOCITY_LAYERS, getChokeLengths, getDrumHits, renderDrums, renderStems
+from midiUtils.constants import ROLAND_REDUCED_MAPPING, PERC_VOICES_MAPPING
+
+import mido
+import numpy as np
+import pretty_midi
+import soundfile as sf
+
+MIDI_PATH = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+OUTPUT_DIR = TEST_OUT_DIR / "drumRenderer"
+SR = 8000
+
+def getFakeBank() -> SampleBank:
+    """
+    A bank of decaying noise bursts, a different one for every (pitch, layer).
+    """
+    rng = np.random.default_rng(SEED)
+    pitches = sorted(set(p for ps in ROLAND_REDUCED_MAPPING.values() for p in ps))
+    samples = {}
+    for p in pitches:
+        for v in VELOCITY_LAYERS:
+            length = int(SR * rng.uniform(0.2, 1.0))
+            samples[(p, v)] = rng.uniform(-1, 1, length) * np.exp(-np.linspace(0, 6, length)) * v / 127
+    return SampleBank(samples, SR)
+
+BANK = getFakeBank()
+
+def getMidi(notes, ticksPerBeat=480, tempo=500000) -> mido.MidiFile:
+    """
+    notes: (tick, pitch, velocity) note_ons, each followed by its note_off 10 ticks later.
+    """
+    events = []
+    for tick, pitch, velocity in notes:
+        events.append((tick, mido.Message('note_on', note=pitch, velocity=velocity, channel=9)))
+        events.append((tick + 10, mido.Message('note_off', note=pitch, velocity=64, channel=9)))
+    events.sort(key=lambda e: e[0])
+    track = mido.MidiTrack([mido.MetaMessage('set_tempo', tempo=tempo)])
+    previous = 0
+    for tick, msg in events:
+        track.append(msg.copy(time=tick - previous))
+        previous = tick
+    track.append(mido.MetaMessage('end_of_track'))
+    return mido.MidiFile(ticks_per_beat=ticksPerBeat, tracks=[track])
+
+def renderReference(mid: mido.MidiFile, bank: SampleBank, chokeFade: int) -> np.ndarray:
+    """
+    Adds every hit one by one.
+    """
+    onsets, pitches, velocities, endTime = getDrumHits(mid)
+    onsets = (onsets * bank.sr).astype(np.int64)
+    chokeLengths = getChokeLengths(onsets, pitches, [ROLAND_REDUCED_MAPPING["HH_CLOSED"] + ROLAND_REDUCED_MAPPING["HH_OPEN"]])
+    out = np.zeros(int(np.ceil(bank.sr * (endTime + 1))) + bank.sr * 2)
+    for onset, pitch, velocity, chokeLength in zip(onsets, pitches, velocities, chokeLengths):
+        layer = int(bank.getLayers(np.array([velocity]))[0])
+        if (pitch, layer) not in bank.samples:
+            continue
+        sample = bank.samples[(pitch, layer)] * (velocity / layer) ** 2
+        if 0 <= chokeLength < len(sample):
+            sample = sample[:chokeLength] * np.clip((chokeLength - np.arange(chokeLength)) / chokeFade, 0, 1)
+        out[onset:onset + len(sample)] += sample
+    return out
+
+def test_getDrumHits():
+    print("///////////////////////////////////////////////")
+    print("Testing getDrumHits against pretty_midi...")
+    onsets, pitches, velocities, _ = getDrumHits(MIDI_PATH)
+    pm = pretty_midi.PrettyMIDI(str(MIDI_PATH))
+    notes = sorted((n.start, n.pitch, n.velocity) for i in pm.instruments for n in i.notes)
+    assert len(notes) == len(onsets), f"Expected {len(notes)} hits, got {len(onsets)}"
+    assert np.allclose(sorted(onsets), [n[0] for n in notes]), "Expected the onsets of pretty_midi"
+    print("getDrumHits passed")
+
+def test_renderDrums_singleHits():
+    print("///////////////////////////////////////////////")
+    print("Testing renderDrums on single hits...")
+    audio = renderDrums(getMidi([(480, 38, 64)]), BANK, normalize=False)
+    sample = BANK.samples[(38, 64)]
+    assert np.allclose(audio[SR // 2:SR // 2 + len(sample)], sample), "Expected the sample at the onset"
+    assert not audio[:SR // 2].any(), "Expected silence before the onset"
+
+    audio = renderDrums(getMidi([(0, 38, 48)]), BANK, normalize=False)
+    assert np.allclose(audio[:len(sample)], sample * (48 / 64) ** 2), "Expected velocity 48 to use the 64 layer, scaled down"
+
+    audio = renderDrums(getMidi([(0, 36, 127), (0, 38, 100)]), BANK)
+    assert np.isclose(np.abs(audio).max(), 1), "Expected a normalized mix"
+    print("renderDrums on single hits passed")
+
+def test_renderDrums_choke():
+    print("///////////////////////////////////////////////")
+    print("Testing renderDrums choke groups...")
+    # an open hi-hat choked by a closed one a quarter second later, and a crash that is not choked
+    audio = renderDrums(getMidi([(0, 46, 127), (0, 49, 127), (240, 42, 127)]), BANK, chokeFade=0.001, normalize=False)
+    crash = BANK.samples[(49, 127)]
+    openHat = BANK.samples[(46, 127)]
+    closedHat = BANK.samples[(42, 127)]
+    chokeAt = SR // 4
+    expected = np.zeros(len(audio))
+    expected[:len(crash)] += crash
+    expected[:chokeAt] += openHat[:chokeAt] * np.clip((chokeAt - np.arange(chokeAt)) / (SR // 1000), 0, 1)
+    expected[chokeAt:chokeAt + len(closedHat)] += closedHat
+    assert np.allclose(audio, expected), "Expected the open hi-hat to be cut off by the closed one"
+    print("renderDrums choke groups passed")
+
+def test_renderDrums_reference():
+    print("///////////////////////////////////////////////")
+    print("Testing renderDrums against hit by hit mixing...")
+    rng = np.random.default_rng(SEED)
+    pitches = [36, 38, 42, 44, 46, 49, 51, 60]
+    for _ in range(10):
+        notes = [(int(rng.integers(0, 3840)), int(rng.choice(pitches)), int(rng.integers(1, 128))) for _ in range(40)]
+        mid = getMidi(notes, tempo=int(rng.integers(300000, 700000)))
+        audio = renderDrums(mid, BANK, chokeFade=0.002, normalize=False)
+        reference = renderReference(mid, BANK, int(0.002 * SR))
+        assert np.allclose(audio, reference[:len(audio)], atol=1e-6) and not reference[len(audio):].any(), "Expected the reference mix"
+    print("renderDrums against hit by hit mixing passed")
+
+def test_sampleBank_saveLoad():
+    print("///////////////////////////////////////////////")
+    print("Testing SampleBank save and load...")
+    path = OUTPUT_DIR / "bank.npz"
+    BANK.save(path)
+    loaded = SampleBank.load(path)
+    assert loaded.sr == BANK.sr and list(loaded.velocityLayers) == list(BANK.velocityLayers), "Expected the same rate and layers"
+    assert loaded.samples.keys() == BANK.samples.keys(), "Expected the same samples"
+    for key in BANK.samples:
+        assert np.array_equal(loaded.samples[key], BANK.samples[key]), f"Sample {key} differs"
+    print("SampleBank save and load passed")
+
+def test_synth_withBank():
+    print("///////////////////////////////////////////////")
+    print("Testing synth.midi_to_audio with a sample bank...")
+    synth.midi_to_audio(str(MIDI_PATH), OUTPUT_DIR, prefix="bank_", sr=SR, bank=BANK)
+    audio, sr = sf.read(OUTPUT_DIR / "bank_rock_testbeat.wav")
+    assert sr == SR, f"Expected a rate of {SR}, got {sr}"
+    assert np.allclose(audio, renderDrums(MIDI_PATH, BANK), atol=1e-6), "Expected the rendered audio"
+    try:
+        synth.midi_to_audio(str(MIDI_PATH), OUTPUT_DIR, prefix="bank_", bank=BANK)
+        assert False, "Expected a ValueError for mismatching rates"
+    except ValueError:
+        pass
+    print("synth.midi_to_audio with a sample bank passed")
+
+def test_renderStems():
+    print("///////////////////////////////////////////////")
+    print("Testing renderStems...")
+    names, stems = renderStems(MIDI_PATH, BANK, normalize=False)
+    assert names == list(PERC_VOICES_MAPPING), f"Expected a stem per voice, got {names}"
+    mix = renderDrums(MIDI_PATH, BANK, normalize=False)
+    assert stems.shape == (len(names), len(mix)), f"Expected stems of shape {(len(names), len(mix))}, got {stems.shape}"
+    assert np.allclose(stems.sum(axis=0), mix), "Expected the stems to add up to the mix"
+
+    _, pitches, _, _ = getDrumHits(MIDI_PATH)
+    for name, stem in zip(names, stems):
+        hasHits = np.isin(pitches, PERC_VOICES_MAPPING[name]).any()
+        assert stem.any() == hasHits, f"Expected the {name} stem to be silent exactly when the voice has no hits"
+
+    _, normalized = renderStems(MIDI_PATH, BANK)
+    assert np.isclose(np.abs(normalized.sum(axis=0)).max(), 1), "Expected stems normalized by the peak of their mix"
+    print("renderStems passed")
+
+def test_synth_stems():
+    print("///////////////////////////////////////////////")
+    print("Testing synth.midi_to_stems...")
+    names, stems = synth.render_stems(str(MIDI_PATH), SR, BANK)
+    assert synth.midi_to_stems(str(MIDI_PATH), OUTPUT_DIR, prefix="", sr=SR, bank=BANK) == names, "Expected the voice names"
+    audio, sr = sf.read(OUTPUT_DIR / "rock_testbeat_stems.wav")
+    assert sr == SR and audio.shape == stems.T.shape, f"Expected a {len(names)} channel file, got shape {audio.shape}"
+    assert np.allclose(audio, stems.T, atol=1e-6), "Expected a channel per stem"
+
+    synth.midi_to_stems(str(MIDI_PATH), OUTPUT_DIR, prefix="", sr=SR, bank=BANK, multichannel=False)
+    for name, stem in zip(names, stems):
+        audio, _ = sf.read(OUTPUT_DIR / f"rock_testbeat_{name}.wav")
+        assert np.allclose(audio, stem, atol=1e-6), f"Expected the {name} stem"
+    print("synth.midi_to_stems passed")
+
+if __name__ == "__main__":
+    clearOutputDir(OUTPUT_DIR)
+    test_getDrumHits()
+    test_renderDrums_singleHits()
+    test_renderDrums_choke()
+    test_renderDrums_reference()
+    test_sampleBank_saveLoad()
+    test_synth_withBank()
+    test_renderStems()
+    test_synth_stems()
@@ -0,0 +1,94 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import tools
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.editPipeline import EditPipeline
+
+import mido
+import random
+
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+MIDI_PATH = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+OUTPUT_DIR = TEST_OUT_DIR / "editPipeline"
+PITCHES = [36, 38, 42, 46, 49, 51]
+
+def getRandomTrack(rng: random.Random, notesOnly=False, endOfTrackInside=False) -> mido.MidiTrack:
+    """
+    A random track with ties in time, velocity 0 note_ons and, optionally, end of track messages before its end.
+    """
+    track = mido.MidiTrack()
+    if not notesOnly:
+        track.append(mido.MetaMessage('set_tempo', tempo=500000))
+        track.append(mido.MetaMessage('track_name', name='random'))
+    for _ in range(rng.randint(0, 30)):
+        r = rng.random()
+        time = rng.choice([0, 0, 0, 1, 5, 120, 240])
+        note = rng.choice(PITCHES)
+        channel = rng.choice([0, 9])
+        if r < 0.45:
+            track.append(mido.Message('note_on', note=note, velocity=rng.choice([0, 64, 100]), channel=channel, time=time))
+        elif r < 0.85:
+            track.append(mido.Message('note_off', note=note, velocity=64, channel=channel, time=time))
+        elif not notesOnly and r < 0.92:
+            track.append(mido.Message('control_change', control=4, value=3, channel=channel, time=time))
+        elif not notesOnly:
+            track.append(mido.MetaMessage('marker', text='m', time=time))
+        if endOfTrackInside and rng.random() < 0.05:
+            track.append(mido.MetaMessage('end_of_track'))
+    track.append(mido.MetaMessage('end_of_track', time=rng.choice([0, 10, 500])))
+    return track
+
+def asStrings(track):
+    return [str(m) for m in track]
+
+def test_editPipeline_matchesTools():
+    print("///////////////////////////////////////////////")
+    print("Testing EditPipeline against tools...")
+    rng = random.Random(SEED)
+    for i in range(200):
+        endOfTrackInside = i % 3 == 0
+        track = getRandomTrack(rng, endOfTrackInside=endOfTrackInside)
+        noteTracks = [getRandomTrack(rng, notesOnly=rng.random() < 0.5, endOfTrackInside=endOfTrackInside) for _ in range(rng.randint(0, 3))]
+        pitches = rng.sample(PITCHES, rng.randint(0, 3))
+        channel = rng.randint(0, 15)
+
+        expected = tools.allMessagesToChannel(tools.mergeMultipleTracks(tools.deletePitches(track, pitches), noteTracks), channel)
+        actual = EditPipeline(track).deletePitches(pitches).merge(noteTracks).toChannel(channel).toMidiTrack()
+        assert asStrings(actual) == asStrings(expected), f"Edit {i} differs from tools"
+
+        startBar = rng.randint(0, 2)
+        endBar = startBar + rng.randint(1, 3)
+        try:
+            expected = tools.trimMidiTrack(tools.mergeMultipleTracks(track, noteTracks), startBar, endBar, 1, 120)
+        except IndexError:
+            # getMidiSlice fails on slices with nothing to copy
+            continue
+        actual = EditPipeline(track).merge(noteTracks).trim(startBar, endBar, 1, 120).toMidiTrack()
+        assert asStrings(actual) == asStrings(expected), f"Trim {i} differs from tools"
+    print("EditPipeline against tools passed")
+
+def test_editPipeline_seedTracks():
+    print("///////////////////////////////////////////////")
+    print("Testing EditPipeline on seed tracks...")
+    mid = mido.MidiFile(MIDI_PATH)
+    ser = SeedExamplesRetriever(EXAMPLES_DIR)
+    noteTracks = [ser.getTrack('songo_kit.mid', 'KICK'), ser.getTrack('mambo_bell1.mid', 'RIDE')]
+    edit = EditPipeline(mid.tracks[0]).deletePitches([36]).deletePitches([51, 53]).merge(noteTracks).toChannel(3).toChannel(9)
+    assert len(edit) == 3, f"Expected consecutive edits to be fused, got {edit}"
+
+    expected = tools.allMessagesToChannel(tools.mergeMultipleTracks(tools.deletePitches(mid.tracks[0], [36, 51, 53]), noteTracks), 9)
+    actual = edit.toMidiTrack()
+    assert asStrings(actual) == asStrings(expected), "Expected the pipeline to match tools"
+    trimmed = edit.trim(1, 2, 4, mid.ticks_per_beat).toMidiTrack()
+    assert asStrings(trimmed) == asStrings(tools.trimMidiTrack(expected, 1, 2, 4, mid.ticks_per_beat)), "Expected the trimmed pipeline to match tools"
+
+    newMid = mido.MidiFile(ticks_per_beat=mid.ticks_per_beat)
+    newMid.tracks.append(trimmed)
+    newMid.save(OUTPUT_DIR / "trimmed.mid")
+    print("EditPipeline on seed tracks passed")
+
+if __name__ == "__main__":
+    clearOutputDir(OUTPUT_DIR)
+    test_editPipeline_matchesTools()
+    test_editPipeline_seedTracks()
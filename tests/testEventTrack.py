@@ -0,0 +1,160 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.eventTrack import EventTrack, EventMidiFile, readSmfFile, readSmfBytes, writeSmfBytes, toSmfBytes, saveMidiFiles
+from midiUtils.constants import PERC_VOICES_MAPPING
+from midiUtils import tools
+
+import io
+import mido
+import numpy as np
+
+OUTPUT_DIR = TEST_OUT_DIR / "eventTrack"
+
+def midoBytes(mid: mido.MidiFile) -> bytes:
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+def allTestMidiPaths():
+    paths = []
+    for root, _, files in os.walk(TEST_DATA_DIR):
+        paths.extend(Path(root) / f for f in files if f.endswith(".mid"))
+    return sorted(paths)
+
+def test_readSmfFile_matchesMido():
+    print("///////////////////////////////////////////////")
+    print("Testing readSmfFile against mido...")
+
+    for path in allTestMidiPaths():
+        mid = mido.MidiFile(path)
+        eventMid = readSmfFile(path)
+        assert eventMid.type == mid.type, f"{path}: type {eventMid.type} != {mid.type}"
+        assert eventMid.ticksPerBeat == mid.ticks_per_beat, f"{path}: ticksPerBeat {eventMid.ticksPerBeat} != {mid.ticks_per_beat}"
+        assert len(eventMid.tracks) == len(mid.tracks), f"{path}: {len(eventMid.tracks)} tracks != {len(mid.tracks)}"
+        for eventTrack, track in zip(eventMid.tracks, mid.tracks):
+            assert eventTrack.toMidiTrack() == track, f"{path}: decoded track differs from mido's"
+    print(f"readSmfFile matches mido for {len(allTestMidiPaths())} files")
+
+def test_readSmfFile_mmapAndBytes():
+    print("///////////////////////////////////////////////")
+    print("Testing readSmfFile with and without mmap...")
+
+    path = allTestMidiPaths()[0]
+    with open(path, "rb") as f:
+        fromBytes = readSmfBytes(f.read())
+    fromMmap = readSmfFile(path, useMmap=True)
+    for t1, t2 in zip(fromBytes.tracks, fromMmap.tracks):
+        assert (t1.events == t2.events).all(), "Expected the same events from bytes and from an mmap"
+    print("readSmfFile with and without mmap passed")
+
+def test_readSmfFile_truncated():
+    print("///////////////////////////////////////////////")
+    print("Testing readSmfFile on a truncated file...")
+
+    path = allTestMidiPaths()[0]
+    truncatedPath = OUTPUT_DIR / "truncated.mid"
+    with open(path, "rb") as f:
+        data = f.read()
+    # cut inside the last end_of_track
+    with open(truncatedPath, "wb") as f:
+        f.write(data[:-2])
+    for useMmap in [True, False]:
+        try:
+            readSmfFile(truncatedPath, useMmap=useMmap)
+            assert False, "Expected an EOFError"
+        except EOFError as e:
+            assert str(truncatedPath) in str(e), f"Expected the file name in the error, got {e}"
+    print("readSmfFile on a truncated file passed")
+
+def test_fromMidiTrack_roundTrip():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTrack.fromMidiTrack round trip...")
+
+    for path in allTestMidiPaths():
+        mid = mido.MidiFile(path)
+        eventMid = EventMidiFile.fromMidiFile(mid)
+        assert eventMid.toMidiFile().tracks == mid.tracks, f"{path}: round trip changed the tracks"
+    print("EventTrack.fromMidiTrack round trip passed")
+
+def test_selectPitches():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTrack.selectPitches against tools.getTrackWithSelectPitches...")
+
+    path = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+    track = mido.MidiFile(path).tracks[0]
+    eventTrack = readSmfFile(path).tracks[0]
+    for pitches in PERC_VOICES_MAPPING.values():
+        for notesOnly in [True, False]:
+            expected = tools.getTrackWithSelectPitches(track, pitches, notesOnly=notesOnly)
+            actual = eventTrack.selectPitches(pitches, notesOnly=notesOnly).toMidiTrack()
+            assert actual == expected, f"selectPitches({pitches}, notesOnly={notesOnly}) differs from getTrackWithSelectPitches"
+            assert eventTrack.hasNoteOn(pitches) == (not tools.isTrackEmpty(expected)), f"hasNoteOn({pitches}) differs from isTrackEmpty"
+    print("EventTrack.selectPitches passed")
+
+def test_concatenate():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTrack.concatenate...")
+
+    tracks = [readSmfFile(p).tracks[0] for p in allTestMidiPaths()[:3]]
+    stacked = EventTrack.concatenate(tracks)
+    assert len(stacked) == sum(len(t) for t in tracks), "Unexpected number of events"
+    metaIndices = np.flatnonzero(stacked.status == 0xFF)
+    expectedPayloads = [t.getPayload(i) for t in tracks for i in np.flatnonzero(t.status == 0xFF)]
+    assert [stacked.getPayload(i) for i in metaIndices] == expectedPayloads, "Meta payloads changed after concatenation"
+    print("EventTrack.concatenate passed")
+
+def test_writeSmfBytes_matchesMido():
+    print("///////////////////////////////////////////////")
+    print("Testing writeSmfBytes against mido...")
+
+    for path in allTestMidiPaths():
+        expected = midoBytes(mido.MidiFile(path))
+        assert writeSmfBytes(readSmfFile(path)) == expected, f"{path}: encoded bytes differ from mido's"
+        assert writeSmfBytes(EventMidiFile.fromMidiFile(mido.MidiFile(path))) == expected, f"{path}: encoded bytes differ from mido's after fromMidiFile"
+    print("writeSmfBytes matches mido")
+
+def test_writeSmfBytes_endOfTrack():
+    print("///////////////////////////////////////////////")
+    print("Testing writeSmfBytes end of track handling...")
+
+    track = mido.MidiTrack([
+        mido.Message('note_on', note=36, velocity=100, time=0),
+        mido.MetaMessage('end_of_track', time=10),
+        mido.Message('note_off', note=36, velocity=64, time=5),
+        mido.MetaMessage('end_of_track', time=20),
+    ])
+    noEotTrack = mido.MidiTrack([mido.Message('note_on', note=38, velocity=90, channel=9, time=3)])
+    for t in [track, noEotTrack, mido.MidiTrack()]:
+        mid = mido.MidiFile()
+        mid.tracks.append(t)
+        assert toSmfBytes(EventMidiFile.fromMidiFile(mid)) == midoBytes(mid), f"Encoded bytes differ from mido's for {t}"
+    print("writeSmfBytes end of track handling passed")
+
+def test_saveMidiFiles():
+    print("///////////////////////////////////////////////")
+    print("Testing saveMidiFiles...")
+
+    paths = allTestMidiPaths()
+    items = []
+    for i, path in enumerate(paths):
+        mid = readSmfFile(path) if i % 2 == 0 else mido.MidiFile(path)
+        items.append((OUTPUT_DIR / f"batch_{i}.mid", mid))
+    written = saveMidiFiles(items, maxWorkers=3, maxPending=2)
+    assert written == len(paths), f"Expected {len(paths)} files written, got {written}"
+    for (outPath, _), path in zip(items, paths):
+        assert mido.MidiFile(outPath).tracks == mido.MidiFile(path).tracks, f"{outPath} differs from {path}"
+    print(f"saveMidiFiles wrote {written} files to {OUTPUT_DIR}")
+
+if __name__ == "__main__":
+    clearOutputDir(OUTPUT_DIR)
+
+    test_readSmfFile_matchesMido()
+    test_readSmfFile_mmapAndBytes()
+    test_readSmfFile_truncated()
+    test_fromMidiTrack_roundTrip()
+    test_selectPitches()
+    test_concatenate()
+    test_writeSmfBytes_matchesMido()
+    test_writeSmfBytes_endOfTrack()
+    test_saveMidiFiles()
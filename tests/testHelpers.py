@@ -0,0 +1,181 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import helpers
+from midiUtils.absTrack import AbsoluteTimeTrack
+from midiUtils.constants import END_OF_TRACK
+
+import math
+import mido
+import shutil
+
+SOURCE_DIR = TEST_DATA_DIR / "tools"
+OUTPUT_DIR = TEST_OUT_DIR / "helpers"
+
+MERGEES = [SOURCE_DIR / 'mergee1.mid', SOURCE_DIR / 'mergee2.mid', SOURCE_DIR / 'mergee3.mid']
+
+def getNoteAbsTimes(track: mido.MidiTrack) -> list:
+    return [am.absTime for am in AbsoluteTimeTrack(track) if am.msg.type in ['note_on', 'note_off']]
+
+def expectedNoteAbsTimes(paths, startTimes) -> list:
+    expected = []
+    for path, startTime in zip(paths, startTimes):
+        expected.extend(t + startTime for t in getNoteAbsTimes(mido.MidiFile(path).tracks[0]))
+    return expected
+
+def test_concatenateMidiFiles():
+    print("///////////////////////////////////////////////")
+    print("Testing concatenateMidiFiles...")
+
+    outputPath = helpers.concatenateMidiFiles(SOURCE_DIR, OUTPUT_DIR, outputName="concatenated.mid")
+    assert outputPath == f"{OUTPUT_DIR}/concatenated.mid", f"Unexpected output path {outputPath}"
+
+    paths = helpers.getSortedMidiFiles(SOURCE_DIR, order="name")
+    tracks = [mido.MidiFile(p).tracks[0] for p in paths]
+    startTimes = [0]
+    for t in tracks[:-1]:
+        startTimes.append(startTimes[-1] + helpers.getEndTime(t))
+
+    concatTrack = mido.MidiFile(outputPath).tracks[0]
+    assert getNoteAbsTimes(concatTrack) == expectedNoteAbsTimes(paths, startTimes), "Note times of the concatenated track are not the shifted note times of the inputs"
+    assert concatTrack[-1].type == END_OF_TRACK, "Expected the concatenated track to end with an end of track"
+    assert sum(1 for m in concatTrack if m.type == END_OF_TRACK) == 1, "Expected a single end of track"
+    assert helpers.getEndTime(concatTrack) == startTimes[-1] + helpers.getEndTime(tracks[-1]), "Unexpected end time"
+
+    metaData, _ = helpers.getMetaDataAndIndex(tracks[0])
+    assert concatTrack[:len(metaData)] == metaData, "Expected the first file's metadata at the start of the concatenated track"
+    print(f"Saved to {outputPath}")
+
+def test_streamConcatenateMidiFiles_gapAndBars():
+    print("///////////////////////////////////////////////")
+    print("Testing streamConcatenateMidiFiles with gaps and bar alignment...")
+
+    outputPath = OUTPUT_DIR / "concatenated_bars.mid"
+    gapTicks = 7
+    helpers.streamConcatenateMidiFiles(MERGEES, outputPath, gapTicks=gapTicks, alignToBars=True, beatsPerBar=4)
+
+    mid = mido.MidiFile(outputPath)
+    barLength = mid.ticks_per_beat * 4
+    startTimes = [0]
+    for p in MERGEES[:-1]:
+        end = startTimes[-1] + helpers.getEndTime(mido.MidiFile(p).tracks[0]) + gapTicks
+        startTimes.append(math.ceil(end / barLength) * barLength)
+    for s in startTimes:
+        assert s % barLength == 0, f"Start time {s} is not on a bar line"
+
+    assert getNoteAbsTimes(mid.tracks[0]) == expectedNoteAbsTimes(MERGEES, startTimes), "Note times do not match the bar aligned start times"
+    assert helpers.getEndTime(mid.tracks[0]) % barLength == 0, "Expected the concatenated track to end on a bar line"
+    print(f"Saved to {outputPath}")
+
+def test_getSortedMidiFiles():
+    print("///////////////////////////////////////////////")
+    print("Testing getSortedMidiFiles...")
+
+    byName = helpers.getSortedMidiFiles(SOURCE_DIR, order="name")
+    assert byName == sorted(byName), "Expected files sorted by name"
+    reverse = helpers.getSortedMidiFiles(SOURCE_DIR, order=lambda p: -len(os.path.basename(p)))
+    assert set(reverse) == set(byName), "Expected the same files for any order"
+    try:
+        helpers.getSortedMidiFiles(SOURCE_DIR, order="size")
+        assert False, "Expected a ValueError for an unknown order"
+    except ValueError as e:
+        print(f"Caught expected exception: {e}")
+    print("getSortedMidiFiles passed")
+
+def copyToOutput(path, name):
+    outputPath = OUTPUT_DIR / name
+    shutil.copyfile(path, outputPath)
+    return outputPath
+
+def getMetaMessages(mid: mido.MidiFile, type: str) -> list:
+    return [m for t in mid.tracks for m in t if m.type == type]
+
+def test_setMidiTempo_patched():
+    print("///////////////////////////////////////////////")
+    print("Testing setMidiTempo on a file with a set_tempo message...")
+
+    sourcePath = TEST_DATA_DIR / "absTrack" / "1_rock_110_beat_4-4_slice_208.mid"
+    path = copyToOutput(sourcePath, "tempo_patched.mid")
+    original = mido.MidiFile(sourcePath)
+    assert len(getMetaMessages(original, 'set_tempo')) > 0, "Test file is expected to have a set_tempo message"
+
+    result = helpers.setMidiTempo(path, tempo=400000)
+    assert result == "patched", f"Expected the file to be patched, got {result}"
+
+    patched = mido.MidiFile(path)
+    assert all(m.tempo == 400000 for m in getMetaMessages(patched, 'set_tempo')), "Expected every set_tempo to be changed"
+    assert len(patched.tracks) == len(original.tracks), "Expected all tracks to be kept"
+    notes = lambda mid: [m for t in mid.tracks for m in t if not m.is_meta]
+    assert notes(patched) == notes(original), "Expected non meta messages to be unchanged"
+    print(f"Saved to {path}")
+
+def test_setMidiTempo_rewritten():
+    print("///////////////////////////////////////////////")
+    print("Testing setMidiTempo when a message has to be inserted...")
+
+    mid = mido.MidiFile()
+    mid.tracks.append(mido.MidiTrack([
+        mido.MetaMessage('track_name', name='drums', time=0),
+        mido.Message('note_on', note=36, velocity=100, time=0),
+        mido.Message('note_off', note=36, velocity=64, time=240),
+    ]))
+    mid.tracks.append(mido.MidiTrack([mido.Message('note_on', note=38, velocity=90, time=120)]))
+    path = OUTPUT_DIR / "tempo_rewritten.mid"
+    mid.save(path)
+
+    result = helpers.setMidiTempo(path, tempo=300000, timeSignature=(6, 8))
+    assert result == "rewritten", f"Expected the file to be rewritten, got {result}"
+
+    rewritten = mido.MidiFile(path)
+    assert len(rewritten.tracks) == 2, "Expected both tracks to be kept"
+    assert [m.type for m in rewritten.tracks[0][:3]] == ['track_name', 'set_tempo', 'time_signature'], "Expected the new messages after the beginning metadata"
+    timeSignature = getMetaMessages(rewritten, 'time_signature')[0]
+    assert (timeSignature.numerator, timeSignature.denominator) == (6, 8), f"Unexpected time signature {timeSignature}"
+
+    # now that the messages exist, they can be patched
+    assert helpers.setMidiTempo(path, tempo=500000, timeSignature=(3, 4)) == "patched", "Expected the second change to be patched"
+    timeSignature = getMetaMessages(mido.MidiFile(path), 'time_signature')[0]
+    assert (timeSignature.numerator, timeSignature.denominator) == (3, 4), f"Unexpected time signature {timeSignature}"
+    print(f"Saved to {path}")
+
+def test_setMidiTempo_invalid():
+    print("///////////////////////////////////////////////")
+    print("Testing setMidiTempo with an invalid time signature...")
+
+    sourcePath = TEST_DATA_DIR / "absTrack" / "1_rock_110_beat_4-4_slice_208.mid"
+    path = copyToOutput(sourcePath, "tempo_invalid.mid")
+    with open(path, "rb") as f:
+        original = f.read()
+    for tempo, timeSignature in [(None, (6, 6)), (None, (0, 4)), (None, (256, 4)), (None, (4, 0)), (0, None), (1 << 24, None)]:
+        try:
+            helpers.setMidiTempo(path, tempo=tempo, timeSignature=timeSignature)
+            assert False, f"Expected a ValueError for tempo {tempo}, time signature {timeSignature}"
+        except ValueError as e:
+            print(f"Raised: {e}")
+    with open(path, "rb") as f:
+        assert f.read() == original, "Expected the file to be left unchanged"
+    print("setMidiTempo with an invalid time signature passed")
+
+def test_changeTempoBatch():
+    print("///////////////////////////////////////////////")
+    print("Testing changeTempoBatch...")
+
+    paths = [copyToOutput(p, f"tempo_batch_{i}.mid") for i, p in enumerate(MERGEES)]
+    results = helpers.changeTempoBatch(paths, tempo=600000, maxWorkers=2)
+    assert len(results) == len(paths), f"Expected {len(paths)} results, got {len(results)}"
+    for p in paths:
+        tempos = [m.tempo for m in getMetaMessages(mido.MidiFile(p), 'set_tempo')]
+        assert tempos and all(t == 600000 for t in tempos), f"Unexpected tempos {tempos} in {p}"
+    assert not any(f.endswith(".tmp") for f in os.listdir(OUTPUT_DIR)), "Expected no temporary files left behind"
+    print("changeTempoBatch passed")
+
+if __name__ == "__main__":
+    clearOutputDir(OUTPUT_DIR)
+
+    test_concatenateMidiFiles()
+    test_streamConcatenateMidiFiles_gapAndBars()
+    test_getSortedMidiFiles()
+    test_setMidiTempo_patched()
+    test_setMidiTempo_rewritten()
+    test_setMidiTempo_invalid()
+    test_changeTempoBatch()
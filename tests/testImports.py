@@ -0,0 +1,49 @@
+from tests.constants import *
+from tests.utils import *
+
+import json
+import subprocess
+import sys
+
+# modules that a core import (absTrack/tools) or a bare synth import must not load
+HEAVY_MODULES = ["numpy", "pretty_midi", "soundfile", "fluidsynth", "note_seq", "scipy"]
+# generous, so that only a real regression (e.g. a heavy import at module level) fails the benchmark
+CORE_IMPORT_BUDGET = 0.5
+
+def measureImport(module: str, runs: int = 3) -> dict:
+    """
+    Imports module in fresh interpreters and returns the best import time in seconds, and the heavy modules it loaded.
+    """
+    code = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - t\n"
+        f"print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=baseDir.parent, capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {"seconds": min(r["seconds"] for r in results), "heavy": results[0]["heavy"]}
+
+def test_coreImports():
+    print("///////////////////////////////////////////////")
+    print("Testing core import time...")
+    for module in ["midiUtils.absTrack", "midiUtils.tools"]:
+        result = measureImport(module)
+        print(f"{module}: {result['seconds'] * 1000:.1f} ms")
+        assert result["heavy"] == [], f"Expected {module} not to import {result['heavy']}"
+        assert result["seconds"] < CORE_IMPORT_BUDGET, f"Importing {module} took {result['seconds']:.3f}s, over the {CORE_IMPORT_BUDGET}s budget"
+    print("core import time passed")
+
+def test_synthImportIsLazy():
+    print("///////////////////////////////////////////////")
+    print("Testing synth lazy imports...")
+    result = measureImport("midiUtils.synth", runs=1)
+    assert result["heavy"] == [], f"Expected midiUtils.synth not to import {result['heavy']} until it synthesizes"
+    print("synth lazy imports passed")
+
+if __name__ == "__main__":
+    test_coreImports()
+    test_synthImportIsLazy()
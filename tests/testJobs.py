@@ -0,0 +1,170 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.dataAug import transformMidiFiles
+from midiUtils.jobs import AugmentationJob, LeaseRenewer, runJobInProcesses
+from midiUtils.manifest import readManifest
+
+import numpy as np
+import shutil
+import time
+
+OUTPUT_DIR = TEST_OUT_DIR / "jobs"
+INPUT_DIR = OUTPUT_DIR / "input"
+REFERENCE_DIR = OUTPUT_DIR / "reference"
+JOB_DIR = OUTPUT_DIR / "job"
+MANIFEST_DIR = OUTPUT_DIR / "manifests"
+JOURNAL_PATH = OUTPUT_DIR / "job.sqlite"
+SOURCE_PATH = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+NUM_FILES = 10
+NUM_REPLACEMENTS = 2
+SER = SeedExamplesRetriever(EXAMPLES_DIR)
+
+def setUp() -> list:
+    for d in [INPUT_DIR, REFERENCE_DIR, JOB_DIR, MANIFEST_DIR]:
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+    if os.path.exists(JOURNAL_PATH):
+        os.remove(JOURNAL_PATH)
+    paths = []
+    for i in range(NUM_FILES):
+        path = str(INPUT_DIR / f"beat_{i}.mid")
+        shutil.copy(SOURCE_PATH, path)
+        paths.append(path)
+    return paths
+
+def readAll(dir) -> dict:
+    contents = {}
+    for filename in sorted(os.listdir(dir)):
+        with open(f"{dir}/{filename}", "rb") as f:
+            contents[filename] = f.read()
+    return contents
+
+def createJob(paths) -> AugmentationJob:
+    return AugmentationJob.create(JOURNAL_PATH, paths, str(JOB_DIR), SER, SEED, NUM_REPLACEMENTS, shardSize=3, manifestDir=str(MANIFEST_DIR), numAugmentations=2)
+
+def runReference(paths):
+    referenceManifest = str(REFERENCE_DIR / "manifest.npy")
+    transformMidiFiles(paths, str(REFERENCE_DIR), NUM_REPLACEMENTS, SER, SEED, numAugmentations=2, manifestPath=referenceManifest)
+    reference = readManifest(referenceManifest)
+    os.remove(referenceManifest)
+    return reference
+
+def checkManifests(job: AugmentationJob, reference: dict):
+    manifests = [readManifest(path) for path in job.getManifestPaths()]
+    for column, values in reference.items():
+        merged = np.concatenate([m[column] for m in manifests])
+        if column in ["sourceFile", "outputFile"]:
+            merged = np.array([os.path.basename(v) for v in merged])
+            values = np.array([os.path.basename(v) for v in values])
+        assert np.array_equal(merged, values), f"Expected the shard manifests to hold the reference {column} column"
+
+def test_resume():
+    print("///////////////////////////////////////////////")
+    print("Testing resuming an augmentation job...")
+    paths = setUp()
+    reference = runReference(paths)
+
+    job = createJob(paths)
+    assert job.numShards == 4, f"Expected 4 shards, got {job.numShards}"
+    assert job.runWorker(SER, maxShards=1) == 1, "Expected one shard to run"
+    # a worker that claims a shard and dies
+    crashed = job.claimShard("crashedWorker")
+    job.close()
+
+    job = createJob(list(reversed(paths)))
+    assert job.getProgress() == {"pending": 2, "running": 1, "done": 1}, f"Unexpected progress {job.getProgress()}"
+    assert job.runWorker(SER) == 2, "Expected the pending shards to run, and the leased shard to be left alone"
+    assert job.releaseShards() == 1, "Expected the crashed worker's shard to be released"
+    assert job.runWorker(SER) == 1 and job.isDone(), f"Expected the released shard {crashed} to run"
+    print(job)
+
+    assert readAll(JOB_DIR) == readAll(REFERENCE_DIR), "Expected the job's outputs to be the same as an uninterrupted run"
+    checkManifests(job, reference)
+    job.close()
+    print("resuming an augmentation job passed")
+
+def test_leases():
+    print("///////////////////////////////////////////////")
+    print("Testing augmentation job leases...")
+    paths = setUp()
+    with createJob(paths) as job:
+        shard = job.claimShard("worker1", leaseSeconds=0)
+        assert job.claimShard("worker2") == shard, "Expected an expired lease to be claimed again"
+        assert not job.completeShard(shard, "worker1"), "Expected a worker that lost its lease not to complete the shard"
+        assert job.completeShard(shard, "worker2"), "Expected the new lease holder to complete the shard"
+        assert job.claimShard("worker3") == shard + 1, "Expected the next pending shard"
+    print("augmentation job leases passed")
+
+def test_leaseRenewal():
+    print("///////////////////////////////////////////////")
+    print("Testing augmentation job lease renewal...")
+    paths = setUp()
+    reference = runReference(paths)
+    with createJob(paths) as job:
+        shard = job.claimShard("worker1", leaseSeconds=0.5)
+        with LeaseRenewer(JOURNAL_PATH, shard, "worker1", 0.5) as renewer:
+            time.sleep(1.5)
+            assert job.claimShard("worker2") == shard + 1, "Expected a renewed lease not to expire"
+            assert not renewer.lost, "Expected the lease to be held"
+        time.sleep(0.6)
+        assert job.claimShard("worker3") == shard, "Expected the lease to expire once it is no longer renewed"
+        assert not job.renewLease(shard, "worker1"), "Expected a lost lease not to be renewed"
+
+        # both attempts run the shard; only the lease holder's manifest is kept
+        job.runShard(shard, SER, workerId="worker3")
+        job.runShard(shard, SER, workerId="worker1")
+        assert job.completeShard(shard, "worker3"), "Expected the lease holder to complete the shard"
+        assert not job.completeShard(shard, "worker1"), "Expected a worker that lost its lease not to complete the shard"
+        assert os.listdir(MANIFEST_DIR) == ["shard_00000.npy"], f"Expected only the shard's manifest, got {os.listdir(MANIFEST_DIR)}"
+
+        job.releaseShards()
+        job.runWorker(SER, leaseSeconds=60)
+        assert job.isDone(), "Expected the job to be done"
+        checkManifests(job, reference)
+    print("augmentation job lease renewal passed")
+
+def test_mismatchingParams():
+    print("///////////////////////////////////////////////")
+    print("Testing augmentation jobs with mismatching params...")
+    paths = setUp()
+    createJob(paths).close()
+    try:
+        AugmentationJob.create(JOURNAL_PATH, paths, str(JOB_DIR), SER, SEED + 1, NUM_REPLACEMENTS, shardSize=3, manifestDir=str(MANIFEST_DIR), numAugmentations=2)
+        assert False, "Expected a ValueError for another seed"
+    except ValueError:
+        pass
+    with AugmentationJob(JOURNAL_PATH) as job:
+        try:
+            job.runWorker(SeedExamplesRetriever(EXAMPLES_DIR, styleWeights={"songo": 2.0}))
+            assert False, "Expected a ValueError for another sampling config"
+        except ValueError:
+            pass
+        try:
+            job.runWorker(SeedExamplesRetriever(EXAMPLES_DIR, dedupe=True))
+            assert False, "Expected a ValueError for another dedupe mode"
+        except ValueError as e:
+            assert "dedupe" in str(e), f"Expected the dedupe settings in the error, got {e}"
+    print("augmentation jobs with mismatching params passed")
+
+def test_runJobInProcesses():
+    print("///////////////////////////////////////////////")
+    print("Testing runJobInProcesses...")
+    paths = setUp()
+    reference = runReference(paths)
+    createJob(paths).close()
+    assert runJobInProcesses(JOURNAL_PATH, SER, numProcesses=2) == 4, "Expected every shard to run"
+    with AugmentationJob(JOURNAL_PATH) as job:
+        assert job.isDone(), "Expected the job to be done"
+        checkManifests(job, reference)
+    assert readAll(JOB_DIR) == readAll(REFERENCE_DIR), "Expected the workers' outputs to be the same as a single process run"
+    print("runJobInProcesses passed")
+
+if __name__ == "__main__":
+    test_resume()
+    test_leases()
+    test_leaseRenewal()
+    test_mismatchingParams()
+    test_runJobInProcesses()
@@ -0,0 +1,124 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.manifest import ManifestWriter, readManifest, iterManifestChunks, getStyleBalance, MANIFEST_COLUMNS
+
+import re
+import numpy as np
+
+OUTPUT_DIR = TEST_OUT_DIR / "manifest"
+MANIFEST_PATH = OUTPUT_DIR / "manifest.npy"
+TRUNCATED_PATH = OUTPUT_DIR / "truncated.npy"
+
+ROWS = [
+    ("a.mid", "out/a_0.mid", "songo", [("songo_kit.mid", "KICK"), ("mambo_simple.mid", "HH")], [False, True]),
+    ("b.mid", "out/b_0.mid", "mambo", [("mambo_bell1.mid", "CRASH")], [False]),
+    ("c.mid", "out/c_0.mid", "songo", [], []),
+]
+
+def writeRows(path, chunkSize):
+    if os.path.exists(path):
+        os.remove(path)
+    with ManifestWriter(path, chunkSize=chunkSize) as writer:
+        for row in ROWS:
+            writer.append(*row)
+    return writer
+
+def test_writeAndRead():
+    print("///////////////////////////////////////////////")
+    print("Testing manifest write and read...")
+
+    writer = writeRows(MANIFEST_PATH, chunkSize=2)
+    assert writer.rowsWritten == len(ROWS), f"Expected {len(ROWS)} rows written, got {writer.rowsWritten}"
+
+    chunks = list(iterManifestChunks(MANIFEST_PATH))
+    assert len(chunks) == 2, f"Expected 2 chunks, got {len(chunks)}"
+
+    manifest = readManifest(MANIFEST_PATH)
+    assert list(manifest["sourceFile"]) == ["a.mid", "b.mid", "c.mid"], f"Unexpected sourceFile column {manifest['sourceFile']}"
+    assert list(manifest["numReplacements"]) == [2, 1, 0], f"Unexpected numReplacements column {manifest['numReplacements']}"
+    assert list(manifest["voice"]) == ["KICK", "HH", "CRASH"], f"Unexpected voice column {manifest['voice']}"
+    assert list(manifest["outOfStyle"]) == [False, True, False], f"Unexpected outOfStyle column {manifest['outOfStyle']}"
+    print("manifest write and read passed")
+
+def test_readSelectedColumns():
+    print("///////////////////////////////////////////////")
+    print("Testing manifest read with selected columns...")
+
+    writeRows(MANIFEST_PATH, chunkSize=10)
+    manifest = readManifest(MANIFEST_PATH, columns=["preferredStyle"])
+    assert list(manifest.keys()) == ["preferredStyle"], f"Unexpected columns {list(manifest.keys())}"
+    assert list(manifest["preferredStyle"]) == ["songo", "mambo", "songo"], f"Unexpected preferredStyle column {manifest['preferredStyle']}"
+    print("manifest read with selected columns passed")
+
+def test_truncatedChunkIgnored():
+    print("///////////////////////////////////////////////")
+    print("Testing that a truncated chunk is ignored...")
+
+    writeRows(MANIFEST_PATH, chunkSize=2)
+    with open(MANIFEST_PATH, "rb") as f:
+        data = f.read()
+    with open(TRUNCATED_PATH, "wb") as f:
+        f.write(data[:-10])
+
+    manifest = readManifest(TRUNCATED_PATH)
+    assert len(manifest["sourceFile"]) == 2, f"Expected only the first chunk's 2 rows, got {len(manifest['sourceFile'])}"
+    print("truncated chunk test passed")
+
+def test_appendAfterTruncatedChunk():
+    print("///////////////////////////////////////////////")
+    print("Testing appending after a truncated chunk...")
+
+    writeRows(MANIFEST_PATH, chunkSize=2)
+    with open(MANIFEST_PATH, "rb") as f:
+        data = f.read()
+    with open(TRUNCATED_PATH, "wb") as f:
+        f.write(data[:-10])
+
+    with ManifestWriter(TRUNCATED_PATH) as writer:
+        writer.append(*ROWS[2])
+    manifest = readManifest(TRUNCATED_PATH)
+    assert list(manifest["sourceFile"]) == ["a.mid", "b.mid", "c.mid"], f"Expected the appended row after the first chunk, got {manifest['sourceFile']}"
+    print("appending after a truncated chunk passed")
+
+def test_corruptChunkRaises():
+    print("///////////////////////////////////////////////")
+    print("Testing that a corrupt chunk before the end raises...")
+
+    writeRows(MANIFEST_PATH, chunkSize=2)
+    with open(MANIFEST_PATH, "rb") as f:
+        data = bytearray(f.read())
+    # break the magic string of the second chunk's first array
+    arrayOffsets = [m.start() for m in re.finditer(b"\x93NUMPY", bytes(data))]
+    secondChunk = arrayOffsets[len(MANIFEST_COLUMNS)]
+    data[secondChunk:secondChunk + 6] = b"xxxxxx"
+    with open(TRUNCATED_PATH, "wb") as f:
+        f.write(data)
+
+    for read in [lambda: readManifest(TRUNCATED_PATH), lambda: ManifestWriter(TRUNCATED_PATH)]:
+        try:
+            read()
+            assert False, "Expected a ValueError"
+        except ValueError as e:
+            print(f"Raised: {e}")
+    print("corrupt chunk test passed")
+
+def test_getStyleBalance():
+    print("///////////////////////////////////////////////")
+    print("Testing getStyleBalance...")
+
+    writeRows(MANIFEST_PATH, chunkSize=2)
+    balance = getStyleBalance(MANIFEST_PATH)
+    assert balance["songo"] == {"files": 2, "inStyle": 1, "outOfStyle": 1}, f"Unexpected songo balance {balance['songo']}"
+    assert balance["mambo"] == {"files": 1, "inStyle": 1, "outOfStyle": 0}, f"Unexpected mambo balance {balance['mambo']}"
+    print("getStyleBalance passed")
+
+if __name__ == "__main__":
+    clearOutputDir(OUTPUT_DIR)
+
+    test_writeAndRead()
+    test_readSelectedColumns()
+    test_truncatedChunkIgnored()
+    test_appendAfterTruncatedChunk()
+    test_corruptChunkRaises()
+    test_getStyleBalance()
@@ -0,0 +1,37 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.sampling import AliasTable
+
+import numpy as np
+
+def test_aliasTable_distribution():
+    print("///////////////////////////////////////////////")
+    print("Testing AliasTable distribution...")
+    weights = [1, 0, 3, 6]
+    table = AliasTable(weights)
+    draws = table.sampleMany(np.random.default_rng(0), 100000)
+    frequencies = np.bincount(draws, minlength=len(weights)) / len(draws)
+    assert frequencies[1] == 0, "Expected a zero weight to never be drawn"
+    assert np.allclose(frequencies, np.array(weights) / sum(weights), atol=0.01), f"Unexpected frequencies {frequencies}"
+
+    rng = np.random.default_rng(1)
+    single = np.bincount([table.sample(rng) for _ in range(20000)], minlength=len(weights)) / 20000
+    assert np.allclose(single, np.array(weights) / sum(weights), atol=0.02), f"Unexpected frequencies {single}"
+    print("AliasTable distribution passed")
+
+def test_aliasTable_invalid():
+    print("///////////////////////////////////////////////")
+    print("Testing AliasTable with invalid weights...")
+    for weights in [[], [0, 0], [1, -1], [1, np.inf]]:
+        try:
+            AliasTable(weights)
+            assert False, f"Expected a ValueError for weights {weights}"
+        except ValueError:
+            pass
+    assert AliasTable([5]).sample(np.random.default_rng(0)) == 0, "Expected the only index to be drawn"
+    print("AliasTable with invalid weights passed")
+
+if __name__ == "__main__":
+    test_aliasTable_distribution()
+    test_aliasTable_invalid()
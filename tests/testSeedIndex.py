@@ -0,0 +1,205 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.seedIndex import SeedIndex, VoiceFeatureIndex, getVoiceFingerprint, getRhythmFeatures, removeRedundantFiles
+from midiUtils.constants import PERC_VOICES_MAPPING
+from midiUtils.augExamples import SeedExamplesRetriever, AugSeedExample
+from midiUtils.eventTrack import EventTrack
+from midiUtils.dataAug import getTransformCacheKey
+
+import mido
+import shutil
+import numpy as np
+
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+OUTPUT_DIR = TEST_OUT_DIR / "seedIndex"
+POOL_DIR = OUTPUT_DIR / "pool"
+SER = SeedExamplesRetriever(EXAMPLES_DIR)
+EXAMPLES = [ae for style in SER.styles for ae in SER.getExamplesByStyle(style)]
+
+def makePoolWithCopy():
+    """
+    Copies the examples to POOL_DIR, plus an exact copy of one of them.
+    """
+    if os.path.exists(POOL_DIR):
+        shutil.rmtree(POOL_DIR)
+    shutil.copytree(EXAMPLES_DIR, POOL_DIR)
+    shutil.copyfile(EXAMPLES_DIR / "songo_kit.mid", POOL_DIR / "songo_kit_copy.mid")
+
+def test_fingerprint():
+    print("///////////////////////////////////////////////")
+    print("Testing getVoiceFingerprint...")
+    example = [ae for ae in EXAMPLES if ae.filename == "songo_kit.mid"][0]
+    hh = getVoiceFingerprint(example, "HH")
+    assert hh.shape == (32,), f"Unexpected fingerprint shape {hh.shape}"
+    assert list(np.flatnonzero(hh)) == list(range(0, 32, 4)), f"Expected quarter note hi-hats, got steps {np.flatnonzero(hh)}"
+    print("getVoiceFingerprint passed")
+
+def test_exactDuplicates():
+    print("///////////////////////////////////////////////")
+    print("Testing SeedIndex exact duplicates...")
+    index = SeedIndex(EXAMPLES, maxDistance=0)
+    duplicates = index.getDuplicates()
+    assert duplicates == [(("mambo_bell1.mid", "KICK"), ("mambo_simple.mid", "KICK"), 0)], f"Unexpected duplicates {duplicates}"
+    assert index.getRedundantTracks() == {("mambo_simple.mid", "KICK")}, f"Unexpected redundant tracks {index.getRedundantTracks()}"
+    assert index.getRedundantFiles() == [], f"Unexpected redundant files {index.getRedundantFiles()}"
+    print("SeedIndex exact duplicates passed")
+
+def test_nearDuplicates():
+    print("///////////////////////////////////////////////")
+    print("Testing SeedIndex near duplicates against brute force...")
+    for maxDistance in [1, 4, 6, 10]:
+        index = SeedIndex(EXAMPLES, maxDistance=maxDistance)
+        pairs = set((a, b) for a, b, _ in index.getDuplicates())
+        for i in range(len(index.keys)):
+            for j in range(i + 1, len(index.keys)):
+                distance = np.count_nonzero(index.fingerprints[i] != index.fingerprints[j])
+                sameGroup = index.keys[i][1] == index.keys[j][1] and index.styles[i] == index.styles[j]
+                if sameGroup and distance <= maxDistance and distance > 0:
+                    assert (index.keys[i], index.keys[j]) in pairs, f"maxDistance {maxDistance}: missed duplicates {index.keys[i]} and {index.keys[j]}"
+        for a, b, distance in index.getDuplicates():
+            assert a[1] == b[1] and distance <= maxDistance, f"maxDistance {maxDistance}: wrong duplicate pair {a}, {b} at distance {distance}"
+
+        # every skipped track is close to the track kept in its place, and kept tracks are not close to each other
+        rows = {key: i for i, key in enumerate(index.keys)}
+        distance = lambda a, b: np.count_nonzero(index.fingerprints[rows[a]] != index.fingerprints[rows[b]])
+        for group in index.getDuplicateGroups():
+            assert all(distance(group[0], key) <= maxDistance for key in group[1:]), f"maxDistance {maxDistance}: {group} is not within maxDistance of {group[0]}"
+        kept = [k for k in index.keys if k not in index.getRedundantTracks()]
+        for a in kept:
+            for b in kept:
+                if a < b and a[1] == b[1] and index.styles[rows[a]] == index.styles[rows[b]]:
+                    assert distance(a, b) > maxDistance, f"maxDistance {maxDistance}: kept both {a} and {b}"
+    print("SeedIndex near duplicates passed")
+
+def makeKickExample(filename: str, style: str, steps: list, voice: str = "KICK") -> AugSeedExample:
+    track = mido.MidiTrack()
+    previous = 0
+    for step in steps:
+        track.append(mido.Message("note_on", note=PERC_VOICES_MAPPING[voice][0], velocity=100, time=step * 120 - previous, channel=9))
+        track.append(mido.Message("note_off", note=PERC_VOICES_MAPPING[voice][0], velocity=64, time=60, channel=9))
+        previous = step * 120 + 60
+    return AugSeedExample(filename, style, voiceEvents={voice: EventTrack.fromMidiTrack(track)}, ticksPerBeat=480)
+
+def test_duplicateChains():
+    print("///////////////////////////////////////////////")
+    print("Testing SeedIndex on a chain of near duplicates...")
+    examples = [
+        makeKickExample("a.mid", "rock", [0, 4, 8, 12]),
+        makeKickExample("b.mid", "rock", [0, 4, 8, 12, 16]),
+        makeKickExample("c.mid", "rock", [0, 4, 8, 12, 16, 20]),
+        makeKickExample("d.mid", "funk", [0, 4, 8, 12]),
+    ]
+    index = SeedIndex(examples, maxDistance=1)
+    # b is within 1 step of both a and c, but a and c are 2 steps apart: only b is skipped
+    assert index.getRedundantTracks() == {("b.mid", "KICK")}, f"Unexpected redundant tracks {index.getRedundantTracks()}"
+    assert index.getDuplicateGroups() == [[("a.mid", "KICK"), ("b.mid", "KICK")]], f"Unexpected groups {index.getDuplicateGroups()}"
+    # d is a copy of a in another style
+    assert all("d.mid" not in (a[0], b[0]) for a, b, _ in index.getDuplicates()), "Expected no duplicates across styles"
+    print("SeedIndex on a chain of near duplicates passed")
+
+def test_sparseVoice():
+    print("///////////////////////////////////////////////")
+    print("Testing SeedIndex on a sparse voice...")
+    # crashes: one to three hits, mostly on the first beat of a bar, so that most tracks share their silent bands
+    rng = np.random.default_rng(SEED)
+    examples = []
+    for n in range(1500):
+        numHits = rng.integers(1, 4)
+        steps = sorted(set([0] + rng.choice(32, numHits - 1).tolist())) if rng.random() < 0.7 else sorted(set(rng.choice(32, numHits).tolist()))
+        examples.append(makeKickExample(f"{n:04d}.mid", ["rock", "funk"][n % 2], steps, voice="CRASH"))
+    maxDistance = 2
+    index = SeedIndex(examples, maxDistance=maxDistance)
+
+    # the same kept tracks as a greedy pass comparing every track with every kept track
+    kept = []
+    expected = set()
+    for i, key in enumerate(index.keys):
+        if any(index.groupKeys[k] == index.groupKeys[i] and np.count_nonzero(index.fingerprints[k] != index.fingerprints[i]) <= maxDistance for k in kept):
+            expected.add(key)
+        else:
+            kept.append(i)
+    assert index.getRedundantTracks() == expected, "Expected the kept tracks of a greedy pass"
+    numTracks = len(index.keys)
+    assert index.numComparisons < numTracks * len(kept), f"Expected tracks to be compared with few kept tracks, got {index.numComparisons} comparisons"
+    assert index.numComparisons < numTracks * (numTracks - 1) // 20, f"Expected far fewer comparisons than pairs, got {index.numComparisons}"
+    print(index)
+    print("SeedIndex on a sparse voice passed")
+
+def test_removeRedundantFiles():
+    print("///////////////////////////////////////////////")
+    print("Testing removeRedundantFiles...")
+    makePoolWithCopy()
+    index = SeedIndex(SeedExamplesRetriever(POOL_DIR).getExamplesByStyle("songo"))
+    assert index.getRedundantFiles() == ["songo_kit_copy.mid"], f"Unexpected redundant files {index.getRedundantFiles()}"
+
+    wouldRemove = removeRedundantFiles(POOL_DIR, index, dryRun=True)
+    assert os.path.exists(POOL_DIR / "songo_kit_copy.mid"), "Expected a dry run not to delete anything"
+    removed = removeRedundantFiles(POOL_DIR, index, dryRun=False)
+    assert removed == wouldRemove, "Expected the dry run to list the removed files"
+    assert not os.path.exists(POOL_DIR / "songo_kit_copy.mid"), "Expected the copy to be deleted"
+    assert os.path.exists(POOL_DIR / "songo_kit.mid"), "Expected the original to be kept"
+    print("removeRedundantFiles passed")
+
+def test_retrieverDedupe():
+    print("///////////////////////////////////////////////")
+    print("Testing SeedExamplesRetriever with dedupe...")
+    makePoolWithCopy()
+    ser = SeedExamplesRetriever(POOL_DIR, dedupe=True)
+    info = ser.getCandidateTracksInfo("songo", outOfStyle=False, voicesToExclude=[])
+    assert sorted(info) == [("songo_kit.mid", v) for v in ["HH", "KICK", "SNARE"]], f"Unexpected songo candidates {info}"
+    info = ser.getCandidateTracksInfo("songo", outOfStyle=True, voicesToExclude=[])
+    assert ("mambo_simple.mid", "KICK") not in info and ("mambo_bell1.mid", "KICK") in info, f"Expected the duplicate mambo kick to be skipped, got {info}"
+
+    # deduped and regular retrievers draw from different candidates, so their transformations are cached apart
+    regular = SeedExamplesRetriever(POOL_DIR)
+    assert ser.getPoolVersion() == regular.getPoolVersion(), "Expected the same pool"
+    mid = mido.MidiFile(TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid")
+    keys = [getTransformCacheKey(mid, 0, 2, r, np.random.default_rng(SEED), "songo") for r in [ser, regular, SeedExamplesRetriever(POOL_DIR, dedupe=True, maxDuplicateDistance=4)]]
+    assert len(set(keys)) == 3, "Expected dedupe settings to change the cache key"
+    print("SeedExamplesRetriever with dedupe passed")
+
+def test_rhythmFeatures():
+    print("///////////////////////////////////////////////")
+    print("Testing getRhythmFeatures...")
+    example = [ae for ae in EXAMPLES if ae.filename == "songo_kit.mid"][0]
+    hh = getRhythmFeatures(example.getVoiceEvents("HH"), example.ticksPerBeat)
+    assert hh[0] == 8 / 32, f"Expected a density of 8/32, got {hh[0]}"
+    assert hh[1] == 0, f"Expected no syncopation for quarter notes, got {hh[1]}"
+    assert np.isclose(hh[2:].sum(), 1) and hh[2] == 0.25, f"Unexpected bar histogram {hh[2:]}"
+
+    snare = getRhythmFeatures(example.getVoiceEvents("SNARE"), example.ticksPerBeat)
+    assert snare[1] > 0.5, f"Expected the songo snare to be syncopated, got {snare[1]}"
+    empty = getRhythmFeatures(example.getVoiceEvents("TOM"), example.ticksPerBeat)
+    assert not empty.any(), "Expected zero features for an absent voice"
+    print("getRhythmFeatures passed")
+
+def test_voiceFeatureIndex():
+    print("///////////////////////////////////////////////")
+    print("Testing VoiceFeatureIndex...")
+    index = VoiceFeatureIndex(EXAMPLES)
+    assert len(index) == 9, f"Expected 9 voice tracks, got {len(index)}"
+    for i, key in enumerate(index.keys):
+        nearest = index.topK(index.features[i], 1)
+        assert index.getDistances(index.features[i])[index.getRows(nearest)[0]] == 0, f"Expected {key} to be at distance 0 from itself"
+
+    batchDistances = index.getDistances(index.features[:3])
+    for q in range(3):
+        assert np.allclose(batchDistances[q], index.getDistances(index.features[q])), "Batched distances differ from single queries"
+
+    queries = {voice: index.features[index.keys.index(("songo_kit.mid", "KICK"))] for voice in PERC_VOICES_MAPPING}
+    kicks = [k for k in index.keys if k[1] == "KICK"]
+    assert index.topKByVoice(queries, 1, kicks) == [("songo_kit.mid", "KICK")], "Expected the songo kick to be closest to itself"
+    assert len(index.topKByVoice(queries, 10, kicks)) == len(kicks), "Expected k to be capped by the number of keys"
+    print("VoiceFeatureIndex passed")
+
+if __name__ == "__main__":
+    test_fingerprint()
+    test_exactDuplicates()
+    test_nearDuplicates()
+    test_duplicateChains()
+    test_sparseVoice()
+    test_removeRedundantFiles()
+    test_retrieverDedupe()
+    test_rhythmFeatures()
+    test_voiceFeatureIndex()
@@ -0,0 +1,129 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.dataAug import transformMidiFile, midiFileToBytes
+from midiUtils.service import AugmentationService, ServiceBusy
+
+import asyncio
+import io
+import mido
+import numpy as np
+
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+MIDI_PATH = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+SER = SeedExamplesRetriever(EXAMPLES_DIR)
+
+with open(MIDI_PATH, "rb") as f:
+    MIDI_BYTES = f.read()
+
+def getExpected(seed, numReplacements=2, preferredStyle='songo', ser=SER):
+    mid = mido.MidiFile(file=io.BytesIO(MIDI_BYTES))
+    newMid, replacementInfo = transformMidiFile(mid, 0, numReplacements, ser, np.random.default_rng(seed), preferredStyle)
+    return midiFileToBytes(newMid), replacementInfo
+
+def fakeRenderer(midiBytes, sr):
+    return f"{len(midiBytes)} bytes at {sr} Hz".encode()
+
+def test_service_inProcess():
+    print("///////////////////////////////////////////////")
+    print("Testing AugmentationService in process...")
+    async def run():
+        async with AugmentationService(SER, maxWorkers=2, batchSize=4, inProcess=True, renderer=fakeRenderer) as service:
+            results = await asyncio.gather(*[service.transform(MIDI_BYTES, 2, seed, preferredStyle='songo') for seed in range(10)])
+            audio = await service.render(MIDI_BYTES, sr=22050)
+            return results, audio, service
+    results, audio, service = asyncio.run(run())
+    for seed, result in enumerate(results):
+        assert result == getExpected(seed), f"Expected the service to match transformMidiFile for seed {seed}"
+    assert service.completed == 10, f"Expected 10 completed requests, got {service.completed}"
+    assert service.batches < 10, f"Expected concurrent requests to be batched, got {service.batches} batches"
+    assert audio == f"{len(MIDI_BYTES)} bytes at 22050 Hz".encode(), f"Unexpected render {audio}"
+    print(service)
+    print("AugmentationService in process passed")
+
+def test_service_errorsAndBackpressure():
+    print("///////////////////////////////////////////////")
+    print("Testing AugmentationService errors and backpressure...")
+    async def run():
+        async with AugmentationService(SER, maxWorkers=1, maxPending=1, batchSize=1, inProcess=True) as service:
+            badAndGood = await asyncio.gather(service.transform(MIDI_BYTES, 10, 0), service.transform(MIDI_BYTES, 2, 1, preferredStyle='songo'), return_exceptions=True)
+            busy = await asyncio.gather(*[service.transform(MIDI_BYTES, 2, seed, wait=False) for seed in range(5)], return_exceptions=True)
+            return badAndGood, busy
+    badAndGood, busy = asyncio.run(run())
+    assert isinstance(badAndGood[0], ValueError), f"Expected a ValueError for too many replacements, got {badAndGood[0]}"
+    assert badAndGood[1] == getExpected(1), "Expected a bad request not to affect the rest of its batch"
+    assert any(isinstance(r, ServiceBusy) for r in busy), "Expected some requests to be rejected with a full queue"
+    assert any(isinstance(r, tuple) for r in busy), "Expected some requests to succeed"
+    print("AugmentationService errors and backpressure passed")
+
+def test_service_cancellation():
+    print("///////////////////////////////////////////////")
+    print("Testing AugmentationService cancellation...")
+    async def run():
+        async with AugmentationService(SER, maxWorkers=1, batchDelay=0.05, inProcess=True) as service:
+            cancelled = asyncio.create_task(service.transform(MIDI_BYTES, 2, 0))
+            kept = asyncio.create_task(service.transform(MIDI_BYTES, 2, 1, preferredStyle='songo'))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            result = await kept
+            try:
+                await cancelled
+                assert False, "Expected the request to be cancelled"
+            except asyncio.CancelledError:
+                pass
+            return result, service
+    result, service = asyncio.run(run())
+    assert result == getExpected(1), "Expected the remaining request to complete"
+    assert service.cancelled == 1 and service.completed == 1, f"Unexpected counters: {service}"
+    print("AugmentationService cancellation passed")
+
+def test_service_processPool():
+    print("///////////////////////////////////////////////")
+    print("Testing AugmentationService with worker processes...")
+    async def run():
+        async with AugmentationService(SER, maxWorkers=2, batchSize=2) as service:
+            return await asyncio.gather(*[service.transform(MIDI_BYTES, 2, seed, preferredStyle='songo') for seed in range(4)])
+    results = asyncio.run(run())
+    for seed, result in enumerate(results):
+        assert result == getExpected(seed), f"Expected worker results to match transformMidiFile for seed {seed}"
+    print("AugmentationService with worker processes passed")
+
+def test_service_close():
+    print("///////////////////////////////////////////////")
+    print("Testing AugmentationService close...")
+    async def run():
+        service = AugmentationService(SER, maxWorkers=1, maxConcurrency=1, batchSize=2, batchDelay=0.05, inProcess=True)
+        await service.start()
+        # the first batch runs, the second waits for its slot, and the third is being filled when the service closes
+        tasks = [asyncio.create_task(service.transform(MIDI_BYTES, 2, seed, preferredStyle='songo')) for seed in range(5)]
+        await asyncio.sleep(0.01)
+        await service.close()
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 5)
+    results = asyncio.run(run())
+    assert all(isinstance(r, (tuple, asyncio.CancelledError)) for r in results), f"Expected every request to complete or be cancelled, got {results}"
+    assert any(isinstance(r, asyncio.CancelledError) for r in results), "Expected the requests not dispatched yet to be cancelled"
+    for seed, result in enumerate(results):
+        assert isinstance(result, asyncio.CancelledError) or result == getExpected(seed), f"Unexpected result for seed {seed}"
+    print("AugmentationService close passed")
+
+def test_service_samplingParams():
+    print("///////////////////////////////////////////////")
+    print("Testing AugmentationService sampling params...")
+    weighted = SeedExamplesRetriever(EXAMPLES_DIR, voiceWeights={"KICK": 20.0, "SNARE": 0.05})
+    async def run(ser, inProcess):
+        async with AugmentationService(ser, maxWorkers=2, inProcess=inProcess) as service:
+            return await asyncio.gather(*[service.transform(MIDI_BYTES, 2, seed, preferredStyle='songo') for seed in range(6)])
+    expected = [getExpected(seed, ser=weighted) for seed in range(6)]
+    assert expected != [getExpected(seed) for seed in range(6)], "Expected the weights to change the replacements"
+    assert asyncio.run(run(weighted, True)) == expected, "Expected the service to sample with the retriever's weights in process"
+    assert asyncio.run(run(weighted, False)) == expected, "Expected the workers to sample with the retriever's weights"
+    print("AugmentationService sampling params passed")
+
+if __name__ == "__main__":
+    test_service_inProcess()
+    test_service_errorsAndBackpressure()
+    test_service_cancellation()
+    test_service_processPool()
+    test_service_close()
+    test_service_samplingParams()
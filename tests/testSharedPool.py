@@ -0,0 +1,55 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.augExamples import SeedExamplesRetriever
+from midiUtils.sharedPool import SharedSeedPool, initSharedPoolWorker, getWorkerRetriever
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+EXAMPLES_DIR = TEST_DATA_DIR / "examples"
+SER = SeedExamplesRetriever(EXAMPLES_DIR)
+
+def getAllTracks(ser):
+    tracks = {}
+    for style in ser.styles:
+        for ae in ser.getExamplesByStyle(style):
+            for voice in ae.voices:
+                tracks[(ae.filename, voice)] = [str(m) for m in ser.getTrack(ae.filename, voice)]
+    return tracks
+
+def workerTracks():
+    return getAllTracks(getWorkerRetriever())
+
+def test_sharedPool_attach():
+    print("///////////////////////////////////////////////")
+    print("Testing SharedSeedPool attach...")
+    with SharedSeedPool.publish(SER) as shared:
+        attached = SharedSeedPool.attach(shared.info)
+        ser = attached.getRetriever()
+        assert sorted(ser.styles) == sorted(SER.styles), f"Expected styles {SER.styles}, got {ser.styles}"
+        assert getAllTracks(ser) == getAllTracks(SER), "Expected the shared tracks to match the parsed tracks"
+        assert ser.getPoolVersion() == SER.getPoolVersion(), "Expected the pool version to be shared"
+
+        events = ser.getExamplesByStyle('songo')[0].getVoiceEvents('KICK').events
+        assert np.shares_memory(events, attached.events), "Expected voice tracks to be views of the shared array"
+        assert not events.flags.writeable, "Expected attached views to be read-only"
+        del ser, events
+        attached.close()
+    print("SharedSeedPool attach passed")
+
+def test_sharedPool_workers():
+    print("///////////////////////////////////////////////")
+    print("Testing SharedSeedPool in worker processes...")
+    expected = getAllTracks(SER)
+    with SharedSeedPool.publish(SER) as shared:
+        with ProcessPoolExecutor(max_workers=2, initializer=initSharedPoolWorker, initargs=(shared.info,)) as executor:
+            results = [executor.submit(workerTracks) for _ in range(4)]
+            for r in results:
+                assert r.result() == expected, "Expected worker tracks to match the parsed tracks"
+    print("SharedSeedPool in worker processes passed")
+
+if __name__ == "__main__":
+    test_sharedPool_attach()
+    test_sharedPool_workers()
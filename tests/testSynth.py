@@ -0,0 +1,103 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import synth
+from midiUtils.cache import DiskCache
+from midiUtils.drumRenderer import SampleBank, VELOCITY_LAYERS
+
+import mido
+import numpy as np
+import shutil
+
+OUTPUT_DIR = TEST_OUT_DIR / "synth"
+MIDI_DIR = OUTPUT_DIR / "midi"
+AUDIO_DIR = OUTPUT_DIR / "audio"
+CACHE_DIR = OUTPUT_DIR / "renderCache"
+SOURCE_PATHS = [TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid", TEST_DATA_DIR / "tools" / "mergee1.mid"]
+SR = 8000
+
+def getBank(seed=SEED) -> SampleBank:
+    rng = np.random.default_rng(seed)
+    samples = {(p, v): rng.uniform(-1, 1, 400) * v / 127 for p in range(35, 82) for v in VELOCITY_LAYERS}
+    return SampleBank(samples, SR)
+
+BANK = getBank()
+
+def setUp(maxBytes=None) -> DiskCache:
+    for d in [MIDI_DIR, AUDIO_DIR, CACHE_DIR]:
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+    for path in SOURCE_PATHS:
+        shutil.copy(path, MIDI_DIR)
+    return DiskCache(CACHE_DIR, maxBytes=maxBytes)
+
+def readAll(dir) -> dict:
+    contents = {}
+    for filename in sorted(os.listdir(dir)):
+        with open(f"{dir}/{filename}", "rb") as f:
+            contents[filename] = f.read()
+    return contents
+
+def test_renderCache_hits():
+    print("///////////////////////////////////////////////")
+    print("Testing synthesize_all with a render cache...")
+    cache = setUp()
+    synth.synthesize_all(str(MIDI_DIR), str(AUDIO_DIR), bank=BANK, sr=SR, cache=cache)
+    assert cache.hits == 0 and len(cache) == 2, f"Expected 2 renders to be cached, got {len(cache)} entries and {cache.hits} hits"
+    firstRun = readAll(AUDIO_DIR)
+
+    shutil.rmtree(AUDIO_DIR)
+    os.makedirs(AUDIO_DIR)
+    synth.synthesize_all(str(MIDI_DIR), str(AUDIO_DIR), bank=BANK, sr=SR, cache=cache)
+    assert cache.hits == 2, f"Expected the second run to be served from the cache, got {cache.hits} hits"
+    assert readAll(AUDIO_DIR) == firstRun, "Expected cached renders to be the same as fresh ones"
+
+    uncached = synth.render_audio_bytes(str(MIDI_DIR / "rock_testbeat.mid"), SR, BANK)
+    assert firstRun["rock_testbeat.wav"] == uncached, "Expected the cached render to be the same as an uncached one"
+    assert synth.midi_to_audio_bytes(str(MIDI_DIR / "rock_testbeat.mid"), SR, BANK, cache) == uncached, "Expected the cached bytes"
+    assert cache.hits == 3, "Expected midi_to_audio_bytes to hit the cache"
+    print("synthesize_all with a render cache passed")
+
+def test_renderCache_keys():
+    print("///////////////////////////////////////////////")
+    print("Testing render cache keys...")
+    setUp()
+    path = str(MIDI_DIR / "rock_testbeat.mid")
+    key = synth.get_render_cache_key(path, SR, BANK)
+
+    # the same events without running status
+    mid = mido.MidiFile(path)
+    reencodedPath = str(MIDI_DIR / "reencoded.mid")
+    mid.save(reencodedPath)
+    with open(path, "rb") as f1, open(reencodedPath, "rb") as f2:
+        sameBytes = f1.read() == f2.read()
+    assert synth.get_render_cache_key(reencodedPath, SR, BANK) == key, f"Expected the same events to share a key (same bytes: {sameBytes})"
+
+    # other events
+    for msg in mid.tracks[0]:
+        if msg.type == "note_on" and msg.velocity > 0:
+            msg.velocity = 1 if msg.velocity != 1 else 2
+            break
+    mid.save(reencodedPath)
+    assert synth.get_render_cache_key(reencodedPath, SR, BANK) != key, "Expected other events to change the key"
+    assert synth.get_render_cache_key(path, SR * 2, BANK) != key, "Expected another sample rate to change the key"
+    assert synth.get_render_cache_key(path, SR, getBank(SEED + 1)) != key, "Expected another bank to change the key"
+    print("render cache keys passed")
+
+def test_renderCache_eviction():
+    print("///////////////////////////////////////////////")
+    print("Testing render cache eviction...")
+    cache = setUp()
+    synth.midi_to_audio(str(MIDI_DIR / "rock_testbeat.mid"), str(AUDIO_DIR), prefix="", sr=SR, bank=BANK, cache=cache)
+    entrySize = cache.size()
+
+    cache.maxBytes = int(entrySize * 1.5)
+    synth.synthesize_all(str(MIDI_DIR), str(AUDIO_DIR), bank=BANK, sr=SR, cache=cache)
+    assert cache.size() <= cache.maxBytes, f"Cache size {cache.size()} exceeds maxBytes {cache.maxBytes}"
+    assert len(os.listdir(AUDIO_DIR)) == 2, "Expected every file to be rendered"
+    print("render cache eviction passed")
+
+if __name__ == "__main__":
+    test_renderCache_hits()
+    test_renderCache_keys()
+    test_renderCache_eviction()
@@ -0,0 +1,111 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import timing
+from midiUtils.eventTrack import EventTrack, readSmfFile
+
+import mido
+import numpy as np
+
+MERGEES = [TEST_DATA_DIR / "tools" / f"mergee{i}.mid" for i in range(1, 4)]
+TICKS_PER_BEAT = 480
+
+def loadTracks():
+    return [readSmfFile(p).tracks[0] for p in MERGEES]
+
+def makeTrack(times: list) -> EventTrack:
+    track = mido.MidiTrack()
+    previous = 0
+    for t in times:
+        track.append(mido.Message('note_on', note=36, velocity=100, channel=9, time=t - previous))
+        previous = t
+    track.append(mido.MetaMessage('end_of_track', time=0))
+    return EventTrack.fromMidiTrack(track)
+
+def test_scaleTime():
+    print("///////////////////////////////////////////////")
+    print("Testing scaleTime...")
+
+    tracks = loadTracks()
+    factors = [0.5, 1.0, 1.5]
+    scaled = timing.scaleTime(tracks, factors)
+    for original, new, factor in zip(tracks, scaled, factors):
+        assert len(original) == len(new), "Expected the same number of events"
+        assert (np.abs(new.times - original.times * factor) <= 0.5).all(), f"Times are not scaled by {factor}"
+        assert (np.diff(new.times) >= 0).all(), "Expected the event order to be preserved"
+        assert (new.status == original.status).all(), "Expected the messages to be unchanged"
+    assert (scaled[1].times == tracks[1].times).all(), "Expected a factor of 1 to leave times unchanged"
+    print("scaleTime passed")
+
+def test_requantizeResolution():
+    print("///////////////////////////////////////////////")
+    print("Testing requantizeResolution...")
+
+    track = makeTrack([0, 120, 240, 360])
+    requantized = timing.requantizeResolution([track], TICKS_PER_BEAT, 96)[0]
+    assert list(requantized.times) == [0, 24, 48, 72, 72], f"Unexpected times {list(requantized.times)}"
+    print("requantizeResolution passed")
+
+def test_applySwing():
+    print("///////////////////////////////////////////////")
+    print("Testing applySwing...")
+
+    grid = TICKS_PER_BEAT // 2
+    track = makeTrack([0, 240, 480, 720, 840])
+    swung = timing.applySwing([track], ratio=2/3, gridTicks=grid)[0]
+    assert list(swung.times[:-1]) == [0, 320, 480, 800, 880], f"Unexpected swung times {list(swung.times)}"
+
+    straight = timing.applySwing([track], ratio=0.5, gridTicks=grid)[0]
+    assert (straight.times == track.times).all(), "Expected a ratio of 0.5 to leave times unchanged"
+
+    for t in timing.applySwing(loadTracks(), ratio=[0.55, 0.6, 0.7], gridTicks=grid):
+        assert (np.diff(t.times) >= 0).all(), "Expected the event order to be preserved"
+
+    try:
+        timing.applySwing([track], ratio=1.0, gridTicks=grid)
+        assert False, "Expected a ValueError for a ratio of 1"
+    except ValueError as e:
+        print(f"Caught expected exception: {e}")
+    print("applySwing passed")
+
+def test_quantize():
+    print("///////////////////////////////////////////////")
+    print("Testing quantize...")
+
+    grid = 120
+    track = makeTrack([0, 130, 230, 365, 479])
+    quantized = timing.quantize([track], gridTicks=grid)[0]
+    assert list(quantized.times) == [0, 120, 240, 360, 480, 480], f"Unexpected quantized times {list(quantized.times)}"
+    assert quantized.endOfTrackMask()[-1], "Expected the end of track to stay last"
+
+    half = timing.quantize([track], gridTicks=grid, strength=0.5)[0]
+    assert list(half.times[:-1]) == [0, 125, 235, 363, 480], f"Unexpected half strength times {list(half.times)}"
+
+    swung = timing.quantize([track], gridTicks=grid, swing=2/3)[0]
+    assert list(swung.times[:-1]) == [0, 160, 240, 400, 480], f"Unexpected swung times {list(swung.times)}"
+    print("quantize passed")
+
+def test_quantize_noteOrder():
+    print("///////////////////////////////////////////////")
+    print("Testing quantize keeps note_offs after their note_ons...")
+
+    tracks = loadTracks()
+    for original, quantized in zip(tracks, timing.quantize(tracks, gridTicks=[60, 120, 240], strength=[1.0, 0.7, 1.0])):
+        assert len(original) == len(quantized), "Expected the same number of events"
+        assert (np.diff(quantized.times) >= 0).all(), "Expected times to be sorted"
+        assert quantized.endOfTrackMask()[-1], "Expected the end of track to be last"
+        onTimes = {}
+        for e in quantized.events:
+            kind = e["status"] & 0xF0
+            if kind == 0x90:
+                onTimes[e["data1"]] = e["time"]
+            elif kind == 0x80 and e["data1"] in onTimes:
+                assert e["time"] >= onTimes[e["data1"]], f"note_off of {e['data1']} precedes its note_on"
+    print("quantize note order passed")
+
+if __name__ == "__main__":
+    test_scaleTime()
+    test_requantizeResolution()
+    test_applySwing()
+    test_quantize()
+    test_quantize_noteOrder()
@@ -0,0 +1,131 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils.constants import PERC_VOICES_MAPPING
+from midiUtils.eventTrack import EventTrack, readSmfFile
+from midiUtils.tokenizer import EventTokenizer, PAD, BOS, EOS
+
+import glob
+import time
+import mido
+import numpy as np
+
+PATHS = sorted(glob.glob(str(TEST_DATA_DIR / "*" / "*.mid")))
+# generous, so that only a real regression (e.g. a loop over tokens) fails the benchmark
+MIN_TRACKS_PER_SECOND = 1000
+
+def readTracks(paths):
+    tracks, ticksPerBeat = [], []
+    for path in paths:
+        eventMid = readSmfFile(path)
+        tracks += eventMid.tracks
+        ticksPerBeat += [eventMid.ticksPerBeat] * len(eventMid.tracks)
+    return tracks, ticksPerBeat
+
+def tokenizeNaively(tokenizer: EventTokenizer, track: mido.MidiTrack, ticksPerBeat: int) -> list:
+    """
+    The tokens of a track, one message at a time.
+    """
+    voiceOfPitch = {p: i for i, v in enumerate(tokenizer.voices) for p in PERC_VOICES_MAPPING[v]}
+    hits, time, endStep = [], 0, 0
+    for msg in track:
+        time += msg.time
+        step = int(np.floor(time * tokenizer.stepsPerBeat / ticksPerBeat + 0.5))
+        endStep = max(endStep, step)
+        if msg.type == "note_on" and msg.velocity > 0 and msg.note in voiceOfPitch:
+            hits.append((step, voiceOfPitch[msg.note], (msg.velocity - 1) * tokenizer.numVelocityBins // 127))
+
+    def shifts(gap):
+        return [tokenizer.shiftOffset + tokenizer.maxShiftSteps] * (gap // tokenizer.maxShiftSteps) + ([tokenizer.shiftOffset + gap % tokenizer.maxShiftSteps] if gap % tokenizer.maxShiftSteps else [])
+
+    tokens, previous = [BOS], 0
+    for step, voice, velocityBin in sorted(hits, key=lambda h: (h[0], h[1])):
+        tokens += shifts(step - previous) + [tokenizer.voiceOffset + voice, tokenizer.velocityOffset + velocityBin]
+        previous = step
+    return tokens + shifts(endStep - previous) + [EOS]
+
+def test_tokenizer_encode():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTokenizer encode...")
+    tracks, ticksPerBeat = readTracks(PATHS)
+    for tokenizer in [EventTokenizer(), EventTokenizer(stepsPerBeat=4, maxShiftSteps=3, numVelocityBins=4)]:
+        tokens, mask = tokenizer.encode(tracks, ticksPerBeat)
+        assert tokens.shape == mask.shape == (len(tracks), mask.sum(axis=1).max()), "Expected a batch as long as its longest sequence"
+        for i, track in enumerate(tracks):
+            expected = tokenizeNaively(tokenizer, track.toMidiTrack(), ticksPerBeat[i])
+            assert tokens[i][mask[i]].tolist() == expected, f"Unexpected tokens for track {i}"
+            assert (tokens[i][~mask[i]] == PAD).all(), "Expected padding after the sequence"
+    print(tokenizer)
+    print("EventTokenizer encode passed")
+
+def test_tokenizer_roundTrip():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTokenizer round trip...")
+    tokenizer = EventTokenizer()
+    tracks, ticksPerBeat = readTracks(PATHS)
+    tokens, mask = tokenizer.encode(tracks, ticksPerBeat)
+    decoded = tokenizer.decode(tokens, mask, ticksPerBeat=480)
+    assert len(decoded) == len(tracks), "Expected a track per sequence"
+    decodedTokens, decodedMask = tokenizer.encode(decoded, 480)
+    assert np.array_equal(tokens, decodedTokens) and np.array_equal(mask, decodedMask), "Expected decoded tracks to encode to the same tokens"
+
+    # a quantized track decodes to its own hits, on the first pitch of every voice
+    track = mido.MidiTrack([
+        mido.Message("note_on", note=36, velocity=100, time=0, channel=9),
+        mido.Message("note_on", note=42, velocity=40, time=0, channel=9),
+        mido.Message("note_on", note=38, velocity=120, time=480, channel=9),
+        mido.Message("note_on", note=44, velocity=80, time=3000, channel=9),
+        mido.MetaMessage("end_of_track", time=360),
+    ])
+    decoded = tokenizer.decode(*tokenizer.encode([track], 480), ticksPerBeat=480)[0]
+    onsets = decoded.noteOnMask() & (decoded.velocities > 0)
+    assert decoded.times[onsets].tolist() == [0, 0, 480, 3480], "Expected the hits at their times"
+    assert decoded.notes[onsets].tolist() == [PERC_VOICES_MAPPING[v][0] for v in ["KICK", "HH", "SNARE", "HH"]], "Expected the hits on their voices"
+    assert (tokenizer.velocityToBin(decoded.velocities[onsets]) == tokenizer.velocityToBin(np.array([100, 40, 120, 80]))).all(), "Expected the velocities in their bins"
+    assert decoded.endOfTrackMask()[-1] and decoded.getEndTime() == 3840, "Expected the track to end at its end of track"
+    assert len(decoded.toMidiTrack()) == 9, "Expected a note_on and a note_off per hit"
+    print("EventTokenizer round trip passed")
+
+def test_tokenizer_batches():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTokenizer batches...")
+    tokenizer = EventTokenizer()
+    tracks, ticksPerBeat = readTracks(PATHS)
+    tokens, mask = tokenizer.encode(tracks, ticksPerBeat)
+    for i in range(len(tracks)):
+        single, singleMask = tokenizer.encode([tracks[i]], ticksPerBeat[i])
+        assert np.array_equal(single[0], tokens[i][:single.shape[1]]) and singleMask.all(), "Expected a track to encode alone as in a batch"
+
+    truncated, truncatedMask = tokenizer.encode(tracks, ticksPerBeat, maxLength=16)
+    assert truncated.shape == (len(tracks), 16), "Expected batches of maxLength tokens"
+    assert np.array_equal(truncated, tokens[:, :16]) and np.array_equal(truncatedMask, mask[:, :16]), "Expected sequences to be cut off at maxLength"
+    padded, paddedMask = tokenizer.encode(tracks, ticksPerBeat, maxLength=tokens.shape[1] + 5)
+    assert (padded[:, -5:] == PAD).all() and not paddedMask[:, -5:].any(), "Expected padding up to maxLength"
+
+    empty, emptyMask = tokenizer.encode([mido.MidiTrack()], 480)
+    assert empty.tolist() == [[BOS, EOS]] and emptyMask.all(), "Expected an empty track to encode to BOS EOS"
+    assert tokenizer.encode([], 480)[0].shape == (0, 0), "Expected an empty batch"
+    print("EventTokenizer batches passed")
+
+def test_tokenizer_throughput():
+    print("///////////////////////////////////////////////")
+    print("Testing EventTokenizer throughput...")
+    tokenizer = EventTokenizer()
+    tracks, ticksPerBeat = readTracks(PATHS)
+    tracks, ticksPerBeat = tracks * 100, ticksPerBeat * 100
+    start = time.perf_counter()
+    tokens, mask = tokenizer.encode(tracks, ticksPerBeat)
+    encodeSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    tokenizer.decode(tokens, mask)
+    decodeSeconds = time.perf_counter() - start
+    print(f"{len(tracks) / encodeSeconds:.0f} tracks/s encoded, {len(tracks) / decodeSeconds:.0f} tracks/s decoded")
+    assert len(tracks) / encodeSeconds > MIN_TRACKS_PER_SECOND, "Encoding is too slow"
+    assert len(tracks) / decodeSeconds > MIN_TRACKS_PER_SECOND, "Decoding is too slow"
+    print("EventTokenizer throughput passed")
+
+if __name__ == "__main__":
+    test_tokenizer_encode()
+    test_tokenizer_roundTrip()
+    test_tokenizer_batches()
+    test_tokenizer_throughput()
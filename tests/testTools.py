@@ -70,6 +70,25 @@ def test_allMessagesToChannel():
             assert msg.channel == 3, f"msg.channel is {msg.channel}, expected 3"
     print("allMessagesToChannel passed")
 
+def test_quantizeTrack():
+    print("///////////////////////////////////////////////")
+    print("Testing quantizeTrack...")
+
+    mid = mido.MidiFile(TO_TRIM)
+    grid = mid.ticks_per_beat // 4
+    quantizedTrack = quantizeTrack(mid.tracks[0], grid)
+
+    absTime = 0
+    for msg in quantizedTrack:
+        absTime += msg.time
+        if msg.type == 'note_on' or msg.type == 'note_off':
+            assert absTime % grid == 0, f"{msg} at {absTime} is not on the grid"
+    assert quantizedTrack[-1].type == 'end_of_track', "Expected the end of track to stay last"
+
+    mid.tracks[0] = quantizedTrack
+    mid.save(OUTPUT_DIR / 'quantized.mid')
+    print(f"Saved to {OUTPUT_DIR}/quantized.mid")
+
 if __name__ == "__main__":
     clearOutputDir(OUTPUT_DIR)
 
@@ -77,4 +96,5 @@ if __name__ == "__main__":
     test_mergeMultipleTracks()
     test_trimMidiTrack()
     test_allMessagesToChannel()
+    test_quantizeTrack()
 
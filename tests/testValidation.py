@@ -0,0 +1,124 @@
+from tests.constants import *
+from tests.utils import *
+
+from midiUtils import validation
+from midiUtils.validation import OK, REPAIRED, INVALID, UNREADABLE
+
+import mido
+import shutil
+import struct
+
+OUTPUT_DIR = TEST_OUT_DIR / "validation"
+CORPUS_DIR = OUTPUT_DIR / "corpus"
+REPAIR_DIR = OUTPUT_DIR / "repaired"
+REPORT_PATH = OUTPUT_DIR / "report.json"
+VALID_PATH = TEST_DATA_DIR / "dataAug" / "rock_testbeat.mid"
+
+def smfBytes(trackData: bytes, ticksPerBeat: int = 480) -> bytes:
+    """
+    A type 0 file with one track of raw events, so that it can hold what mido would not write.
+    """
+    return b"MThd" + struct.pack(">Lhhh", 6, 0, 1, ticksPerBeat) + b"MTrk" + struct.pack(">L", len(trackData)) + trackData
+
+END_OF_TRACK = b"\x00\xff\x2f\x00"
+BROKEN_FILES = {
+    "missingEndOfTrack.mid": (smfBytes(b"\x00\x99\x24\x64\x60\x89\x24\x40"), ["missingEndOfTrack"]),
+    "hangingNotes.mid": (smfBytes(b"\x00\x99\x24\x64\x00\x99\x26\x64\x60\x89\x24\x40" + END_OF_TRACK), ["hangingNotes"]),
+    # a velocity byte of 0xC8, which mido refuses to read
+    "velocityOutOfRange.mid": (smfBytes(b"\x00\x99\x24\xc8\x60\x89\x24\x40" + END_OF_TRACK), ["dataOutOfRange"]),
+    "misplacedEndOfTrack.mid": (smfBytes(b"\x00\x99\x24\x64" + END_OF_TRACK + b"\x60\x89\x24\x40" + END_OF_TRACK), ["misplacedEndOfTrack"]),
+    "unreadable.mid": (b"not a midi file", None),
+}
+
+def writeCorpus():
+    for d in [CORPUS_DIR, REPAIR_DIR]:
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+    shutil.copy(VALID_PATH, CORPUS_DIR)
+    for filename, (data, _) in BROKEN_FILES.items():
+        with open(CORPUS_DIR / filename, "wb") as f:
+            f.write(data)
+
+def test_validateDirectory():
+    print("///////////////////////////////////////////////")
+    print("Testing validateDirectory...")
+    writeCorpus()
+    reports = validation.validateDirectory(str(CORPUS_DIR), str(REPAIR_DIR), str(REPORT_PATH), maxWorkers=2)
+    byName = {os.path.basename(r["path"]): r for r in reports}
+    assert byName["rock_testbeat.mid"]["status"] == OK and not byName["rock_testbeat.mid"]["issues"], "Expected the valid file to pass"
+    assert byName["unreadable.mid"]["status"] == UNREADABLE, "Expected an unreadable file"
+    for filename, (_, expectedIssues) in BROKEN_FILES.items():
+        if expectedIssues is None:
+            continue
+        report = byName[filename]
+        issues = sorted(i["issue"] for i in report["issues"])
+        assert report["status"] == REPAIRED and issues == expectedIssues, f"Expected {filename} to be repaired of {expectedIssues}, got {report}"
+        # the repaired copy is clean, and mido can read it
+        assert validation.validateFile(report["repairedPath"])["status"] == OK, f"Expected the repaired copy of {filename} to be valid"
+        mido.MidiFile(report["repairedPath"])
+
+    assert validation.readReport(REPORT_PATH) == reports, "Expected the written report"
+    usable = validation.getUsablePaths(reports)
+    assert len(usable) == len(BROKEN_FILES) and str(CORPUS_DIR / "unreadable.mid") not in usable, f"Unexpected usable paths {usable}"
+
+    reports = validation.validateDirectory(str(CORPUS_DIR), maxWorkers=1)
+    statuses = sorted(r["status"] for r in reports)
+    assert statuses == sorted([OK, UNREADABLE] + [INVALID] * 4), f"Expected broken files to be invalid without a repair dir, got {statuses}"
+    print("validateDirectory passed")
+
+def test_repairTrack():
+    print("///////////////////////////////////////////////")
+    print("Testing repairTrack...")
+    mid = mido.MidiFile(ticks_per_beat=480)
+    mid.tracks.append(mido.MidiTrack([
+        mido.MetaMessage('set_tempo', tempo=500000),
+        mido.Message('note_on', note=36, velocity=100, channel=9, time=0),
+        mido.Message('note_on', note=38, velocity=100, channel=9, time=240),
+        # a negative delta, e.g. after a bad time offset
+        mido.Message('note_off', note=36, velocity=64, channel=9, time=-480),
+        mido.Message('note_on', note=42, velocity=0, channel=9, time=480),
+        mido.MetaMessage('end_of_track', time=10),
+    ]))
+    issues = sorted(i["issue"] for i in validation.checkMidiFile(mid))
+    assert issues == ["hangingNotes", "negativeDelta"], f"Unexpected issues {issues}"
+
+    repaired = validation.repairMidiFile(mid)
+    assert validation.checkMidiFile(repaired) == [], "Expected the repaired file to be valid"
+    expected = [
+        "MetaMessage('set_tempo', tempo=500000, time=0)",
+        "note_on channel=9 note=36 velocity=100 time=0",
+        "note_on channel=9 note=38 velocity=100 time=240",
+        "note_off channel=9 note=36 velocity=64 time=0",
+        "note_on channel=9 note=42 velocity=0 time=480",
+        "note_off channel=9 note=38 velocity=64 time=10",
+        "MetaMessage('end_of_track', time=0)",
+    ]
+    actual = [str(m) if not m.is_meta else repr(m) for m in repaired.tracks[0].toMidiTrack()]
+    assert actual == expected, f"Unexpected repaired track {actual}"
+    print("repairTrack passed")
+
+def test_repairedNames():
+    print("///////////////////////////////////////////////")
+    print("Testing repaired file names...")
+    writeCorpus()
+    data = BROKEN_FILES["hangingNotes.mid"][0]
+    paths = [CORPUS_DIR / "a" / "broken.mid", CORPUS_DIR / "b" / "broken.mid"]
+    for path in paths:
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    try:
+        validation.validateFiles(paths, str(REPAIR_DIR), maxWorkers=1)
+        assert False, "Expected same-named files to need a rootDir"
+    except ValueError as e:
+        print(e)
+    reports = validation.validateFiles(paths, str(REPAIR_DIR), maxWorkers=1, rootDir=str(CORPUS_DIR))
+    repairedPaths = [r["repairedPath"] for r in reports]
+    assert repairedPaths == [f"{REPAIR_DIR}/a__broken.mid", f"{REPAIR_DIR}/b__broken.mid"], f"Unexpected repaired paths {repairedPaths}"
+    assert all(os.path.exists(p) for p in repairedPaths), "Expected both repaired copies to be written"
+    print("repaired file names passed")
+
+if __name__ == "__main__":
+    test_validateDirectory()
+    test_repairTrack()
+    test_repairedNames()
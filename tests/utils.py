@@ -4,7 +4,7 @@ import midiUtils.synth as synth
 
 def clearOutputDir(outputDir):
     for f in os.listdir(outputDir):
-        if not os.path.isdir(f"{outputDir}/{f}"):
+        if not os.path.isdir(f"{outputDir}/{f}") and f != ".gitkeep":
             os.remove(f"{outputDir}/{f}")
 
     audioDir = f"{outputDir}/audio"